@@ -0,0 +1,325 @@
+import time
+import numpy as np
+import pandas as pd
+
+
+spread_columns = [
+    'symbol', 'timestamp', 'id', 'buy_price', 'best_bid',
+    'buy_from', 'sell_to', 'sell_price', 'price_diff', 'diff_ratio',
+]
+
+
+def calc_best_spread(df):
+    """ For each (symbol, timestamp), find the exchange with the highest bid
+        (sell_to) and the one with the lowest ask (buy_from), and keep the
+        ticks where the spread between them is positive.
+
+        Same result as `calc_sell_to` followed by `calc_highest_diff` in
+        check_price_diff, computed on a dense tick x exchange matrix with
+        NumPy reductions instead of groupby/merge. `best_bid` and `id` are
+        the ones of the buy_from row.
+    """
+    if df.empty:
+        return pd.DataFrame(columns=spread_columns)
+    start = time.time()
+
+    symbol_codes, symbol_names = pd.factorize(df['symbol'])
+    exchange_codes, exchange_names = pd.factorize(df['exchange'])
+    timestamp_codes, timestamps = pd.factorize(df['timestamp'])
+    # Plain object arrays, even when the input columns are categorical
+    symbol_names, exchange_names = np.asarray(symbol_names), np.asarray(exchange_names)
+
+    # Number the ticks, i.e. the distinct (symbol, timestamp) pairs
+    tick_keys = symbol_codes * len(timestamps) + timestamp_codes
+    del timestamp_codes
+    ticks, tick_keys = pd.factorize(tick_keys)
+    n_ticks = len(tick_keys)
+    n_exchanges = len(exchange_names)
+
+    # One slot per exchange in each tick, so the reductions below are plain
+    # argmin/argmax along rows. If an exchange appears twice, the last row wins.
+    asks = np.full((n_ticks, n_exchanges), np.inf)
+    bids = np.full((n_ticks, n_exchanges), -np.inf)
+    row_of = np.full((n_ticks, n_exchanges), -1, dtype=np.int64)
+    asks[ticks, exchange_codes] = df['best_ask'].to_numpy(dtype=np.float64)
+    bids[ticks, exchange_codes] = df['best_bid'].to_numpy(dtype=np.float64)
+    row_of[ticks, exchange_codes] = np.arange(len(df))
+    del ticks, symbol_codes, exchange_codes
+
+    tick_range = np.arange(n_ticks)
+    buy_ex = asks.argmin(axis=1)
+    sell_ex = bids.argmax(axis=1)
+    buy_price = asks[tick_range, buy_ex]
+    sell_price = bids[tick_range, sell_ex]
+    price_diff = sell_price - buy_price
+
+    keep = price_diff > 0
+    buy_rows = row_of[tick_range, buy_ex][keep]
+    tick_keys = tick_keys[keep]
+
+    res = pd.DataFrame({
+        'symbol': symbol_names[tick_keys // len(timestamps)],
+        'timestamp': timestamps[tick_keys % len(timestamps)],
+        'id': df['id'].to_numpy()[buy_rows],
+        'buy_price': buy_price[keep],
+        'best_bid': df['best_bid'].to_numpy()[buy_rows],
+        'buy_from': exchange_names[buy_ex[keep]],
+        'sell_to': exchange_names[sell_ex[keep]],
+        'sell_price': sell_price[keep],
+        'price_diff': price_diff[keep],
+    })
+    res['diff_ratio'] = res['price_diff'] / res['buy_price']
+    res.sort_values(by=['timestamp'], kind='stable', inplace=True, ignore_index=True)
+
+    elsapsed = time.time() - start
+    print(f"Calculate best spread took: {elsapsed:.3f}s")
+    return res
+
+
+def segment_opportunities(df_spread, group_delimiter=60):
+    """ Merge the per-tick rows of `calc_best_spread` into opportunities:
+        consecutive ticks of a symbol belong to the same opportunity unless
+        they are more than `group_delimiter` seconds apart.
+
+        Each opportunity keeps the columns of its first tick, plus:
+            - duration: seconds between its first and last tick
+            - ticks: number of ticks
+            - peak_diff_ratio: highest diff_ratio over its ticks
+            - mean_price_diff: average price_diff over its ticks
+    """
+    df = df_spread.assign(
+        duration=0,
+        ticks=1,
+        peak_diff_ratio=df_spread['diff_ratio'],
+        mean_price_diff=df_spread['price_diff'],
+    )
+    return merge_segments(df, group_delimiter=group_delimiter)
+
+
+def merge_segments(df, group_delimiter=60):
+    """ Merge opportunities of the same symbol that are no more than
+        `group_delimiter` seconds apart, combining their summary columns.
+        A per-tick row is an opportunity with a single tick.
+    """
+    if df.empty:
+        return df.reset_index(drop=True)
+
+    # Work on the sort order only, the frame itself is reordered at the end
+    symbol_codes = pd.factorize(df['symbol'], sort=True)[0]
+    order = np.lexsort((df['timestamp'].to_numpy(), symbol_codes))
+    symbol_codes = symbol_codes[order]
+    timestamps = df['timestamp'].to_numpy()[order]
+    ends = timestamps + df['duration'].to_numpy()[order]
+    ticks = df['ticks'].to_numpy()[order]
+
+    # A new segment starts at each symbol change and after each gap
+    new_segment = np.empty(len(df), dtype=bool)
+    new_segment[0] = True
+    new_segment[1:] = (symbol_codes[1:] != symbol_codes[:-1]) | (timestamps[1:] - ends[:-1] > group_delimiter)
+    starts = np.flatnonzero(new_segment)
+
+    segment_ticks = np.add.reduceat(ticks, starts)
+    price_diff_sums = np.add.reduceat(df['mean_price_diff'].to_numpy()[order] * ticks, starts)
+
+    res = df.iloc[order[starts]].reset_index(drop=True)
+    res['duration'] = np.maximum.reduceat(ends, starts) - timestamps[starts]
+    res['ticks'] = segment_ticks
+    res['peak_diff_ratio'] = np.maximum.reduceat(df['peak_diff_ratio'].to_numpy()[order], starts)
+    res['mean_price_diff'] = price_diff_sums / segment_ticks
+    return res
+
+
+executable_columns = [
+    'symbol', 'timestamp', 'buy_from', 'sell_to', 'buy_price', 'sell_price', 'size',
+    'profit', 'price_diff', 'diff_ratio', 'max_size', 'max_profit',
+]
+
+
+def depth_rows_to_matrices(row_index, is_bid, price, amount, n_rows, levels=10):
+    """ Turn depth rows (one per level, in any order) into per-snapshot
+        ladders: (ask_price, ask_amount, bid_price, bid_amount) of shape
+        (n_rows, levels), best level first. `row_index` is the position of
+        the snapshot of each depth row, -1 to skip it. Missing levels have
+        a NaN price and a zero amount.
+    """
+    keep = row_index >= 0
+    row_index, is_bid, price, amount = row_index[keep], is_bid[keep], price[keep], amount[keep]
+    # Asks by increasing price, bids by decreasing price
+    order = np.lexsort((np.where(is_bid, -price, price), is_bid, row_index))
+    row_index, is_bid, price, amount = row_index[order], is_bid[order], price[order], amount[order]
+
+    # Rank of each level within its (snapshot, side)
+    positions = np.arange(len(order))
+    new_group = np.empty(len(order), dtype=bool)
+    new_group[:1] = True
+    new_group[1:] = (row_index[1:] != row_index[:-1]) | (is_bid[1:] != is_bid[:-1])
+    rank = positions - np.maximum.accumulate(np.where(new_group, positions, 0))
+    keep = rank < levels
+
+    matrices = []
+    for side in (False, True):
+        on_side = keep & (is_bid == side)
+        side_price = np.full((n_rows, levels), np.nan)
+        side_amount = np.zeros((n_rows, levels))
+        side_price[row_index[on_side], rank[on_side]] = price[on_side]
+        side_amount[row_index[on_side], rank[on_side]] = amount[on_side]
+        matrices += [side_price, side_amount]
+    return tuple(matrices)
+
+
+def build_ladders(df, ask_price, ask_amount, bid_price, bid_amount):
+    """ Arrange the per-snapshot ladders of the rows of `df` (symbol,
+        exchange, timestamp) on a dense tick x exchange x level grid, like
+        `calc_best_spread` does with the best prices.
+
+        Returns (symbols, timestamps, exchange_names, ask_price, ask_amount,
+        bid_price, bid_amount), the first two per tick. Exchanges missing
+        from a tick have empty ladders.
+    """
+    symbol_codes, symbol_names = pd.factorize(df['symbol'])
+    exchange_codes, exchange_names = pd.factorize(df['exchange'])
+    timestamp_codes, timestamps = pd.factorize(df['timestamp'])
+    tick_keys = symbol_codes * len(timestamps) + timestamp_codes
+    ticks, tick_keys = pd.factorize(tick_keys)
+    n_ticks, n_exchanges, levels = len(tick_keys), len(exchange_names), ask_price.shape[1]
+
+    grids = []
+    for values, fill in ((ask_price, np.nan), (ask_amount, 0), (bid_price, np.nan), (bid_amount, 0)):
+        grid = np.full((n_ticks, n_exchanges, levels), fill, dtype=np.float64)
+        grid[ticks, exchange_codes] = values
+        grids.append(grid)
+    return (
+        np.asarray(symbol_names)[tick_keys // len(timestamps)],
+        np.asarray(timestamps)[tick_keys % len(timestamps)],
+        np.asarray(exchange_names),
+        *grids,
+    )
+
+
+def _take_level(values, k):
+    """ values[..., k] for an index array `k` broadcast against values[..., 0].
+    """
+    shape = np.broadcast_shapes(values.shape[:-1], k.shape)
+    values = np.broadcast_to(values, shape + values.shape[-1:])
+    k = np.broadcast_to(k, shape)
+    return np.take_along_axis(values, k[..., None], axis=-1)[..., 0]
+
+
+def _cumulate(price, amount):
+    value = np.where(amount > 0, price, 0) * amount
+    return np.cumsum(amount, axis=-1), np.cumsum(value, axis=-1)
+
+
+def walk_quantity(price, amount, cum_amount, cum_value, quantity):
+    """ Value of `quantity` taken from the ladders, level by level. NaN when
+        the ladder is not deep enough. `quantity` is broadcast against the
+        ladders without their level axis.
+    """
+    levels = price.shape[-1]
+    k = (cum_amount < quantity[..., None]).sum(axis=-1)
+    filled = k < levels
+    k_prev = np.maximum(k - 1, 0)
+    k = np.minimum(k, levels - 1)
+    prev_amount = np.where(k_prev < k, _take_level(cum_amount, k_prev), 0)
+    prev_value = np.where(k_prev < k, _take_level(cum_value, k_prev), 0)
+    value = prev_value + (quantity - prev_amount) * _take_level(price, k)
+    return np.where(filled, value, np.nan)
+
+
+def walk_notional(price, amount, cum_amount, cum_value, notional):
+    """ Quantity bought for `notional` (in the quote currency) from the
+        ladders, NaN when they are not deep enough.
+    """
+    levels = price.shape[-1]
+    k = (cum_value < notional).sum(axis=-1)
+    filled = k < levels
+    k_prev = np.maximum(k - 1, 0)
+    k = np.minimum(k, levels - 1)
+    prev_amount = np.where(k_prev < k, _take_level(cum_amount, k_prev), 0)
+    prev_value = np.where(k_prev < k, _take_level(cum_value, k_prev), 0)
+    quantity = prev_amount + (notional - prev_value) / _take_level(price, k)
+    return np.where(filled, quantity, np.nan)
+
+
+def calc_executable_spread(symbols, timestamps, exchange_names, ask_price, ask_amount, bid_price, bid_amount,
+                           notional, chunk_size=5000):
+    """ Walk the books of every buy_from/sell_to pair of each tick, for a
+        trade of `notional` in the quote currency: buy on the asks of
+        buy_from, sell the same quantity on the bids of sell_to.
+
+        The inputs are the output of `build_ladders`. For each tick, the
+        pair with the highest profit is kept when that profit is positive:
+            - buy_price, sell_price: volume-weighted prices of the trade
+            - size: quantity traded, profit: sell value - notional
+            - price_diff, diff_ratio: sell_price - buy_price and
+              profit / notional, so that the result can be passed on to
+              `segment_opportunities` like the one of `calc_best_spread`
+            - max_size: largest quantity that is still profitable, i.e. up
+              to where the two ladders cross, and max_profit at that size
+        Pairs on an exchange too shallow for the notional are skipped.
+
+        Ticks are processed `chunk_size` at a time, which bounds the
+        temporary tick x exchange x exchange x level arrays.
+    """
+    start = time.time()
+    n_ticks, n_exchanges, levels = ask_price.shape
+    frames = []
+    same_exchange = np.eye(n_exchanges, dtype=bool)
+    for lo in range(0, n_ticks, chunk_size):
+        hi = min(lo + chunk_size, n_ticks)
+        ap, aa, bp, ba = ask_price[lo:hi], ask_amount[lo:hi], bid_price[lo:hi], bid_amount[lo:hi]
+        ask_cum_amount, ask_cum_value = _cumulate(ap, aa)
+        bid_cum_amount, bid_cum_value = _cumulate(bp, ba)
+
+        # Buy side per exchange: (tick, buy_from)
+        size = walk_notional(ap, aa, ask_cum_amount, ask_cum_value, notional)
+        # Sell that size on every exchange: (tick, buy_from, sell_to)
+        sell_value = walk_quantity(
+            bp[:, None], ba[:, None], bid_cum_amount[:, None], bid_cum_value[:, None], size[:, :, None])
+        profit = sell_value - notional
+        profit[:, same_exchange] = np.nan
+
+        flat_profit = np.where(np.isnan(profit), -np.inf, profit).reshape(hi - lo, -1)
+        best = flat_profit.argmax(axis=1)
+        keep = flat_profit[np.arange(hi - lo), best] > 0
+        tick_range = np.flatnonzero(keep)
+        best = best[keep]
+        buy_ex, sell_ex = best // n_exchanges, best % n_exchanges
+        if not len(tick_range):
+            continue
+
+        # Only for the kept pairs: profitable up to min(cumulated amounts)
+        # of every pair of levels whose ask price is below the bid price
+        buy_ladder = (ap[tick_range, buy_ex], aa[tick_range, buy_ex],
+                      ask_cum_amount[tick_range, buy_ex], ask_cum_value[tick_range, buy_ex])
+        sell_ladder = (bp[tick_range, sell_ex], ba[tick_range, sell_ex],
+                       bid_cum_amount[tick_range, sell_ex], bid_cum_value[tick_range, sell_ex])
+        with np.errstate(invalid='ignore'):
+            crossing = buy_ladder[0][:, :, None] < sell_ladder[0][:, None, :]
+        max_size = np.where(crossing, np.minimum(buy_ladder[2][:, :, None], sell_ladder[2][:, None, :]), 0).max(axis=(-2, -1))
+        max_profit = walk_quantity(*sell_ladder, max_size) - walk_quantity(*buy_ladder, max_size)
+
+        best_size = size[tick_range, buy_ex]
+        best_sell_price = sell_value[tick_range, buy_ex, sell_ex] / best_size
+        best_buy_price = notional / best_size
+        frames.append(pd.DataFrame({
+            'symbol': symbols[lo:hi][tick_range],
+            'timestamp': timestamps[lo:hi][tick_range],
+            'buy_from': exchange_names[buy_ex],
+            'sell_to': exchange_names[sell_ex],
+            'buy_price': best_buy_price,
+            'sell_price': best_sell_price,
+            'size': best_size,
+            'profit': profit[tick_range, buy_ex, sell_ex],
+            'price_diff': best_sell_price - best_buy_price,
+            'diff_ratio': profit[tick_range, buy_ex, sell_ex] / notional,
+            'max_size': max_size,
+            'max_profit': max_profit,
+        }))
+
+    res = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=executable_columns)
+    res.sort_values(by=['timestamp'], kind='stable', inplace=True, ignore_index=True)
+
+    elsapsed = time.time() - start
+    print(f"Calculate executable spread took: {elsapsed:.3f}s")
+    return res
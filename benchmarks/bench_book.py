@@ -0,0 +1,81 @@
+""" Local book maintenance: level updates near the top of a deep book, with
+    a top-10 snapshot every few updates. Compares a dict of levels, sorted
+    or partially sorted with heapq on each snapshot, and `OrderBook`.
+
+    Run from the repository root:
+        python -m benchmarks.bench_book [updates] [levels] [updates per snapshot]
+"""
+import sys
+import time
+import heapq
+import random
+from orderbook import OrderBook, OrderbookSnapshot
+
+top_n = 10
+
+
+def make_updates(n, levels, seed=0):
+    """(side, price, amount) updates, mostly close to the best levels.
+        A third of them remove a level, the others add or change one.
+    """
+    rnd = random.Random(seed)
+    mid = 5000000
+    updates = []
+    for _ in range(n):
+        side = rnd.choice(('ask', 'bid'))
+        distance = min(int(rnd.expovariate(1 / 20)), levels - 1)
+        price = float(mid + 1 + distance if side == 'ask' else mid - 1 - distance)
+        amount = 0 if rnd.random() < 1 / 3 else round(rnd.uniform(0.001, 2), 4)
+        updates.append((side, price, amount))
+    initial = [(float(mid + 1 + i), 1.0) for i in range(levels)], [(float(mid - 1 - i), 1.0) for i in range(levels)]
+    return initial, updates
+
+
+def run_dict(initial, updates, every, select):
+    book = {'ask': dict(initial[0]), 'bid': dict(initial[1])}
+    for i, (side, price, amount) in enumerate(updates):
+        if amount:
+            book[side][price] = amount
+        else:
+            book[side].pop(price, None)
+        if i % every == 0:
+            asks, bids = select(book)
+            OrderbookSnapshot.from_levels(asks, bids)
+
+
+def select_sorted(book):
+    return sorted(book['ask'].items())[:top_n], sorted(book['bid'].items(), reverse=True)[:top_n]
+
+
+def select_heapq(book):
+    return heapq.nsmallest(top_n, book['ask'].items()), heapq.nlargest(top_n, book['bid'].items())
+
+
+def run_orderbook(initial, updates, every):
+    book = OrderBook.from_levels(*initial)
+    for i, (side, price, amount) in enumerate(updates):
+        book.update(side, price, amount)
+        if i % every == 0:
+            book.snapshot(top_n)
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    levels = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    every = int(sys.argv[3]) if len(sys.argv) > 3 else 20
+    initial, updates = make_updates(n, levels)
+    cases = {
+        'dict + sorted': lambda: run_dict(initial, updates, every, select_sorted),
+        'dict + heapq': lambda: run_dict(initial, updates, every, select_heapq),
+        'OrderBook': lambda: run_orderbook(initial, updates, every),
+    }
+    print(f"{n} updates on {levels} levels per side, top-{top_n} snapshot every {every} updates")
+    for name, run in cases.items():
+        start = time.perf_counter()
+        run()
+        elapsed = time.perf_counter() - start
+        print(f"{name:15s}: {elapsed * 1000:8.1f}ms, {elapsed / n * 1e6:6.2f}us per update")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+""" Requests sent to a hanging endpoint, which accepts connections and never
+    answers, by several symbols of one exchange polled every second: with
+    the circuit breakers, and with breakers that never open. Also checks
+    that a half-open breaker lets a single probe through.
+
+    Run from the repository root:
+        python -m benchmarks.bench_breaker [seconds] [symbols]
+"""
+import sys
+import asyncio
+import aiohttp
+from breaker import CircuitBreaker
+from exchanges import ParseLayerBase
+from scheduler import PollScheduler
+
+never_open = {'consecutive_failures': 10 ** 9, 'min_calls': 10 ** 9}
+
+
+def make_exchange_class(port, breakers):
+    class Hanging(ParseLayerBase):
+        name = 'hanging'
+        url = 'http://127.0.0.1:{}/{{0}}'.format(port)
+        interval = 1
+        breaker_config = {} if breakers else never_open
+        host_breaker_config = dict(ParseLayerBase.host_breaker_config) if breakers else never_open
+        host_breakers = {}
+    return Hanging
+
+
+async def run(seconds, n_symbols, breakers):
+    connections = []
+
+    async def hang(reader, writer):
+        connections.append(writer)
+        await reader.read()
+        writer.close()
+
+    server = await asyncio.start_server(hang, '127.0.0.1', 0)
+    port = server.sockets[0].getsockname()[1]
+    e_class = make_exchange_class(port, breakers)
+    exchanges = [e_class('sym{}'.format(i)) for i in range(n_symbols)]
+    async with aiohttp.ClientSession() as session:
+        scheduler = PollScheduler(exchanges, session=session, on_record=None)
+        try:
+            await asyncio.wait_for(scheduler.run(), seconds)
+        except asyncio.TimeoutError:
+            pass
+    server.close()
+    for writer in connections:
+        writer.close()
+    return len(connections), scheduler, exchanges
+
+
+def check_single_probe():
+    breaker = CircuitBreaker(name='probe', consecutive_failures=1, jitter=0)
+    breaker.record_failure(now=0)
+    assert not breaker.allow(now=1)
+    after_backoff = breaker.base_backoff + 1
+    allowed = [breaker.allow(now=after_backoff) for _ in range(5)]
+    assert allowed == [True, False, False, False, False], allowed
+    breaker.record_failure(now=after_backoff)
+    assert breaker.state == breaker.OPEN
+    # A probe that never reports is given up after probe_timeout
+    later = after_backoff + breaker.max_backoff * 2
+    assert breaker.allow(now=later) and not breaker.allow(now=later + 1)
+    assert breaker.allow(now=later + breaker.probe_timeout)
+    breaker.record_success(now=later + breaker.probe_timeout)
+    assert breaker.state == breaker.CLOSED
+
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 12
+    n_symbols = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    check_single_probe()
+
+    results = {}
+    for breakers in (False, True):
+        requests, scheduler, exchanges = asyncio.run(run(seconds, n_symbols, breakers))
+        results[breakers] = requests
+        states = sorted({e.breaker.state for e in exchanges})
+        print(f"{'breakers' if breakers else 'no breakers':12s}: {requests} requests in {seconds:.0f}s "
+              f"for {n_symbols} symbols, {scheduler.dropped_polls} polls cancelled, breaker states {states}")
+        if breakers:
+            assert all(e.breaker.failures_in_row >= e.breaker.consecutive_failures for e in exchanges)
+            assert scheduler.dropped_polls == 0
+    assert results[True] < results[False] / 2, results
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+""" Compare JSON decoding of depth payloads with the stdlib, orjson and the
+    partial top-N decoder, for each exchange class. Each figure includes
+    `parse_orderbook`. Also checks that every decoder reports a body that
+    is not valid UTF-8 as a `json.JSONDecodeError`.
+
+    Run from the repository root:
+        python -m benchmarks.bench_decode [levels]
+"""
+import sys
+import json
+import timeit
+import decoder
+from benchmarks.payloads import exchange_classes, make_raw_payload, wrappers
+
+
+def check_invalid_utf8():
+    raw = b'{"asks": [["5000000", "0.1\xff"]], "bids": [["4999999", "0.2"]]}'
+    decoders = {'partial': lambda: decoder.loads_top_levels(raw, ('asks', 'bids'), 10)}
+    for name in decoder.backends:
+        decoders[name] = lambda name=name: decoder.set_backend(name) and decoder.loads(raw)
+    try:
+        for name, decode in decoders.items():
+            try:
+                decode()
+            except json.JSONDecodeError:
+                continue
+            raise AssertionError("Invalid UTF-8 decoded by {}".format(name))
+    finally:
+        decoder.set_backend()
+
+
+def main():
+    check_invalid_utf8()
+    levels = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    number = 200
+    backends = [name for name in ('json', 'orjson') if name in decoder.backends]
+
+    header = f"{'exchange':12s} {'bytes':>8s}"
+    for name in backends + ['partial']:
+        header += f" {name:>10s}"
+    print(header)
+
+    for e_class in exchange_classes:
+        raw = make_raw_payload(e_class, levels=levels)
+        line = f"{e_class.name:12s} {len(raw):8d}"
+        for name in backends:
+            loads = decoder.backends[name]
+            elapsed = timeit.timeit(lambda: e_class.parse_orderbook(loads(raw)), number=number) / number
+            line += f" {elapsed * 1e6:8.1f}us"
+
+        # The partial decoder relies on the venue returning sorted depth,
+        # which the synthetic payloads always do
+        root = (wrappers[e_class],) if e_class in wrappers else ()
+        keys = (e_class.ask_key, e_class.bid_key)
+        partial = lambda: e_class.parse_orderbook(decoder.loads_top_levels(raw, keys, e_class.top_n, root=root))
+        assert partial()['depth'] == e_class.parse_orderbook(json.loads(raw))['depth']
+        elapsed = timeit.timeit(partial, number=number) / number
+        line += f" {elapsed * 1e6:8.1f}us"
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
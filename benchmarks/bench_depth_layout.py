@@ -0,0 +1,71 @@
+""" Storage size and load time of the depth ladders on SQLite, with one
+    row per level and with one packed blob per snapshot (float64, float32,
+    float32 + zlib).
+
+    Run from the repository root:
+        python -m benchmarks.bench_depth_layout [cycles]
+"""
+import os
+import sys
+import time
+import tempfile
+import numpy as np
+from dbmanager import SqliteManager
+from benchmarks.samples import make_cycle
+
+layouts = {
+    'rows': {'depth_layout': 'rows'},
+    'packed f8': {'depth_layout': 'packed', 'depth_dtype': 'f8'},
+    'packed f4': {'depth_layout': 'packed', 'depth_dtype': 'f4'},
+    'packed f4 zlib': {'depth_layout': 'packed', 'depth_dtype': 'f4', 'depth_compress': True},
+}
+
+
+def load_rows(db):
+    """Ladders of every snapshot as NumPy arrays, from the depth rows.
+    """
+    c = db.conn.cursor()
+    c.execute("SELECT orderbook_id, side, price, amount FROM depth ORDER BY orderbook_id, id;")
+    rows = c.fetchall()
+    ids = np.array([r[0] for r in rows])
+    is_ask = np.array([r[1] == 'ask' for r in rows])
+    values = np.array([(r[2], r[3]) for r in rows])
+    starts = np.flatnonzero(np.r_[True, ids[1:] != ids[:-1]])
+    n = 0
+    for chunk, asks in zip(np.split(values, starts[1:]), np.split(is_ask, starts[1:])):
+        ask, bid = chunk[asks], chunk[~asks]
+        n += len(ask[:, 0]) + len(bid[:, 0])
+    return n
+
+
+def load_packed(db):
+    n = 0
+    for _, _, _, _, ask_price, ask_amount, bid_price, bid_amount in db.iter_packed_depth():
+        n += len(ask_price) + len(bid_price)
+    return n
+
+
+def main():
+    cycles = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    batches = [make_cycle(timestamp=t, levels=20) for t in range(cycles)]
+    with tempfile.TemporaryDirectory() as path:
+        sizes = {}
+        for name, options in layouts.items():
+            file = name.replace(' ', '_') + '.db'
+            with SqliteManager(path=path, file=file, **options) as db:
+                db.create_tables_safe()
+                for records in batches:
+                    db.insert_records(records=records)
+                db.conn.execute("PRAGMA wal_checkpoint(TRUNCATE);")
+                db.conn.execute("VACUUM;")
+                sizes[name] = os.path.getsize(db.file)
+
+                start = time.perf_counter()
+                n_levels = load_rows(db) if options['depth_layout'] == 'rows' else load_packed(db)
+                elapsed = time.perf_counter() - start
+            print(f"{name:15s}: {sizes[name] / 2 ** 20:7.2f}MB ({sizes['rows'] / sizes[name]:4.1f}x smaller), "
+                  f"load {elapsed * 1000:8.1f}ms for {n_levels} levels")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,31 @@
+""" Cost per record of the online `SpreadDetector`, fed with polling
+    cycles of every exchange for every symbol.
+
+    Run from the repository root:
+        python -m benchmarks.bench_detector [cycles]
+"""
+import sys
+import time
+from detector import SpreadDetector
+from benchmarks.samples import make_cycle
+
+
+def main():
+    cycles = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    batches = [make_cycle(timestamp=t * 2, levels=1) for t in range(cycles)]
+    events = []
+    detector = SpreadDetector(on_opportunity=lambda event, opportunity: events.append(event), minimun_earn_rate=0.001)
+
+    n_records = sum(len(records) for records in batches)
+    start = time.perf_counter()
+    for records in batches:
+        for record in records:
+            detector.add(record)
+    detector.flush()
+    elapsed = time.perf_counter() - start
+    print(f"{n_records} records in {elapsed * 1000:.1f}ms, {elapsed / n_records * 1e6:.2f}us per record, "
+          f"{elapsed / cycles * 1000:.3f}ms per cycle, {events.count('open')} opportunities")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,43 @@
+""" Throughput of the walk-the-book engine `arbitrage.calc_executable_spread`
+    on synthetic 10-level ladders of every exchange for every symbol.
+
+    Run from the repository root:
+        python -m benchmarks.bench_executable [snapshots] [notional]
+"""
+import sys
+import time
+import numpy as np
+from arbitrage import calc_executable_spread
+from benchmarks.samples import exchange_names, symbols
+
+
+def make_ladders(n_snapshots, levels=10, seed=0):
+    """ Dense (tick, exchange, level) ladders as returned by `build_ladders`.
+    """
+    rng = np.random.default_rng(seed)
+    n_exchanges = len(exchange_names)
+    n_ticks = -(-n_snapshots // n_exchanges)
+    mid = 1000 * (1 + 0.0003 * rng.standard_normal((n_ticks, n_exchanges, 1)))
+    steps = np.cumsum(rng.uniform(0.05, 0.5, (n_ticks, n_exchanges, levels)), axis=-1)
+    ask_price = mid + steps
+    bid_price = mid - steps
+    ask_amount = rng.uniform(0.01, 2, (n_ticks, n_exchanges, levels))
+    bid_amount = rng.uniform(0.01, 2, (n_ticks, n_exchanges, levels))
+    tick_symbols = np.array(symbols)[np.arange(n_ticks) % len(symbols)]
+    timestamps = np.arange(n_ticks) // len(symbols) * 2
+    return tick_symbols, timestamps, np.array(exchange_names), ask_price, ask_amount, bid_price, bid_amount
+
+
+def main():
+    n_snapshots = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    notional = float(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    ladders = make_ladders(n_snapshots)
+    start = time.perf_counter()
+    res = calc_executable_spread(*ladders, notional=notional)
+    elapsed = time.perf_counter() - start
+    print(f"{n_snapshots} snapshots ({len(ladders[0])} ticks x {len(exchange_names)} exchanges x 10 levels): "
+          f"{elapsed:.2f}s, {elapsed / n_snapshots * 1e6:.2f}us per snapshot, {len(res)} profitable ticks")
+
+
+if __name__ == '__main__':
+    main()
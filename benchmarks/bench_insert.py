@@ -0,0 +1,47 @@
+""" Compare the per-row and bulk ingestion paths of `insert_records` on SQLite,
+    with the rollback journal (synchronous=FULL) and with the WAL mode.
+
+    Run from the repository root:
+        python -m benchmarks.bench_insert [cycles]
+"""
+import sys
+import time
+import tempfile
+from dbmanager import SqliteManager
+from benchmarks.samples import make_cycle
+
+
+def run(bulk_insert, cycles, wal=True):
+    batches = [make_cycle(timestamp=t) for t in range(cycles)]
+    with tempfile.TemporaryDirectory() as path:
+        with SqliteManager(path=path, bulk_insert=bulk_insert, wal=wal) as db:
+            db.create_tables_safe()
+            start = time.time()
+            for records in batches:
+                db.insert_records(records=records)
+            elapsed = time.time() - start
+
+            c = db.conn.cursor()
+            c.execute("SELECT COUNT(*) FROM orderbook;")
+            n_orderbook = c.fetchone()[0]
+            c.execute("SELECT COUNT(*) FROM depth;")
+            n_depth = c.fetchone()[0]
+    return elapsed, n_orderbook, n_depth
+
+
+def main():
+    cycles = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    results = {}
+    for journal, wal in (('rollback', False), ('wal', True)):
+        for name, bulk_insert in (('per-row', False), ('bulk', True)):
+            elapsed, n_orderbook, n_depth = run(bulk_insert, cycles, wal=wal)
+            results[journal, name] = elapsed
+            print(f"{journal:8s} {name:8s}: {elapsed:.3f}s for {cycles} cycles "
+                  f"({n_orderbook} orderbook rows, {n_depth} depth rows), "
+                  f"{elapsed / cycles * 1000:.2f}ms per cycle")
+    print(f"Speedup, bulk + wal vs per-row + rollback: "
+          f"{results['rollback', 'per-row'] / results['wal', 'bulk']:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
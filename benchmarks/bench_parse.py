@@ -0,0 +1,45 @@
+""" Compare the heap/sorted selection in `ParseLayerBase.parse_orderbook`
+    with the previous full-sort implementation, for each exchange class.
+
+    Run from the repository root:
+        python -m benchmarks.bench_parse [levels]
+"""
+import sys
+import random
+import timeit
+from benchmarks.payloads import exchange_classes, make_payload
+
+
+def legacy_parse_orderbook(cls, data):
+    """The previous implementation: parse every level, sort, then slice.
+    """
+    data = cls.preprocess_data(data)
+    asks = [{'price': r[cls.price_pos], 'amount': r[cls.amount_pos]} for r in data[cls.ask_key]]
+    bids = [{'price': r[cls.price_pos], 'amount': r[cls.amount_pos]} for r in data[cls.bid_key]]
+    sorted_asks = sorted(asks, key=lambda x: x['price'])[:cls.top_n]
+    sorted_bids = sorted(bids, key=lambda x: x['price'], reverse=True)[:cls.top_n]
+    return float(sorted_asks[0]['price']), float(sorted_bids[0]['price'])
+
+
+def shuffle_depth(e_class, data):
+    book = e_class.preprocess_data(data)
+    for key in (e_class.ask_key, e_class.bid_key):
+        random.Random(0).shuffle(book[key])
+
+
+def main():
+    levels = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    number = 200
+    print(f"{'exchange':12s} {'order':9s} {'legacy':>10s} {'current':>10s} {'speedup':>8s}")
+    for e_class in exchange_classes:
+        for order in ('sorted', 'shuffled'):
+            data = make_payload(e_class, levels=levels)
+            if order == 'shuffled':
+                shuffle_depth(e_class, data)
+            legacy = timeit.timeit(lambda: legacy_parse_orderbook(e_class, data), number=number) / number
+            current = timeit.timeit(lambda: e_class.parse_orderbook(data), number=number) / number
+            print(f"{e_class.name:12s} {order:9s} {legacy * 1e6:8.1f}us {current * 1e6:8.1f}us {legacy / current:7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
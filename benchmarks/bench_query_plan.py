@@ -0,0 +1,90 @@
+""" Query plans and timings of the date-range and depth-join queries on
+    SQLite, for the plain schema without indexes (as created before), the
+    same database after `create_tables_safe` added the indexes, and the
+    normalized schema.
+
+    Run from the repository root:
+        python -m benchmarks.bench_query_plan [cycles]
+"""
+import os
+import sys
+import time
+import sqlite3
+import tempfile
+from dbmanager import SqliteManager
+from benchmarks.samples import make_cycle, symbols
+
+queries = {
+    'range': "SELECT * FROM {source} WHERE timestamp>={start} and timestamp<={end};",
+    'symbol range': "SELECT * FROM {source} WHERE symbol='{symbol}' and timestamp>={start} and timestamp<={end};",
+    'depth join': '''SELECT o.id, d.side, d.price, d.amount FROM {source} o JOIN depth d ON d.orderbook_id = o.id
+        WHERE o.timestamp>={start} and o.timestamp<={end};''',
+}
+
+
+def fill(db, cycles):
+    for t in range(cycles):
+        db.insert_records(records=make_cycle(timestamp=t * 2, levels=5))
+
+
+def describe(db):
+    """File size, and size of the orderbook table with its indexes when
+        SQLite is built with the dbstat table.
+    """
+    text = f"{os.path.getsize(db.file) / 2 ** 20:.1f}MB"
+    try:
+        c = db.conn.cursor()
+        c.execute('''SELECT SUM(s.pgsize) FROM dbstat s JOIN sqlite_master m ON m.name = s.name
+            WHERE m.tbl_name = 'orderbook';''')
+        text += f", orderbook with indexes {c.fetchone()[0] / 2 ** 20:.1f}MB"
+    except sqlite3.OperationalError:
+        pass
+    return text
+
+
+def run_queries(db, cycles, repeat=5):
+    # About 1% of the stored time range
+    params = {'source': db.orderbook_source, 'symbol': symbols[0], 'start': cycles, 'end': cycles + cycles // 50}
+    c = db.conn.cursor()
+    for name, template in queries.items():
+        sql = template.format(**params)
+        c.execute("EXPLAIN QUERY PLAN " + sql)
+        plan = "; ".join(row[-1] for row in c.fetchall())
+
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            c.execute(sql)
+            n_rows = len(c.fetchall())
+            timings.append(time.perf_counter() - start)
+        print(f"  {name:13s} {min(timings) * 1000:8.2f}ms {n_rows:7d} rows | {plan}")
+
+
+def main():
+    cycles = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    with tempfile.TemporaryDirectory() as path:
+        with SqliteManager(path=path, file='plain.db') as db:
+            # The previous DDL: tables only
+            c = db.conn.cursor()
+            c.execute(db.sql_create_orderbook)
+            c.execute(db.sql_create_depth)
+            db.conn.commit()
+            fill(db, cycles)
+            print(f"plain, no index ({describe(db)}):")
+            run_queries(db, cycles)
+
+            start = time.perf_counter()
+            db.create_tables_safe()
+            elapsed = time.perf_counter() - start
+            print(f"plain, indexes added in {elapsed:.2f}s ({describe(db)}):")
+            run_queries(db, cycles)
+
+        with SqliteManager(path=path, file='normalized.db', normalized=True) as db:
+            db.create_tables_safe()
+            fill(db, cycles)
+            print(f"normalized, indexes ({describe(db)}):")
+            run_queries(db, cycles)
+
+
+if __name__ == '__main__':
+    main()
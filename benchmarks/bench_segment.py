@@ -0,0 +1,48 @@
+""" Compare the previous nested groupby/apply opportunity merger with
+    `arbitrage.segment_opportunities`, on the per-tick spreads of synthetic
+    orderbook rows.
+
+    Run from the repository root:
+        python -m benchmarks.bench_segment [rows]
+"""
+import sys
+import time
+import pandas as pd
+from arbitrage import calc_best_spread, segment_opportunities
+from benchmarks.bench_spread import make_rows
+
+
+def legacy_merge_consecutive(df_highest_diff_in_group, group_delimiter=60):
+    """The previous implementation: one nested groupby per symbol.
+    """
+    return df_highest_diff_in_group.groupby(['symbol'], sort=False).apply(lambda gdf:
+        gdf.groupby(((gdf.timestamp - gdf.timestamp.shift(1)).rename('time_group') > group_delimiter).cumsum())
+        .first()).droplevel([0])
+
+
+def main():
+    n_rows = int(float(sys.argv[1])) if len(sys.argv) > 1 else 10_000_000
+    group_delimiter = 4
+    df_spread = calc_best_spread(make_rows(n_rows))
+    # Only the wider half of the spreads, so opportunities are interrupted often
+    df_spread = df_spread[df_spread['diff_ratio'] > df_spread['diff_ratio'].median()]
+
+    start = time.perf_counter()
+    legacy = legacy_merge_consecutive(df_spread, group_delimiter=group_delimiter)
+    legacy_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    current = segment_opportunities(df_spread, group_delimiter=group_delimiter)
+    current_time = time.perf_counter() - start
+
+    print(f"ticks with a spread: {len(df_spread):,d}, opportunities: {len(current):,d}")
+    print(f"legacy  {legacy_time:8.2f}s")
+    print(f"current {current_time:8.2f}s ({legacy_time / current_time:.1f}x)")
+
+    legacy = legacy.sort_values(by=['symbol', 'timestamp'], ignore_index=True)
+    pd.testing.assert_frame_equal(legacy, current[legacy.columns], check_dtype=False)
+    print("Results match.")
+
+
+if __name__ == '__main__':
+    main()
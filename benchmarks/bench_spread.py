@@ -0,0 +1,76 @@
+""" Compare the pandas groupby/merge path (`calc_sell_to` + `calc_highest_diff`)
+    with the NumPy kernel `arbitrage.calc_best_spread` on synthetic orderbook
+    rows: wall time and peak memory allocated during the call.
+
+    Run from the repository root:
+        python -m benchmarks.bench_spread [rows]
+"""
+import sys
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+from arbitrage import calc_best_spread
+from check_price_diff import calc_sell_to, calc_highest_diff
+from benchmarks.samples import exchange_names, symbols
+
+
+def make_rows(n_rows, seed=0):
+    """One row per (tick, symbol, exchange), as loaded from the orderbook table.
+    """
+    rng = np.random.default_rng(seed)
+    per_tick = len(symbols) * len(exchange_names)
+    n_ticks = -(-n_rows // per_tick)
+    tick = np.repeat(np.arange(n_ticks), per_tick)[:n_rows]
+    symbol = np.tile(np.repeat(np.arange(len(symbols)), len(exchange_names)), n_ticks)[:n_rows]
+    exchange = np.tile(np.arange(len(exchange_names)), n_ticks * len(symbols))[:n_rows]
+
+    mid = 1000 * (1 + symbol) * (1 + 0.0003 * rng.standard_normal(n_rows))
+    half_spread = mid * 0.0005 * rng.random(n_rows)
+    return pd.DataFrame({
+        'id': np.arange(1, n_rows + 1),
+        'symbol': np.array(symbols, dtype=object)[symbol],
+        'best_ask': mid + half_spread,
+        'best_bid': mid - half_spread,
+        'timestamp': 1600000000 + 2 * tick,
+        'exchange': np.array(exchange_names, dtype=object)[exchange],
+    })
+
+
+def measure(func, df):
+    tracemalloc.start()
+    start = time.perf_counter()
+    res = func(df)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return res, elapsed, peak
+
+
+def pandas_path(df):
+    return calc_highest_diff(calc_sell_to(df))
+
+
+def main():
+    n_rows = int(float(sys.argv[1])) if len(sys.argv) > 1 else 10_000_000
+    df = make_rows(n_rows)
+    print(f"rows: {len(df):,d}, ticks: {df[['symbol', 'timestamp']].drop_duplicates().shape[0]:,d}, "
+          f"exchanges: {len(exchange_names)}")
+
+    print(f"{'path':8s} {'time':>9s} {'peak mem':>10s} {'results':>10s}")
+    results = {}
+    for name, func in (('pandas', pandas_path), ('numpy', calc_best_spread)):
+        res, elapsed, peak = measure(func, df)
+        results[name] = res
+        print(f"{name:8s} {elapsed:8.2f}s {peak / 2 ** 20:8.0f}MB {len(res):10,d}")
+
+    keys = ['symbol', 'timestamp']
+    pd.testing.assert_frame_equal(
+        results['pandas'].sort_values(keys, ignore_index=True),
+        results['numpy'].sort_values(keys, ignore_index=True),
+        check_dtype=False)
+    print("Results match.")
+
+
+if __name__ == '__main__':
+    main()
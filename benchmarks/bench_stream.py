@@ -0,0 +1,301 @@
+""" Streaming ingestion against a local WebSocket stand-in server replaying
+    depth messages: update rate of the local book, and bytes received per
+    update compared to one REST poll. Fails when the local book does not
+    end up equal to the one that was streamed.
+
+    By default, messages of bitbank, bitFlyer and Coincheck are generated:
+    diffs, some received before the first snapshot (see the make_*_frames
+    functions). Messages can also be captured from one of these exchanges
+    and replayed later, along with the REST snapshot when it needs one.
+
+    Run from the repository root:
+        python -m benchmarks.bench_stream [diffs]
+        python -m benchmarks.bench_stream --capture EXCHANGE SYMBOL SECONDS FILE
+        python -m benchmarks.bench_stream --replay FILE
+"""
+import sys
+import json
+import time
+import random
+import asyncio
+import aiohttp
+from aiohttp import web
+from streaming import streaming_exchanges
+
+
+class RandomBook:
+    """Book of integer prices around `mid`, changed at random by `diff`.
+    """
+    def __init__(self, rnd, levels=200, mid=5000000):
+        self.rnd = rnd
+        self.levels = levels
+        self.mid = mid
+        self.book = {
+            'ask': {mid + 1 + i: round(rnd.uniform(0.001, 2), 4) for i in range(levels)},
+            'bid': {mid - 1 - i: round(rnd.uniform(0.001, 2), 4) for i in range(levels)},
+        }
+
+    def diff(self):
+        """Change a few levels, and return the changes as {side: [(price, amount)]}.
+        """
+        rnd = self.rnd
+        changes = {'ask': [], 'bid': []}
+        for _ in range(rnd.randint(1, 4)):
+            side = rnd.choice(('ask', 'bid'))
+            distance = rnd.randrange(self.levels + 20)
+            price = self.mid + 1 + distance if side == 'ask' else self.mid - 1 - distance
+            amount = 0 if rnd.random() < 0.3 else round(rnd.uniform(0.001, 2), 4)
+            if amount:
+                self.book[side][price] = amount
+            else:
+                self.book[side].pop(price, None)
+            changes[side].append((price, amount))
+        return changes
+
+    def sorted_levels(self, side):
+        return sorted(self.book[side].items(), reverse=side == 'bid')
+
+
+def make_bitbank_frames(n_diffs, symbol='btc_jpy', n_early=50, seed=0):
+    """Socket.IO frames of bitbank: the handshake, `n_early` diffs, a
+        depth_whole taken before the last 10 of them, then the other diffs.
+        Return the frames, no REST snapshot, and the final book.
+    """
+    book = RandomBook(random.Random(seed))
+    sequence = 1000
+
+    def diff():
+        nonlocal sequence
+        sequence += book.rnd.randint(1, 3)
+        changes = book.diff()
+        data = {
+            'a': [[str(p), str(a)] for p, a in changes['ask']],
+            'b': [[str(p), str(a)] for p, a in changes['bid']],
+            't': 0, 's': str(sequence),
+        }
+        return '42' + json.dumps(['message', {'room_name': 'depth_diff_' + symbol, 'message': {'data': data}}])
+
+    def whole():
+        data = {
+            'asks': [[str(p), str(a)] for p, a in book.sorted_levels('ask')],
+            'bids': [[str(p), str(a)] for p, a in book.sorted_levels('bid')],
+            'timestamp': 0, 'sequenceId': str(sequence),
+        }
+        return '42' + json.dumps(['message', {'room_name': 'depth_whole_' + symbol, 'message': {'data': data}}])
+
+    frames = ['0{"sid":"replay","upgrades":[],"pingInterval":25000,"pingTimeout":20000}', '40{"sid":"replay"}']
+    early = [diff() for _ in range(n_early - 10)]
+    snapshot = whole()
+    early += [diff() for _ in range(10)]
+    frames += early + [snapshot]
+    for i in range(n_diffs - n_early):
+        if i % 1000 == 0:
+            frames.append('2')
+        frames.append(diff())
+    return frames, None, book.book
+
+
+def make_bitflyer_frames(n_diffs, symbol='BTC_JPY', n_early=50, seed=0):
+    """JSON-RPC frames of bitFlyer: the subscription results, `n_early`
+        diffs, a snapshot including them, then the other diffs.
+        Return the frames, no REST snapshot, and the final book.
+    """
+    book = RandomBook(random.Random(seed))
+
+    def message(channel, asks, bids):
+        board = {
+            'mid_price': book.mid,
+            'asks': [{'price': p, 'size': a} for p, a in asks],
+            'bids': [{'price': p, 'size': a} for p, a in bids],
+        }
+        return json.dumps({'jsonrpc': '2.0', 'method': 'channelMessage', 'params': {'channel': channel, 'message': board}})
+
+    def diff():
+        changes = book.diff()
+        return message('lightning_board_' + symbol, changes['ask'], changes['bid'])
+
+    frames = [json.dumps({'jsonrpc': '2.0', 'id': i, 'result': True}) for i in range(2)]
+    frames += [diff() for _ in range(n_early)]
+    frames.append(message('lightning_board_snapshot_' + symbol, book.sorted_levels('ask'), book.sorted_levels('bid')))
+    frames += [diff() for _ in range(n_diffs - n_early)]
+    return frames, None, book.book
+
+
+def make_coincheck_frames(n_diffs, symbol='btc_jpy', n_early=50, seed=0):
+    """Coincheck diffs: `n_early` of them sent while the REST snapshot
+        loads, then the others once it is loaded (the None frame). The
+        snapshot misses a level added by an early diff, as if it was
+        filled without any diff, so replaying the early diffs would bring
+        it back. Return the frames, the REST snapshot, and the final book.
+    """
+    book = RandomBook(random.Random(seed))
+
+    def diff():
+        changes = book.diff()
+        data = {
+            'asks': [[str(p), str(a)] for p, a in changes['ask']],
+            'bids': [[str(p), str(a)] for p, a in changes['bid']],
+            'last_update_at': '0',
+        }
+        return json.dumps([symbol, data])
+
+    frames = [diff() for _ in range(n_early - 1)]
+    filled = book.mid + 1 + book.levels + 100
+    book.book['ask'][filled] = 1.0
+    frames.append(json.dumps([symbol, {'asks': [[str(filled), '1.0']], 'bids': [], 'last_update_at': '0'}]))
+    del book.book['ask'][filled]
+    snapshot = {
+        'asks': [[str(p), str(a)] for p, a in book.sorted_levels('ask')],
+        'bids': [[str(p), str(a)] for p, a in book.sorted_levels('bid')],
+    }
+    frames.append(None)
+    frames += [diff() for _ in range(n_diffs - n_early)]
+    return frames, snapshot, book.book
+
+
+generators = {
+    'bitbank': make_bitbank_frames,
+    'bitflyer': make_bitflyer_frames,
+    'coincheck': make_coincheck_frames,
+}
+
+
+def rest_payload(book):
+    """Size of a REST depth response of bitbank for `book`.
+    """
+    data = {
+        'asks': [[str(p), str(a)] for p, a in sorted(book['ask'].items())],
+        'bids': [[str(p), str(a)] for p, a in sorted(book['bid'].items(), reverse=True)],
+    }
+    return len(json.dumps({'success': 1, 'data': data}))
+
+
+async def serve(frames, snapshot=None, settle=0.05):
+    """Start the stand-in server: every WebSocket connection gets `frames`,
+        and /rest answers `snapshot`. A None frame holds the next ones until
+        the snapshot is served, and the snapshot waits for the frames
+        before it, each time `settle` seconds more so that the client
+        handles them in that order. Return the runner and the base URL.
+    """
+    sent = asyncio.Event()
+    served = asyncio.Event()
+    if None not in frames:
+        sent.set()
+
+    async def stream(request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        for frame in frames:
+            if frame is None:
+                sent.set()
+                await served.wait()
+                await asyncio.sleep(settle)
+            else:
+                await ws.send_str(frame)
+        # Keep the connection open, ignoring the subscriptions
+        async for _ in ws:
+            pass
+        return ws
+
+    async def rest(request):
+        await sent.wait()
+        await asyncio.sleep(settle)
+        served.set()
+        return web.json_response(snapshot)
+
+    app = web.Application()
+    app.router.add_get('/stream', stream)
+    app.router.add_get('/rest', rest)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, 'http://127.0.0.1:{}'.format(port)
+
+
+async def replay(exchange, symbol, frames, snapshot=None):
+    """Stream `frames` from the stand-in server into a streaming exchange
+        until all of them are handled. Return the exchange and the time taken.
+    """
+    runner, base_url = await serve(frames, snapshot)
+    e = streaming_exchanges[exchange](symbol)
+    e.stream_url = base_url + '/stream'
+    e.url = base_url + '/rest'
+    try:
+        async with aiohttp.ClientSession() as session:
+            start = time.perf_counter()
+            await e.get_latest_orderbook(session=session)
+            n_frames = len([frame for frame in frames if frame is not None])
+            while e.messages < n_frames:
+                await asyncio.sleep(0.001)
+            elapsed = time.perf_counter() - start
+            e.task.cancel()
+    finally:
+        await runner.cleanup()
+    return e, elapsed
+
+
+async def capture(exchange, symbol, seconds, path):
+    e = streaming_exchanges[exchange](symbol)
+    frames = []
+    snapshots = []
+    on_message, fetch = e.on_message, e.fetch
+
+    async def record_message(ws, data):
+        frames.append(data)
+        await on_message(ws, data)
+
+    async def record_fetch(session):
+        data = await fetch(session=session)
+        snapshots.append(data)
+        return data
+
+    e.on_message, e.fetch = record_message, record_fetch
+    async with aiohttp.ClientSession() as session:
+        await e.get_latest_orderbook(session=session)
+        await asyncio.sleep(seconds)
+        print(await e.get_latest_orderbook(session=session))
+        e.task.cancel()
+    with open(path, 'w') as f:
+        f.write(json.dumps({'exchange': exchange, 'symbol': symbol, 'snapshot': snapshots[0] if snapshots else None}) + '\n')
+        for frame in frames:
+            f.write(json.dumps(frame) + '\n')
+    print(f"Captured {len(frames)} messages in {path}")
+
+
+def report(e, elapsed, n_frames):
+    print(f"[{e.name}] {n_frames} messages in {elapsed * 1000:.1f}ms, {n_frames / elapsed:.0f} messages/s, "
+          f"{e.bytes_received / n_frames:.0f} bytes per message, {e.resyncs} resyncs")
+    print(e.get_snapshot())
+
+
+def main():
+    args = sys.argv[1:]
+    if args[:1] == ['--capture']:
+        exchange, symbol, seconds, path = args[1:5]
+        asyncio.run(capture(exchange, symbol, float(seconds), path))
+        return
+    if args[:1] == ['--replay']:
+        with open(args[1]) as f:
+            header = json.loads(f.readline())
+            frames = [json.loads(line) for line in f]
+        e, elapsed = asyncio.run(replay(header['exchange'], header['symbol'], frames, header['snapshot']))
+        report(e, elapsed, len(frames))
+        return
+
+    n_diffs = int(args[0]) if args else 100000
+    for exchange, make_frames in generators.items():
+        frames, snapshot, book = make_frames(n_diffs)
+        e, elapsed = asyncio.run(replay(exchange, 'btc_jpy', frames, snapshot))
+        report(e, elapsed, e.messages)
+        assert e.book.asks.amounts == book['ask'] and e.book.bids.amounts == book['bid'], \
+            f"[{exchange}] local book different from the streamed one"
+        assert e.resyncs == 0, e.resyncs
+        payload = rest_payload(book)
+        print(f"Local book equal to the streamed one. "
+              f"One REST poll: {payload} bytes, as much as {payload / (e.bytes_received / e.messages):.0f} messages")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+""" Synthetic depth payloads in the response format of each exchange class.
+"""
+import json
+import random
+from exchanges import (
+    Bitbank, Decurrent, GMOCoin, Bitflyer, Coincheck,
+    BITPoint, Quoine, Zaif, Huobi, BtcBox,
+)
+
+exchange_classes = [
+    Bitbank, Decurrent, GMOCoin, Bitflyer, Coincheck,
+    BITPoint, Quoine, Zaif, Huobi, BtcBox,
+]
+
+# Key the depth lives under, for venues that wrap it
+wrappers = {
+    Bitbank: 'data',
+    GMOCoin: 'data',
+    Huobi: 'tick',
+}
+
+# Venues that send prices and amounts as strings
+string_numbers = {Bitbank, GMOCoin, Coincheck, Quoine, Decurrent, BITPoint}
+
+
+def make_level(e_class, price, amount):
+    if e_class in string_numbers:
+        price, amount = str(price), str(amount)
+    if isinstance(e_class.price_pos, int):
+        level = [None, None]
+    else:
+        level = {}
+    level[e_class.price_pos] = price
+    level[e_class.amount_pos] = amount
+    return level
+
+
+def make_payload(e_class, levels=500, mid=5000000, tick=1, seed=0):
+    """Build a decoded payload with `levels` levels per side,
+        asks ascending and bids descending.
+    """
+    rnd = random.Random(seed)
+    asks = [make_level(e_class, mid + tick * (i + 1), round(rnd.uniform(0.001, 2), 4)) for i in range(levels)]
+    bids = [make_level(e_class, mid - tick * i, round(rnd.uniform(0.001, 2), 4)) for i in range(levels)]
+    data = {e_class.ask_key: asks, e_class.bid_key: bids}
+    if e_class in wrappers:
+        data = {wrappers[e_class]: data}
+    return data
+
+
+def make_raw_payload(e_class, levels=500, **kwargs):
+    return json.dumps(make_payload(e_class, levels=levels, **kwargs)).encode()
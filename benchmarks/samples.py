@@ -0,0 +1,29 @@
+import random
+from orderbook import OrderbookSnapshot
+
+
+exchange_names = [
+    'bitbank', 'decurrent', 'gmocoin', 'bitflyer', 'coincheck',
+    'bitpoint', 'quoine', 'zaif', 'huobi', 'btcbox',
+]
+symbols = ['btc_jpy', 'eth_jpy', 'xrp_jpy', 'ltc_jpy', 'eth_btc', 'mona_jpy', 'xlm_jpy']
+
+
+def make_record(symbol, exchange, timestamp, levels=10, mid=1000.0, seed=None):
+    """Build a snapshot like the ones returned by `ExchangeBase.get_latest_orderbook`.
+    """
+    rnd = random.Random(seed)
+    half_spread = mid * rnd.uniform(0.0005, 0.005)
+    asks = [(mid + half_spread + i, rnd.uniform(0.01, 2)) for i in range(levels)]
+    bids = [(mid - half_spread - i, rnd.uniform(0.01, 2)) for i in range(levels)]
+    return OrderbookSnapshot.from_levels(asks, bids, symbol=symbol, exchange=exchange, timestamp=timestamp)
+
+
+def make_cycle(timestamp, levels=10, seed=0):
+    """One polling cycle: every exchange for every symbol.
+    """
+    rnd = random.Random(seed + timestamp)
+    return [
+        make_record(s, e, timestamp, levels=levels, mid=rnd.uniform(900, 1100), seed=rnd.random())
+        for s in symbols for e in exchange_names
+    ]
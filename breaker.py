@@ -0,0 +1,132 @@
+import time
+import random
+import datetime
+from collections import deque
+from email.utils import parsedate_to_datetime
+
+
+class CircuitBreaker:
+    """Stop calling an endpoint that keeps failing, and probe it again later.
+
+        - closed: calls go through. The breaker opens after
+          `consecutive_failures` failures in a row, or when at least
+          `failure_rate` of the calls in the last `window` seconds failed.
+        - open: calls are refused until the backoff expires. The backoff
+          doubles each time the breaker opens again without a success in
+          between, up to `max_backoff`, with +/- `jitter` randomization.
+          A `retry_after` hint from the server is honored when longer.
+        - half_open: a single probe call goes through, the others are
+          refused. Its success closes the breaker, its failure opens it
+          with a longer backoff. A probe without a result after
+          `probe_timeout` seconds is given up and another one is allowed.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    consecutive_failures = 3
+    failure_rate = 0.5
+    min_calls = 10  # Calls in the window before the failure rate applies
+    window = 300  # In seconds
+    base_backoff = 4  # In seconds
+    max_backoff = 900  # In seconds
+    jitter = 0.2
+    probe_timeout = 60  # In seconds
+
+    def __init__(self, name='', **config) -> None:
+        self.name = name
+        for key, value in config.items():
+            if not hasattr(self, key):
+                raise TypeError("Unknown circuit breaker option: {}".format(key))
+            setattr(self, key, value)
+
+        self.state = self.CLOSED
+        self.open_until = 0
+        self.probe_started = None
+        self.trips = 0
+        self.failures_in_row = 0
+        self.results = deque()
+
+    def ready(self, now=None):
+        """Whether `allow` would let a call through, without taking the probe.
+        """
+        now = time.monotonic() if now is None else now
+        if self.state == self.OPEN:
+            return now >= self.open_until
+        if self.state == self.HALF_OPEN:
+            return now - self.probe_started >= self.probe_timeout
+        return True
+
+    def allow(self, now=None):
+        now = time.monotonic() if now is None else now
+        if not self.ready(now):
+            return False
+        if self.state != self.CLOSED:
+            self.state = self.HALF_OPEN
+            self.probe_started = now
+        return True
+
+    def remaining(self, now=None):
+        now = time.monotonic() if now is None else now
+        return max(0, self.open_until - now)
+
+    def record_success(self, now=None):
+        now = time.monotonic() if now is None else now
+        self.add_result(now, True)
+        self.failures_in_row = 0
+        if self.state != self.CLOSED:
+            self.state = self.CLOSED
+            self.trips = 0
+            self.results.clear()
+
+    def record_failure(self, retry_after=None, now=None):
+        now = time.monotonic() if now is None else now
+        self.add_result(now, False)
+        self.failures_in_row += 1
+        if self.state == self.OPEN:
+            return
+
+        if (self.state == self.HALF_OPEN
+                or retry_after is not None
+                or self.failures_in_row >= self.consecutive_failures
+                or self.failure_rate_exceeded()):
+            self.trip(now, retry_after=retry_after)
+
+    def trip(self, now, retry_after=None):
+        backoff = min(self.max_backoff, self.base_backoff * 2 ** self.trips)
+        backoff *= random.uniform(1 - self.jitter, 1 + self.jitter)
+        if retry_after is not None:
+            backoff = max(backoff, retry_after)
+        self.trips += 1
+        self.state = self.OPEN
+        self.open_until = now + backoff
+
+    def add_result(self, now, ok):
+        self.results.append((now, ok))
+        while self.results and self.results[0][0] < now - self.window:
+            self.results.popleft()
+
+    def failure_rate_exceeded(self):
+        if len(self.results) < self.min_calls:
+            return False
+        failures = sum(1 for _, ok in self.results if not ok)
+        return failures / len(self.results) >= self.failure_rate
+
+
+def parse_retry_after(value):
+    """Seconds to wait from a Retry-After header, given either in seconds
+        or as an HTTP date. Returns None when missing or malformed.
+    """
+    if not value:
+        return None
+    try:
+        return max(0, float(value))
+    except ValueError:
+        pass
+    try:
+        date = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=datetime.timezone.utc)
+    return max(0, (date - datetime.datetime.now(datetime.timezone.utc)).total_seconds())
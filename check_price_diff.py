@@ -2,17 +2,74 @@ import os
 import time
 import datetime
 import pickle
+import numpy as np
 import pandas as pd
+import datastore
+import depthpack
+from arbitrage import calc_best_spread, segment_opportunities, merge_segments, spread_columns
+from arbitrage import depth_rows_to_matrices, build_ladders, calc_executable_spread, executable_columns
+from orderbook import OrderBook
 from version import print_version
 from utils import get_db_manager
 
 pickle_cache_file = 'data/tmp.pkl'
+incremental_state_file = 'data/incremental_state.pkl'
+incremental_state_version = 2
 default_output_dir = 'data/calcs'
 last_db_access_file = 'last_db_access.txt'
 timezone = 'Asia/Tokyo'
+# Rows younger than this (in seconds) may still be waiting in the writer queue,
+# so the incremental mode leaves them for the next run
+settle_delay = 60
+# Rows fetched from the db at a time when streaming
+chunk_size = 100000
+# Streamed rows are converted on the fly. Prices take the `price_dtype` of
+# the db manager: float32 where they are stored in single precision.
+chunk_dtypes = {'id': 'int64', 'timestamp': 'int32', 'best_ask': 'float64', 'best_bid': 'float64'}
+# Depth-aware analysis: seconds of data loaded at a time, and ladder levels used
+depth_window = 6 * 3600
+depth_levels = 10
+
+
+def calc_potential_earn(date_range='auto', exclued_exchange=[], group_delimiter = 60, minimun_earn_rate = 0.005, show_top=20, use_cache=True, notional=None):
+    """ Possible options for date_range: see `load_data`, plus
+            - "incremental": only process the rows stored since the last
+              incremental run, and merge them into the persisted results
+
+        With a `notional` (in the quote currency), the depth ladders are
+        walked to price a trade of that size (see `calc_executable_streaming`)
+        and diff_ratio is the executable profit over the notional. The rows
+        are then always read from the db.
+
+        Without use_cache, the rows are streamed from the db in chunks
+        (see `calc_independents_streaming`) and no cache is written.
+    """
 
-
-def calc_potential_earn(date_range='auto', exclued_exchange=[], group_delimiter = 60, minimun_earn_rate = 0.005, show_top=20, use_cache=True):
+    if notional:
+        if date_range == 'incremental':
+            print("The incremental mode does not read depth, using 'auto' instead.")
+            date_range = 'auto'
+        start_ts, end_ts = get_date_range(date_range)
+        df_independents, first_ts, last_ts = calc_executable_streaming(
+            notional, start_ts=start_ts, end_ts=end_ts, exclued_exchange=exclued_exchange, group_delimiter=group_delimiter)
+        oldest, latest = [datetime.datetime.fromtimestamp(ts) if ts else None for ts in (first_ts, last_ts)]
+        print(f"Time range: {oldest} -- {latest}")
+        return report_opportunities(df_independents, oldest, latest, minimun_earn_rate=minimun_earn_rate, show_top=show_top)
+
+    if date_range == 'incremental':
+        df_independents, oldest, latest = calc_independents_incremental(
+            exclued_exchange=exclued_exchange, group_delimiter=group_delimiter)
+        return report_opportunities(df_independents, oldest, latest, minimun_earn_rate=minimun_earn_rate, show_top=show_top)
+
+    if not use_cache:
+        start_ts, end_ts = get_date_range(date_range)
+        df_independents, first_ts, last_ts = calc_independents_streaming(
+            start_ts=start_ts, end_ts=end_ts, exclued_exchange=exclued_exchange, group_delimiter=group_delimiter)
+        oldest, latest = [datetime.datetime.fromtimestamp(ts) if ts else None for ts in (first_ts, last_ts)]
+        print(f"Time range: {oldest} -- {latest}")
+        if latest:
+            save_latest_date(last_access_date=latest)
+        return report_opportunities(df_independents, oldest, latest, minimun_earn_rate=minimun_earn_rate, show_top=show_top)
 
     df = load_data(date_range=date_range, use_cache=use_cache)
 
@@ -28,14 +85,23 @@ def calc_potential_earn(date_range='auto', exclued_exchange=[], group_delimiter
     print(df.tail(5))
 
     
-    if not sell_to_calculated(df):
+    if sell_to_calculated(df):
+        # Pickle cache written by older versions, with sell_to already joined
+        df_highest_diff_in_group = calc_highest_diff(df)
+    else:
         # Exclude exchange
         if exclued_exchange:
-            df = df[~df['exchange'].isin(exclued_exchange)].copy()
-        df = calc_sell_to(df)
-        # Since this calculation is time-consuming, we cache the data
-        df.to_pickle(pickle_cache_file)
+            df = df[~df['exchange'].isin(exclued_exchange)]
+        df_highest_diff_in_group = calc_best_spread(df)
 
+    df_independents = segment_opportunities(df_highest_diff_in_group, group_delimiter=group_delimiter)
+    return report_opportunities(df_independents, oldest, latest, minimun_earn_rate=minimun_earn_rate, show_top=show_top)
+
+
+def calc_highest_diff(df):
+    """ Keep, for each symbol and timestamp, the buy_from/sell_to pair
+        with the highest positive diff_ratio.
+    """
     # Calculate the price diff and remove those without any potential profit
     df['price_diff'] = df['sell_price'] - df['buy_price']
     # https://stackoverflow.com/a/53954986/1938012
@@ -46,17 +112,10 @@ def calc_potential_earn(date_range='auto', exclued_exchange=[], group_delimiter
     # Keep only one record that has the highest diff_ratio for each symbol
     df_diff_over_0.sort_values(by=['timestamp', 'diff_ratio'], ascending=[True, False], inplace=True)
     df_highest_diff_in_group = df_diff_over_0.groupby(['symbol', 'timestamp'], sort=False).first().reset_index()
+    return df_highest_diff_in_group
 
-    # Merge consecutive rows
-    # https://stackoverflow.com/a/46732998/1938012
-    
-    # If two consecutive records are larger than this time interval (in seconds), 
-    #  they are treated as seperate opportunity
-    df_independents = df_highest_diff_in_group.groupby(['symbol'], sort=False).apply(lambda gdf: 
-        gdf.groupby(((gdf.timestamp  - gdf.timestamp.shift(1)).rename('time_group') > group_delimiter).cumsum())
-        .first()).droplevel([0])
-    # df_independents.sort_values(by='diff_ratio', ascending=False, inplace=True)
 
+def report_opportunities(df_independents, oldest, latest, minimun_earn_rate=0.005, show_top=20):
     df_enough_earn_rate = df_independents[df_independents['diff_ratio'] >= minimun_earn_rate].copy()
     df_enough_earn_rate.sort_values(by=['diff_ratio'], ascending=False, inplace=True)
     
@@ -69,6 +128,293 @@ def calc_potential_earn(date_range='auto', exclued_exchange=[], group_delimiter
     return df_enough_earn_rate
 
 
+def calc_independents_incremental(exclued_exchange=[], group_delimiter=60, state_file=incremental_state_file):
+    """ Process only the rows past the persisted watermark and merge the
+        resulting opportunities into the ones found by previous runs.
+
+        The last opportunity of each symbol stays open: when the new rows
+        continue it, they are merged into it instead of starting a new one.
+        Changing the parameters starts over from the beginning.
+    """
+    params = {'exclued_exchange': sorted(exclued_exchange), 'group_delimiter': group_delimiter}
+    state = load_incremental_state(params, state_file=state_file)
+
+    start_ts = state['watermark'] + 1 if state['watermark'] is not None else None
+    end_ts = int(time.time()) - settle_delay
+    print(f"Incremental window: {start_ts} -- {end_ts}")
+    df_segments, first_ts, last_ts = calc_independents_streaming(
+        start_ts=start_ts, end_ts=end_ts, exclued_exchange=exclued_exchange, group_delimiter=group_delimiter)
+
+    if last_ts is not None:
+        state['first_ts'] = state['first_ts'] or first_ts
+        state['last_ts'] = last_ts
+
+        df_independents = state['independents']
+        if df_independents.empty:
+            state['independents'] = df_segments
+        elif not df_segments.empty:
+            # Independents are sorted by symbol and timestamp, so the open ones come last
+            is_open = ~df_independents.duplicated(subset=['symbol'], keep='last')
+            df_merged = merge_segments(
+                concat_frames([df_independents[is_open], df_segments], ignore_index=True),
+                group_delimiter=group_delimiter)
+            state['independents'] = concat_frames([df_independents[~is_open], df_merged]).sort_values(
+                by=['symbol', 'timestamp'], kind='stable', ignore_index=True)
+
+    state['watermark'] = end_ts
+    save_incremental_state(state, state_file=state_file)
+
+    oldest, latest = [datetime.datetime.fromtimestamp(ts) if ts else None for ts in (state['first_ts'], state['last_ts'])]
+    print(f"Time range: {oldest} -- {latest}")
+    return state['independents'], oldest, latest
+
+
+def calc_independents_streaming(start_ts=None, end_ts=None, exclued_exchange=[], group_delimiter=60):
+    """ Find the opportunities between start_ts and end_ts chunk by chunk,
+        so that memory is bounded by `chunk_size` and by the number of
+        opportunities, not by the number of rows in the range.
+
+        Returns the opportunities and the first and last timestamps read,
+        None when there was no row.
+    """
+    segments = []
+    first_ts = last_ts = None
+    n_rows = 0
+    for df in query_orderbook_chunks(start_ts=start_ts, end_ts=end_ts):
+        n_rows += df.shape[0]
+        # Chunks come in timestamp order
+        if first_ts is None:
+            first_ts = int(df['timestamp'].iat[0])
+        last_ts = int(df['timestamp'].iat[-1])
+
+        if exclued_exchange:
+            df = df[~df['exchange'].isin(exclued_exchange)]
+        segments.append(segment_opportunities(calc_best_spread(df), group_delimiter=group_delimiter))
+
+    print(f"Number of records: {n_rows:d}")
+    # Opportunities running across chunk boundaries are joined here
+    df_segments = concat_frames(segments, empty=empty_opportunities(), ignore_index=True)
+    df_independents = merge_segments(df_segments, group_delimiter=group_delimiter)
+    return df_independents, first_ts, last_ts
+
+
+def calc_executable_streaming(notional, start_ts=None, end_ts=None, exclued_exchange=[], group_delimiter=60,
+                              window=depth_window, levels=depth_levels):
+    """ Find the opportunities that are still profitable for a trade of
+        `notional`, from the depth ladders (see `calc_executable_spread`),
+        `window` seconds of rows at a time.
+
+        Returns the opportunities and the first and last timestamps read,
+        None when there was no row.
+    """
+    segments = []
+    first_ts = last_ts = None
+    n_rows = 0
+    with get_db_manager(read_only=True) as db:
+        # Only walk the windows that can hold rows
+        c = db.conn.cursor()
+        c.execute(f"SELECT MIN(timestamp), MAX(timestamp) FROM {db.orderbook_source};")
+        min_ts, max_ts = c.fetchone()
+        if min_ts is None:
+            return empty_opportunities(executable_columns), None, None
+        start_ts = min_ts if start_ts is None else max(start_ts, min_ts)
+        end_ts = max_ts if end_ts is None else min(end_ts, max_ts)
+        # Unchanged books have no stored ladder, the last one is carried across windows
+        last_blobs = query_last_packed(db, start_ts) if db.depth_layout == 'packed' else None
+        books = {} if db.depth_layout == 'rows' and db.delta_depth else None
+
+        for window_start in range(start_ts, end_ts + 1, window):
+            window_end = min(window_start + window - 1, end_ts)
+            sql = build_orderbook_query(start_ts=window_start, end_ts=window_end, order_by="timestamp", source=db.orderbook_source)
+            df = compact_orderbook_frame(pd.read_sql_query(sql=sql, con=db.conn), db.price_dtype)
+            if df.empty:
+                continue
+            n_rows += df.shape[0]
+            if first_ts is None:
+                first_ts = int(df['timestamp'].iat[0])
+            last_ts = int(df['timestamp'].iat[-1])
+
+            if exclued_exchange:
+                df = df[~df['exchange'].isin(exclued_exchange)].reset_index(drop=True)
+            matrices = query_depth_matrices(db, df, window_start, window_end, levels=levels, last_blobs=last_blobs, books=books)
+            ladders = build_ladders(df, *matrices)
+            segments.append(segment_opportunities(calc_executable_spread(*ladders, notional=notional), group_delimiter=group_delimiter))
+
+    print(f"Number of records: {n_rows:d}")
+    df_segments = concat_frames(segments, empty=empty_opportunities(executable_columns), ignore_index=True)
+    df_independents = merge_segments(df_segments, group_delimiter=group_delimiter)
+    return df_independents, first_ts, last_ts
+
+
+def query_depth_matrices(db, df, start_ts, end_ts, levels=depth_levels, last_blobs=None, books=None):
+    """ Ladders of the orderbook rows of `df`, read between two timestamps,
+        as matrices of shape (len(df), levels) (see `depth_rows_to_matrices`).
+
+        In the packed layout, unchanged books (written with delta_depth)
+        have no stored ladder, whatever the current setting, and take the
+        one of the previous row of the same (symbol, exchange). Before the first stored ladder of the
+        window, that is the blob of `last_blobs` (see `query_last_packed`),
+        which is then updated with the last blob of each book in the window.
+
+        Depth rows stored as deltas are replayed on the `OrderBook` of each
+        (symbol, exchange) in `books` (see `replay_depth_matrices`).
+    """
+    row_of = pd.Index(df['id'].to_numpy())
+    source = db.orderbook_source
+    if db.depth_layout == 'rows' and db.delta_depth:
+        return replay_depth_matrices(db, df, start_ts, end_ts, levels=levels, books={} if books is None else books)
+    if db.depth_layout == 'rows':
+        sql = f'''SELECT d.orderbook_id, d.side, d.price, d.amount FROM depth d JOIN {source} o ON o.id = d.orderbook_id
+            WHERE o.timestamp>={start_ts} and o.timestamp<={end_ts};'''
+        df_depth = pd.read_sql_query(sql=sql, con=db.conn)
+        return depth_rows_to_matrices(
+            row_of.get_indexer(df_depth['orderbook_id']),
+            (df_depth['side'].str.strip() == 'bid').to_numpy(),
+            df_depth['price'].to_numpy(dtype=np.float64),
+            df_depth['amount'].to_numpy(dtype=np.float64),
+            len(df), levels=levels,
+        )
+
+    c = db.conn.cursor()
+    c.execute(f'''SELECT p.orderbook_id, p.ladders FROM depth_packed p JOIN {source} o ON o.id = p.orderbook_id
+        WHERE o.timestamp>={start_ts} and o.timestamp<={end_ts};''')
+    rows = c.fetchall()
+    positions = row_of.get_indexer([r[0] for r in rows])
+    blobs = [r[1] for r in rows]
+
+    # Row of `df` -> row of `packed`, -1 when there is none
+    source_row = np.full(len(df), -1)
+    source_row[positions[positions >= 0]] = np.flatnonzero(positions >= 0)
+    # Rows without a ladder are unchanged books (written with delta_depth), whatever the current setting
+    groups = [df['symbol'], df['exchange']]
+    keys = list(zip(df['symbol'].astype(str), df['exchange'].astype(str)))
+    if last_blobs:
+        # Books not stored at their first row in the window start from their last blob
+        for i in np.flatnonzero(~df.duplicated(subset=['symbol', 'exchange']).to_numpy() & (source_row < 0)):
+            if keys[i] in last_blobs:
+                source_row[i] = len(blobs)
+                blobs.append(last_blobs[keys[i]])
+    # df is in timestamp order
+    filled = pd.Series(np.where(source_row >= 0, source_row, np.nan))
+    source_row = filled.groupby(groups, observed=True).ffill().fillna(-1).to_numpy(dtype=np.int64)
+    if last_blobs is not None:
+        for i in np.flatnonzero(~df.duplicated(subset=['symbol', 'exchange'], keep='last').to_numpy() & (source_row >= 0)):
+            last_blobs[keys[i]] = blobs[source_row[i]]
+    packed = depthpack.unpack_many(blobs, levels=levels)
+
+    matrices = []
+    for values, fill in zip(packed, (np.nan, 0, np.nan, 0)):
+        matrix = np.full((len(df), levels), fill, dtype=np.float64)
+        matrix[source_row >= 0] = values[source_row[source_row >= 0]]
+        matrices.append(matrix)
+    return tuple(matrices)
+
+
+def replay_depth_matrices(db, df, start_ts, end_ts, levels=depth_levels, books=None):
+    """ Ladders of the orderbook rows of `df` from depth rows stored as
+        deltas, as `query_depth_matrices` returns them.
+
+        A row with depth rows outside of `depth_delta` holds a full ladder
+        and resets the book, a delta only changes its levels (a NULL amount
+        removing one) and a row without depth rows is unchanged, like
+        `load_depth` replays them. Books missing from `books` start from
+        their stored state before `start_ts`; `books` is left with the
+        books at the end of the window.
+    """
+    if books is None:
+        books = {}
+    source = db.orderbook_source
+    c = db.conn.cursor()
+    c.execute(f'''SELECT d.orderbook_id, d.side, d.price, d.amount, m.orderbook_id FROM depth d JOIN {source} o ON o.id = d.orderbook_id
+        LEFT JOIN depth_delta m ON m.orderbook_id = d.orderbook_id
+        WHERE o.timestamp>={start_ts} and o.timestamp<={end_ts} ORDER BY d.orderbook_id;''')
+    # orderbook_id -> (is_delta, [(side, price, amount)])
+    changes = {}
+    for orderbook_id, side, price, amount, delta_id in c.fetchall():
+        changes.setdefault(orderbook_id, (delta_id is not None, []))[1].append((side.strip(), price, amount))
+
+    matrices = [np.full((len(df), levels), fill, dtype=np.float64) for fill in (np.nan, 0, np.nan, 0)]
+    snapshots = {}
+    for i, (orderbook_id, symbol, exchange) in enumerate(zip(df['id'], df['symbol'].astype(str), df['exchange'].astype(str))):
+        key = (symbol, exchange)
+        book = books.get(key)
+        if book is None:
+            book = books[key] = OrderBook(symbol=symbol, exchange=exchange)
+            stored = db.load_depth(exchange, symbol, start_ts - 1)
+            if stored is not None:
+                book.apply(zip(stored.ask_price, stored.ask_amount), zip(stored.bid_price, stored.bid_amount))
+        if orderbook_id in changes:
+            is_delta, updates = changes[orderbook_id]
+            if not is_delta:
+                book.clear()
+            for side, price, amount in updates:
+                book.update(side, price, amount)
+            snapshots.pop(key, None)
+        if key not in snapshots:
+            snapshots[key] = book.snapshot(levels)
+        snapshot = snapshots[key]
+        for matrix, values in zip(matrices, (snapshot.ask_price, snapshot.ask_amount, snapshot.bid_price, snapshot.bid_amount)):
+            matrix[i, :len(values)] = values
+    return tuple(matrices)
+
+
+def query_last_packed(db, before_ts):
+    """ Last stored blob of each (symbol, exchange) before a timestamp,
+        as a dict of blobs.
+    """
+    source = db.orderbook_source
+    c = db.conn.cursor()
+    c.execute(f'''SELECT o.symbol, o.exchange, p.ladders FROM depth_packed p JOIN {source} o ON o.id = p.orderbook_id
+        WHERE o.id IN (SELECT MAX(o2.id) FROM depth_packed p2 JOIN {source} o2 ON o2.id = p2.orderbook_id
+            WHERE o2.timestamp<{before_ts} GROUP BY o2.symbol, o2.exchange);''')
+    return {(symbol.strip(), exchange.strip()): ladders for symbol, exchange, ladders in c.fetchall()}
+
+
+def concat_frames(frames, empty=None, **kwargs):
+    """ Concatenate the non-empty frames. Without any, return the first
+        frame, or `empty` when there is no frame at all.
+    """
+    # Empty frames carry no dtypes and would upcast the int columns
+    non_empty = [f for f in frames if not f.empty]
+    if not non_empty:
+        return frames[0] if frames else (pd.DataFrame() if empty is None else empty)
+    return pd.concat(non_empty, **kwargs)
+
+
+def empty_opportunities(columns=spread_columns):
+    """ Opportunities without any row, with the columns of
+        `segment_opportunities`, so that they can still be reported.
+    """
+    return segment_opportunities(pd.DataFrame(columns=columns))
+
+
+def load_incremental_state(params, state_file=incremental_state_file):
+    try:
+        with open(state_file, 'rb') as f:
+            state = pickle.load(f)
+        if state['params'] == params and state.get('version') == incremental_state_version:
+            return state
+        print("Incremental parameters or state format changed, starting over.")
+    except (FileNotFoundError, EOFError, pickle.UnpicklingError, KeyError):
+        pass
+
+    return {
+        'version': incremental_state_version,
+        'params': params,
+        'watermark': None,
+        'first_ts': None,
+        'last_ts': None,
+        'independents': empty_opportunities(),
+    }
+
+
+def save_incremental_state(state, state_file=incremental_state_file):
+    tmp_file = state_file + '.tmp'
+    with open(tmp_file, 'wb') as f:
+        pickle.dump(state, f)
+    os.replace(tmp_file, state_file)
+
+
 def sell_to_calculated(df):
     return 'sell_to' in df.columns
 
@@ -94,9 +440,15 @@ def calc_sell_to(df):
     return df
 
 
-def load_data(date_range='auto', use_cache=True):
-    """ Load data within certain date range, either from database or cache file.
-        If use_cache is True, data_range is ignored.
+def load_data(date_range='auto', use_cache=True, columns=None):
+    """ Load data within certain date range, either from database or cache.
+
+        With pyarrow installed, the cache is a Parquet store partitioned by
+        date and symbol (see `datastore.ParquetStore`): reading it only
+        touches the partitions within date_range ("auto" reads all of it),
+        and rows loaded from the db are merged into it.
+        Without pyarrow, the cache is a pickle file holding the last db
+        query, and data_range is ignored if use_cache is True.
 
         Possible options for date_range: 
             - "auto" (default): start from last db query, end with now()
@@ -104,44 +456,120 @@ def load_data(date_range='auto', use_cache=True):
             - (start, end): a tuple/list of two datetime object
     """
 
-    if use_cache and os.path.exists(pickle_cache_file):
+    if use_cache and datastore.available() and datastore.ParquetStore().exists():
+        start_ts, end_ts = get_date_range(date_range) if date_range != "auto" else (None, None)
+        start = time.time()
+        df = datastore.ParquetStore().read(start_ts=start_ts, end_ts=end_ts, columns=columns)
+        elsapsed = time.time() - start
+        print(f"Reading from parquet cache took: {elsapsed:.3f}s")
+    elif use_cache and not datastore.available() and os.path.exists(pickle_cache_file):
         start = time.time()
         df = pd.read_pickle(pickle_cache_file)
         elsapsed = time.time() - start
         print(f"Reading from pickle cache took: {elsapsed:.3f}s")
     else:
-        if date_range == "all":
-            sql = "SELECT * FROM orderbook;"
-        else:
-            if date_range == "auto":
-                start_date = get_latest_date()
-                if not start_date:
-                    start_date = datetime.datetime(2000, 1, 1)
-                end_date = datetime.datetime.now()
-            elif not isinstance(date_range, str) and len(date_range) > 1:
-                start_date, end_date = date_range[0:2]
-            try:
-                start_ts, end_ts = list(map(lambda x: int(x.timestamp()),(start_date, end_date)))
-            except AttributeError:
-                raise TypeError("Date range need to be datetime type.")
-            sql = f"SELECT * FROM orderbook WHERE timestamp>={start_ts} and timestamp<={end_ts};"
-
-        print(sql)
-        with get_db_manager() as db:
-            start = time.time()
-            df = pd.read_sql_query(sql=sql, con=db.conn)
-            elsapsed = time.time() - start
-            print(f"Reading from db took: {elsapsed:.3f}s")
+        start_ts, end_ts = get_date_range(date_range)
+        df = query_orderbook(start_ts=start_ts, end_ts=end_ts)
             
-            # Save data to cache file
+        # Save data to cache file
+        if datastore.available():
+            datastore.ParquetStore().write(df)
+        else:
             df.to_pickle(pickle_cache_file)
 
-            # Save last db access info
-            latest = datetime.datetime.fromtimestamp(df.timestamp.max())
-            save_latest_date(last_access_date=latest)
+        # Save last db access info
+        latest = datetime.datetime.fromtimestamp(df.timestamp.max())
+        save_latest_date(last_access_date=latest)
+
+        if columns is not None:
+            df = df[columns]
     return df
 
 
+def get_date_range(date_range='auto'):
+    """ Convert date_range to (start_ts, end_ts), None meaning unbounded.
+    """
+    if date_range == "all":
+        return None, None
+
+    if date_range == "auto":
+        start_date = get_latest_date()
+        if not start_date:
+            start_date = datetime.datetime(2000, 1, 1)
+        end_date = datetime.datetime.now()
+    elif not isinstance(date_range, str) and len(date_range) > 1:
+        start_date, end_date = date_range[0:2]
+    try:
+        start_ts, end_ts = list(map(lambda x: int(x.timestamp()),(start_date, end_date)))
+    except (AttributeError, UnboundLocalError):
+        raise TypeError("Date range need to be datetime type.")
+    return start_ts, end_ts
+
+
+def build_orderbook_query(start_ts=None, end_ts=None, order_by=None, source='orderbook'):
+    conditions = []
+    if start_ts is not None:
+        conditions.append(f"timestamp>={start_ts}")
+    if end_ts is not None:
+        conditions.append(f"timestamp<={end_ts}")
+    sql = f"SELECT * FROM {source}"
+    if conditions:
+        sql += " WHERE " + " and ".join(conditions)
+    if order_by:
+        sql += " ORDER BY " + order_by
+    sql += ";"
+    return sql
+
+
+def query_orderbook(start_ts=None, end_ts=None):
+    with get_db_manager(read_only=True) as db:
+        sql = build_orderbook_query(start_ts=start_ts, end_ts=end_ts, source=db.orderbook_source)
+        print(sql)
+        start = time.time()
+        df = pd.read_sql_query(sql=sql, con=db.conn)
+        elsapsed = time.time() - start
+        print(f"Reading from db took: {elsapsed:.3f}s")
+    return df
+
+
+def query_orderbook_chunks(start_ts=None, end_ts=None, chunk_size=chunk_size):
+    """ Stream the orderbook rows in timestamp order, as DataFrames of about
+        `chunk_size` rows with compact dtypes (see `compact_orderbook_frame`).
+        All the rows of a timestamp are in the same chunk: the rows sharing
+        the last timestamp of a chunk are carried over to the next one.
+    """
+    carried = []
+    columns = None
+    with get_db_manager(read_only=True) as db:
+        sql = build_orderbook_query(start_ts=start_ts, end_ts=end_ts, order_by="timestamp", source=db.orderbook_source)
+        print(sql)
+        start = time.time()
+        for columns, rows in db.fetch_chunks(sql, chunk_size=chunk_size):
+            rows = carried + rows
+            ts_pos = columns.index('timestamp')
+            split = len(rows)
+            while split > 0 and rows[split - 1][ts_pos] == rows[-1][ts_pos]:
+                split -= 1
+            carried = rows[split:]
+            if split > 0:
+                yield compact_orderbook_frame(pd.DataFrame.from_records(rows[:split], columns=columns), db.price_dtype)
+        if carried:
+            yield compact_orderbook_frame(pd.DataFrame.from_records(carried, columns=columns), db.price_dtype)
+        elsapsed = time.time() - start
+        print(f"Streaming from db took: {elsapsed:.3f}s")
+
+
+def compact_orderbook_frame(df, price_dtype='float64'):
+    """ Use categories for symbol and exchange, with the CHAR(n) padding
+        stripped, and the narrower numeric types of `chunk_dtypes`, with
+        prices in `price_dtype`.
+    """
+    for col in ('symbol', 'exchange'):
+        values = df[col].astype('category')
+        df[col] = values.cat.rename_categories(values.cat.categories.str.strip())
+    return df.astype(dict(chunk_dtypes, best_ask=price_dtype, best_bid=price_dtype))
+
+
 def get_latest_date(path=default_output_dir):
     try:
         with open(os.path.join(path, last_db_access_file), 'r') as f:
@@ -179,9 +607,13 @@ def main():
     minimum_earn_rate = 0.001
     exclued_exchange = ['bitflyer']
     # date_range = 'all'
-    date_range = 'auto'
+    # date_range = 'auto'
+    date_range = 'incremental'
+    # Walk the depth ladders for trades of this size (in JPY), instead of the best prices
+    notional = None
+    # notional = 100000
 
-    calc_potential_earn(date_range=date_range, minimun_earn_rate=minimum_earn_rate, use_cache=use_cache, exclued_exchange=exclued_exchange)
+    calc_potential_earn(date_range=date_range, minimun_earn_rate=minimum_earn_rate, use_cache=use_cache, exclued_exchange=exclued_exchange, notional=notional)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,108 @@
+import os
+import uuid
+import datetime
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    from pyarrow.fs import LocalFileSystem
+except ImportError:
+    pa = None
+
+
+default_store_dir = 'data/parquet_cache'
+partition_columns = ['date', 'symbol']
+
+
+def available():
+    return pa is not None
+
+
+class ParquetStore:
+    """ Orderbook rows cached as Parquet files, partitioned by date (UTC)
+        and symbol in hive layout: `date=2021-05-01/symbol=btc_jpy/*.parquet`.
+
+        Reads only open the partitions matching the requested time range
+        and symbols, only decode the requested columns, and memory-map the
+        files. Writes rewrite the partitions they touch and nothing else.
+    """
+
+    def __init__(self, path=default_store_dir) -> None:
+        if not available():
+            raise ImportError("pyarrow is required for the Parquet cache")
+        self.path = path
+        self.filesystem = LocalFileSystem(use_mmap=True)
+        self.partitioning = ds.partitioning(
+            pa.schema([('date', pa.string()), ('symbol', pa.string())]), flavor='hive')
+
+    def exists(self):
+        return os.path.isdir(self.path) and len(os.listdir(self.path)) > 0
+
+    def get_dataset(self):
+        return ds.dataset(self.path, format='parquet', partitioning=self.partitioning, filesystem=self.filesystem)
+
+    @classmethod
+    def to_date(cls, ts):
+        return datetime.datetime.fromtimestamp(ts, datetime.timezone.utc).strftime('%Y-%m-%d')
+
+    @classmethod
+    def build_filter(cls, start_ts=None, end_ts=None, symbols=None):
+        conditions = []
+        # Bounds on the partition key let the reader skip whole directories
+        if start_ts is not None:
+            conditions.append(ds.field('date') >= cls.to_date(start_ts))
+            conditions.append(ds.field('timestamp') >= start_ts)
+        if end_ts is not None:
+            conditions.append(ds.field('date') <= cls.to_date(end_ts))
+            conditions.append(ds.field('timestamp') <= end_ts)
+        if symbols:
+            conditions.append(ds.field('symbol').isin(list(symbols)))
+
+        expression = None
+        for c in conditions:
+            expression = c if expression is None else expression & c
+        return expression
+
+    def read(self, start_ts=None, end_ts=None, symbols=None, columns=None):
+        if not self.exists():
+            return pd.DataFrame(columns=columns)
+        table = self.get_dataset().to_table(
+            columns=columns,
+            filter=self.build_filter(start_ts=start_ts, end_ts=end_ts, symbols=symbols),
+        )
+        df = table.to_pandas()
+        if columns is None:
+            df = df.drop(columns=['date'])
+        return df
+
+    def write(self, df):
+        """ Merge `df` into the store. Rows already cached, matched by id,
+            are replaced.
+        """
+        if df.empty:
+            return
+        df = df.copy()
+        # CHAR(n) columns come back space padded from some databases
+        for col in ('symbol', 'exchange'):
+            df[col] = df[col].str.strip()
+        df['date'] = pd.to_datetime(df['timestamp'], unit='s').dt.strftime('%Y-%m-%d')
+
+        if self.exists():
+            touched = df[partition_columns].drop_duplicates()
+            dates = list(touched['date'].unique())
+            symbols = list(touched['symbol'].unique())
+            existing = self.get_dataset().to_table(
+                filter=ds.field('date').isin(dates) & ds.field('symbol').isin(symbols)).to_pandas()
+            if not existing.empty:
+                existing = existing.merge(touched, on=partition_columns)
+                df = pd.concat([existing[df.columns], df], ignore_index=True)
+                df = df.drop_duplicates(subset=['id'], keep='last')
+
+        table = pa.Table.from_pandas(df.sort_values(by=['symbol', 'timestamp']), preserve_index=False)
+        ds.write_dataset(
+            table, self.path, format='parquet',
+            partitioning=self.partitioning,
+            basename_template='part-{}-{{i}}.parquet'.format(uuid.uuid4().hex),
+            existing_data_behavior='delete_matching',
+        )
@@ -1,9 +1,82 @@
+import depthpack
+from orderbook import OrderBook, OrderbookSnapshot
+
+
 class DBManagerBase:
     sql_create_orderbook = ''
     sql_create_depth = ''
     sql_insert_placeholder = '?'
     sql_insert_orderbook = "INSERT INTO orderbook ({}) VALUES ({});"
     sql_insert_depth =  "INSERT INTO depth ({}) VALUES ({});"
+    sql_bulk_insert_orderbook = "INSERT INTO orderbook ({}) VALUES ({});"
+    sql_bulk_insert_depth = "INSERT INTO depth ({}) VALUES ({});"
+    sql_max_orderbook_id = "SELECT COALESCE(MAX(id), 0) FROM orderbook;"
+    sql_create_index = "CREATE INDEX IF NOT EXISTS {} ON {} ({});"
+    # NumPy dtype holding the stored prices without loss
+    price_dtype = 'float64'
+
+    # Normalized schema: symbol and exchange names are stored once in small
+    # dimension tables and orderbook rows only keep their ids. Readers go
+    # through the `orderbook_named` view, which has the plain columns.
+    # Meant for new databases, existing tables are not converted, and
+    # create_tables_safe refuses to run on a table of the other schema.
+    normalized = False
+    sql_create_orderbook_normalized = ''
+    sql_create_dimension = ''
+    sql_create_view = "CREATE VIEW IF NOT EXISTS {} AS {};"
+    sql_select_orderbook_named = '''SELECT o.id, s.name AS symbol, o.best_ask, o.best_bid, o.timestamp, e.name AS exchange
+        FROM orderbook o
+        JOIN symbol s ON s.id = o.symbol_id
+        JOIN exchange e ON e.id = o.exchange_id'''
+    dimension_columns = {'symbol': 'symbol_id', 'exchange': 'exchange_id'}
+    sql_select_no_rows = "SELECT * FROM {} WHERE 1 = 0;"
+
+    # Delta depth: only the levels that changed since the last stored book of
+    # the same (exchange, symbol) go to the depth table, and nothing at all
+    # when the book did not change. Removed levels are stored with a NULL
+    # amount. Orderbook rows written this way are listed in depth_delta,
+    # the others hold their full ladder: the first one of each book after
+    # start-up, then one every keyframe_interval seconds. Orderbook rows are
+    # still written on every tick. See load_depth to rebuild a book.
+    delta_depth = False
+    keyframe_interval = 600  # In seconds
+    sql_create_depth_delta = '''CREATE TABLE IF NOT EXISTS depth_delta
+        (orderbook_id   INTEGER    PRIMARY KEY,
+        FOREIGN KEY (orderbook_id) REFERENCES orderbook (id)
+            ON DELETE CASCADE
+        );'''
+    sql_insert_depth_delta = "INSERT INTO depth_delta ({}) VALUES ({});"
+    sql_not_delta = "AND NOT EXISTS (SELECT 1 FROM depth_delta m WHERE m.orderbook_id = o.id)"
+    sql_select_keyframe = '''SELECT o.id, o.timestamp FROM {} o
+        WHERE o.exchange = {p} AND o.symbol = {p} AND o.timestamp <= {p} {}
+            AND EXISTS (SELECT 1 FROM depth d WHERE d.orderbook_id = o.id)
+        ORDER BY o.timestamp DESC, o.id DESC LIMIT 1;'''
+    sql_select_depth_since = '''SELECT d.orderbook_id, d.side, d.price, d.amount FROM depth d
+        JOIN {} o ON o.id = d.orderbook_id
+        WHERE o.exchange = {p} AND o.symbol = {p} AND o.timestamp >= {p} AND o.timestamp <= {p} AND o.id >= {p}
+        ORDER BY d.orderbook_id;'''
+
+    # Packed depth layout: the ladders of a snapshot are stored in a single
+    # depth_packed row, as one blob of float64 or float32 arrays (see
+    # depthpack), optionally compressed, instead of one depth row per level.
+    # With delta_depth, unchanged books are skipped but changed ones are
+    # stored in full, and unchanged ones too every keyframe_interval
+    # seconds. migrate_depth.py converts the depth table.
+    depth_layout = 'rows'  # 'rows' or 'packed'
+    depth_dtype = 'f8'  # 'f8' or 'f4'
+    depth_compress = False
+    sql_create_depth_packed = ''
+    sql_insert_depth_packed = "INSERT INTO depth_packed ({}) VALUES ({});"
+    sql_select_packed = '''SELECT o.timestamp, p.ladders FROM depth_packed p
+        JOIN {} o ON o.id = p.orderbook_id
+        WHERE o.exchange = {p} AND o.symbol = {p} AND o.timestamp <= {p}
+        ORDER BY o.timestamp DESC, o.id DESC LIMIT 1;'''
+    sql_select_packed_range = '''SELECT o.id, o.symbol, o.exchange, o.timestamp, p.ladders FROM depth_packed p
+        JOIN {} o ON o.id = p.orderbook_id'''
+
+    # Write each batch with pre-allocated ids and one executemany per table,
+    # instead of one INSERT per orderbook and per depth level
+    bulk_insert = True
 
     orderbook_columns = [
         'symbol',
@@ -18,13 +91,61 @@ class DBManagerBase:
         'price',
         'amount',
     ]        
+    depth_delta_columns = [
+        'orderbook_id',
+    ]
+    depth_packed_columns = [
+        'orderbook_id',
+        'ladders',
+    ]
+
+    # (name, table, columns), created or added to existing tables by create_tables_safe
+    indexes = [
+        ('idx_orderbook_timestamp', 'orderbook', ['timestamp']),
+        ('idx_orderbook_symbol_timestamp', 'orderbook', ['symbol', 'timestamp']),
+        ('idx_orderbook_exchange', 'orderbook', ['exchange']),
+        ('idx_depth_orderbook_id', 'depth', ['orderbook_id']),
+    ]
 
-    def __init__(self) -> None:
+    def __init__(self, bulk_insert=None, normalized=None, delta_depth=None, keyframe_interval=None,
+                 depth_layout=None, depth_dtype=None, depth_compress=None) -> None:
+        if bulk_insert is not None:
+            self.bulk_insert = bulk_insert
+        if normalized is not None:
+            self.normalized = normalized
+        if delta_depth is not None:
+            self.delta_depth = delta_depth
+        if keyframe_interval is not None:
+            self.keyframe_interval = keyframe_interval
+        if depth_layout:
+            if depth_layout not in ('rows', 'packed'):
+                raise ValueError(f"Depth layout not supported: {depth_layout}")
+            self.depth_layout = depth_layout
+        if depth_dtype:
+            if depth_dtype not in depthpack.dtypes:
+                raise ValueError(f"Depth dtype not supported: {depth_dtype}")
+            self.depth_dtype = depth_dtype
+        if depth_compress is not None:
+            self.depth_compress = depth_compress
+        # (exchange, symbol) -> ({(side, price): amount}, timestamp of the keyframe),
+        # or (packed ladders, timestamp of the last stored blob) in the packed layout
+        self.last_books = {}
+        if self.normalized:
+            self.orderbook_columns = [self.dimension_columns.get(oc, oc) for oc in self.orderbook_columns]
+        self.dimension_tables = {col: table for table, col in self.dimension_columns.items()}
+        self.dimension_ids = {}
         self.conn = None
         self.o_sql = self.construct_insert_sql(self.sql_insert_orderbook, self.orderbook_columns)
 
         self.depth_key = 'depth'
         self.d_sql = self.construct_insert_sql(self.sql_insert_depth, self.depth_columns)        
+        self.depth_tables = {
+            'depth': (self.depth_columns, self.d_sql),
+            'depth_delta': (self.depth_delta_columns,
+                            self.construct_insert_sql(self.sql_insert_depth_delta, self.depth_delta_columns)),
+            'depth_packed': (self.depth_packed_columns,
+                             self.construct_insert_sql(self.sql_insert_depth_packed, self.depth_packed_columns)),
+        }
     
     def __enter__(self):
         self.connect()
@@ -44,36 +165,304 @@ class DBManagerBase:
         self.conn.close()
         print("Database connection closed") 
 
+    @property
+    def orderbook_source(self):
+        """Table or view to read orderbook rows with their plain columns from.
+        """
+        return 'orderbook_named' if self.normalized else 'orderbook'
+
     def create_tables_safe(self):
         c = self.conn.cursor()
-        c.execute(self.sql_create_orderbook)
-        c.execute(self.sql_create_depth)
+        if self.normalized:
+            for table in self.dimension_columns:
+                c.execute(self.sql_create_dimension.format(table))
+            c.execute(self.sql_create_orderbook_normalized)
+        else:
+            c.execute(self.sql_create_orderbook)
+        self.check_orderbook_schema(c)
+        if self.depth_layout == 'packed':
+            c.execute(self.sql_create_depth_packed)
+        else:
+            c.execute(self.sql_create_depth)
+            if self.delta_depth:
+                c.execute(self.sql_create_depth_delta)
+        if self.normalized:
+            c.execute(self.sql_create_view.format('orderbook_named', self.sql_select_orderbook_named))
+        self.create_indexes(c)
         self.conn.commit()
         print("Table created successfully")
 
+    def check_orderbook_schema(self, cursor):
+        """Refuse to use an existing orderbook table created with the other
+            schema, plain or normalized, where every insert would fail.
+        """
+        cursor.execute(self.sql_select_no_rows.format('orderbook'))
+        columns = {d[0].lower() for d in cursor.description}
+        cursor.fetchall()
+        missing = [col for col in self.orderbook_columns if col not in columns]
+        if missing:
+            schema, other = ('normalized', 'plain') if self.normalized else ('plain', 'normalized')
+            raise RuntimeError(f"Table orderbook has the {other} schema, without {', '.join(missing)}. "
+                               f"Set DB_NORMALIZED={str(not self.normalized).lower()} or use a new database for the {schema} schema.")
+
+    def get_indexes(self):
+        # depth_packed is keyed by orderbook_id already
+        indexes = [i for i in self.indexes if self.depth_layout == 'rows' or i[1] != 'depth']
+        if not self.normalized:
+            return indexes
+        return [
+            (name, table, [self.dimension_columns.get(col, col) for col in cols])
+            for name, table, cols in indexes
+        ]
+
+    def create_indexes(self, cursor):
+        for name, table, cols in self.get_indexes():
+            if not self.index_exists(cursor, table, name):
+                cursor.execute(self.sql_create_index.format(name, table, ",".join(cols)))
+
+    def index_exists(self, cursor, table, name):
+        # CREATE INDEX IF NOT EXISTS takes care of it
+        return False
+
+    def create_stream_cursor(self):
+        return self.conn.cursor()
+
+    def fetch_chunks(self, sql, chunk_size=100000):
+        """Run a query and yield its result as (columns, rows), at most
+            `chunk_size` rows at a time, without loading it all on the client.
+        """
+        c = self.create_stream_cursor()
+        try:
+            c.execute(sql)
+            columns = None
+            while True:
+                rows = c.fetchmany(chunk_size)
+                if not rows:
+                    break
+                # Server-side cursors only describe the result after the first fetch
+                if columns is None:
+                    columns = [d[0] for d in c.description]
+                yield columns, rows
+        finally:
+            c.close()
+
     @classmethod
     def get_last_inserted_id(cls, cursor):
         return cursor.lastrowid
 
     def insert_records(self, records):
+        try:
+            if self.bulk_insert:
+                self.insert_records_bulk(records)
+            else:
+                self.insert_records_per_row(records)
+        except Exception:
+            # The stored books are unknown now, start again from keyframes
+            self.last_books.clear()
+            raise
+
+    def insert_records_per_row(self, records):
 
         c = self.conn.cursor()
         for r in records:
-            orderbook_data = []
-            for oc in self.orderbook_columns:
-                orderbook_data.append(r[oc])
+            orderbook_data = self.get_orderbook_values(c, r)
             c.execute(self.o_sql, orderbook_data)
 
             # Write depth data
             orderbook_id = self.get_last_inserted_id(c)
-            depth_data = r[self.depth_key]
-            for side in ('ask', 'bid'):
-                depth_list = depth_data[side]
-                for dr in depth_list:
-                    c.execute(self.d_sql, (orderbook_id, side, dr['price'], dr['amount']))
+            for table, rows in self.get_stored_depth_rows(orderbook_id, r).items():
+                sql = self.depth_tables[table][1]
+                for row in rows:
+                    c.execute(sql, row)
         
         self.conn.commit()
 
+    def insert_records_bulk(self, records):
+        if not records:
+            return
+
+        c = self.conn.cursor()
+        try:
+            ids = self.allocate_orderbook_ids(c, len(records))
+            orderbook_rows = []
+            depth_rows = {}
+            for orderbook_id, r in zip(ids, records):
+                orderbook_rows.append([orderbook_id] + self.get_orderbook_values(c, r))
+                for table, rows in self.get_stored_depth_rows(orderbook_id, r).items():
+                    depth_rows.setdefault(table, []).extend(rows)
+
+            self.write_rows(c, 'orderbook', ['id'] + self.orderbook_columns, orderbook_rows)
+            for table, rows in depth_rows.items():
+                if rows:
+                    self.write_rows(c, table, self.depth_tables[table][0], rows)
+        except Exception:
+            self.conn.rollback()
+            # Dimension rows inserted in this transaction are gone as well
+            self.dimension_ids.clear()
+            raise
+        self.conn.commit()
+
+    def get_orderbook_values(self, cursor, record):
+        if not self.normalized:
+            return [record[oc] for oc in self.orderbook_columns]
+        values = []
+        for oc in self.orderbook_columns:
+            table = self.dimension_tables.get(oc)
+            values.append(self.get_dimension_id(cursor, table, record[table]) if table else record[oc])
+        return values
+
+    def get_dimension_id(self, cursor, table, name):
+        """Id of `name` in a dimension table, inserted on first use and cached.
+        """
+        ids = self.dimension_ids.setdefault(table, {})
+        if name not in ids:
+            sql_select = "SELECT id FROM {} WHERE name={};".format(table, self.sql_insert_placeholder)
+            cursor.execute(sql_select, (name,))
+            row = cursor.fetchone()
+            if row is None:
+                cursor.execute("INSERT INTO {} (name) VALUES ({});".format(table, self.sql_insert_placeholder), (name,))
+                cursor.execute(sql_select, (name,))
+                row = cursor.fetchone()
+            ids[name] = row[0]
+        return ids[name]
+
+    def get_depth_rows(self, orderbook_id, record):
+        """Rows for the depth table, bound straight from the snapshot arrays
+            when the record is an `OrderbookSnapshot`.
+        """
+        if hasattr(record, 'depth_rows'):
+            return record.depth_rows(orderbook_id)
+
+        depth_data = record[self.depth_key]
+        return [
+            (orderbook_id, side, dr['price'], dr['amount'])
+            for side in ('ask', 'bid') for dr in depth_data[side]
+        ]
+
+    def get_row_suffix(self, record):
+        """Values appended to the depth and depth_delta rows after the
+            standard columns.
+        """
+        return ()
+
+    def get_stored_depth_rows(self, orderbook_id, record):
+        """Rows to write for one record, as {table: rows}. Without
+            delta_depth, that is the full ladder in the depth table.
+        """
+        if self.depth_layout == 'packed':
+            return self.get_packed_depth_rows(orderbook_id, record)
+
+        rows = list(self.get_depth_rows(orderbook_id, record))
+        if not self.delta_depth:
+            return {'depth': rows}
+
+        key = (record['exchange'], record['symbol'])
+        book = {(row[1], row[2]): row[3] for row in rows}
+        last = self.last_books.get(key)
+        if last is None or self.needs_keyframe(last[1], record):
+            self.last_books[key] = (book, record['timestamp'])
+            return {'depth': rows}
+
+        last_book, keyframe_ts = last
+        self.last_books[key] = (book, keyframe_ts)
+        # No depth row and no mark: the book is the same as the previous one
+        if book == last_book:
+            return {}
+        suffix = self.get_row_suffix(record)
+        changed = [row for row in rows if last_book.get((row[1], row[2])) != row[3]]
+        removed = [
+            (orderbook_id, side, price, None) + suffix
+            for side, price in last_book.keys() - book.keys()
+        ]
+        return {'depth': changed + removed, 'depth_delta': [(orderbook_id,) + suffix]}
+
+    def get_packed_depth_rows(self, orderbook_id, record):
+        ladders = depthpack.pack_record(record, dtype=self.depth_dtype, compress=self.depth_compress)
+        if self.delta_depth:
+            key = (record['exchange'], record['symbol'])
+            last = self.last_books.get(key)
+            # Compare the packed bytes, the ladders were just serialized anyway
+            if last is not None and last[0] == ladders and not self.needs_keyframe(last[1], record):
+                return {}
+            self.last_books[key] = (ladders, record['timestamp'])
+        return {'depth_packed': [(orderbook_id, ladders) + self.get_row_suffix(record)]}
+
+    def needs_keyframe(self, keyframe_ts, record):
+        return record['timestamp'] - keyframe_ts >= self.keyframe_interval
+
+    def load_depth(self, exchange, symbol, timestamp=None):
+        """Rebuild the book of (exchange, symbol) as stored at `timestamp`
+            (the latest one by default), from its last full ladder and the
+            deltas after it. Returns an `OrderbookSnapshot`, or None when
+            there is no stored depth.
+        """
+        if timestamp is None:
+            timestamp = 2 ** 31 - 1
+        p = self.sql_insert_placeholder
+        if self.depth_layout == 'packed':
+            return self.load_packed_depth(exchange, symbol, timestamp)
+        delta_filter = self.sql_not_delta if self.delta_depth else ''
+        c = self.conn.cursor()
+        c.execute(self.sql_select_keyframe.format(self.orderbook_source, delta_filter, p=p), (exchange, symbol, timestamp))
+        row = c.fetchone()
+        if row is None:
+            return None
+        keyframe_id, keyframe_ts = row
+        c.execute(self.sql_select_depth_since.format(self.orderbook_source, p=p),
+                  (exchange, symbol, keyframe_ts, timestamp, keyframe_id))
+
+        # A None amount removes the level
+        book = OrderBook(symbol=symbol, exchange=exchange)
+        for _, side, price, amount in c.fetchall():
+            book.update(side.strip(), price, amount)
+        return book.snapshot(timestamp=timestamp)
+
+    def load_packed_depth(self, exchange, symbol, timestamp):
+        p = self.sql_insert_placeholder
+        c = self.conn.cursor()
+        c.execute(self.sql_select_packed.format(self.orderbook_source, p=p), (exchange, symbol, timestamp))
+        row = c.fetchone()
+        if row is None:
+            return None
+        return OrderbookSnapshot(*depthpack.unpack_ladders(row[1]), symbol=symbol, exchange=exchange, timestamp=timestamp)
+
+    def iter_packed_depth(self, start_ts=None, end_ts=None, chunk_size=100000):
+        """Stream the packed ladders stored between two timestamps, as
+            (orderbook_id, symbol, exchange, timestamp, ask_price, ask_amount,
+            bid_price, bid_amount), the ladders being NumPy arrays.
+        """
+        conditions = []
+        if start_ts is not None:
+            conditions.append(f"o.timestamp>={int(start_ts)}")
+        if end_ts is not None:
+            conditions.append(f"o.timestamp<={int(end_ts)}")
+        sql = self.sql_select_packed_range.format(self.orderbook_source)
+        if conditions:
+            sql += " WHERE " + " and ".join(conditions)
+        sql += " ORDER BY o.id;"
+        for _, rows in self.fetch_chunks(sql, chunk_size=chunk_size):
+            for orderbook_id, symbol, exchange, timestamp, ladders in rows:
+                yield (orderbook_id, symbol, exchange, timestamp) + depthpack.unpack_ladders(ladders)
+
+    def allocate_orderbook_ids(self, cursor, n):
+        """Reserve `n` consecutive orderbook ids, after the last one. Other
+            writers must not read it again before the commit, which the
+            backends ensure by taking a lock first.
+        """
+        cursor.execute(self.sql_max_orderbook_id)
+        start = cursor.fetchone()[0] + 1
+        return range(start, start + n)
+
+    def write_rows(self, cursor, table, cols, rows):
+        templates = {
+            'orderbook': self.sql_bulk_insert_orderbook,
+            'depth': self.sql_bulk_insert_depth,
+            'depth_delta': self.sql_insert_depth_delta,
+            'depth_packed': self.sql_insert_depth_packed,
+        }
+        sql = self.construct_insert_sql(templates[table], cols)
+        cursor.executemany(sql, rows)
+
     @classmethod
     def construct_insert_sql(cls, sql_template, cols):
         sql = sql_template.format(",".join(cols), ",".join([cls.sql_insert_placeholder] * len(cols)))
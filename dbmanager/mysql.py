@@ -3,6 +3,7 @@ from dbmanager.base import DBManagerBase
 
 
 class MysqlManager(DBManagerBase):
+    price_dtype = 'float32'  # FLOAT is single precision
     sql_insert_placeholder = '%s'
     sql_create_orderbook = '''CREATE TABLE IF NOT EXISTS orderbook
         (id              INTEGER    PRIMARY KEY AUTO_INCREMENT,
@@ -23,8 +24,45 @@ class MysqlManager(DBManagerBase):
             ON DELETE CASCADE
         );'''
 
-    def __init__(self, database="orderbook_db", user="admin", password="admin", host="localhost", port=3306) -> None:
-        super().__init__()
+    sql_create_depth_packed = '''CREATE TABLE IF NOT EXISTS depth_packed
+        (orderbook_id  INTEGER    PRIMARY KEY,
+        ladders        BLOB       NOT NULL,
+        FOREIGN KEY (orderbook_id) REFERENCES orderbook (id)
+            ON DELETE CASCADE
+        );'''
+
+    sql_create_orderbook_normalized = '''CREATE TABLE IF NOT EXISTS orderbook
+        (id              INTEGER    PRIMARY KEY AUTO_INCREMENT,
+        symbol_id        SMALLINT   NOT NULL,
+        best_ask         FLOAT      NOT NULL,
+        best_bid         FLOAT      NOT NULL,
+        timestamp        INT        NOT NULL,
+        exchange_id      SMALLINT   NOT NULL,
+        FOREIGN KEY (symbol_id) REFERENCES symbol (id),
+        FOREIGN KEY (exchange_id) REFERENCES exchange (id)
+        );'''
+
+    sql_create_dimension = '''CREATE TABLE IF NOT EXISTS {}
+        (id              SMALLINT   PRIMARY KEY AUTO_INCREMENT,
+        name             VARCHAR(20) NOT NULL UNIQUE
+        );'''
+    sql_create_view = "CREATE OR REPLACE VIEW {} AS {};"
+
+    # MySQL has no CREATE INDEX IF NOT EXISTS, see index_exists
+    sql_create_index = "CREATE INDEX {} ON {} ({});"
+    sql_index_exists = '''SELECT COUNT(*) FROM information_schema.statistics
+        WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s;'''
+
+    # Held from the id reservation to the commit of a bulk insert, so that
+    # concurrent writers (shard workers) do not reserve the same ids
+    sql_lock_orderbook_ids = "SELECT GET_LOCK('orderbook_ids', %s);"
+    sql_unlock_orderbook_ids = "SELECT RELEASE_LOCK('orderbook_ids');"
+    lock_timeout = 30  # In seconds
+
+    def __init__(self, database="orderbook_db", user="admin", password="admin", host="localhost", port=3306, bulk_insert=None, normalized=None, delta_depth=None, keyframe_interval=None,
+                 depth_layout=None, depth_dtype=None, depth_compress=None) -> None:
+        super().__init__(bulk_insert=bulk_insert, normalized=normalized, delta_depth=delta_depth, keyframe_interval=keyframe_interval,
+                         depth_layout=depth_layout, depth_dtype=depth_dtype, depth_compress=depth_compress)
         self.db_config = {
             "database": database,
             "user": user,
@@ -36,6 +74,27 @@ class MysqlManager(DBManagerBase):
     
     def create_conn(self):
         return mysql.connector.connect(**self.db_config)
+
+    def index_exists(self, cursor, table, name):
+        cursor.execute(self.sql_index_exists, (table, name))
+        return cursor.fetchone()[0] > 0
+
+    def insert_records_bulk(self, records):
+        if not records:
+            return
+        c = self.conn.cursor()
+        c.execute(self.sql_lock_orderbook_ids, (self.lock_timeout,))
+        if c.fetchone()[0] != 1:
+            raise RuntimeError(f"Could not lock the orderbook ids within {self.lock_timeout}s")
+        try:
+            super().insert_records_bulk(records)
+        finally:
+            c.execute(self.sql_unlock_orderbook_ids)
+            c.fetchone()
+
+    def create_stream_cursor(self):
+        # Unbuffered: rows are read from the socket as they are fetched
+        return self.conn.cursor(buffered=False)
     
 
 def run_test():
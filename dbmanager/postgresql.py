@@ -1,8 +1,12 @@
+import io
+import time
+from datetime import datetime, timezone
 import psycopg2
 from dbmanager.base import DBManagerBase
 
 
 class PsqlManager(DBManagerBase):
+    price_dtype = 'float32'  # REAL is single precision
     sql_insert_placeholder = '%s'    
     sql_create_orderbook = '''CREATE TABLE IF NOT EXISTS orderbook
         (id              SERIAL     PRIMARY KEY,
@@ -23,11 +27,129 @@ class PsqlManager(DBManagerBase):
             ON DELETE CASCADE
         );'''
 
+    sql_create_depth_packed = '''CREATE TABLE IF NOT EXISTS depth_packed
+        (orderbook_id  INTEGER    PRIMARY KEY,
+        ladders        BYTEA      NOT NULL,
+        FOREIGN KEY (orderbook_id) REFERENCES orderbook (id)
+            ON DELETE CASCADE
+        );'''
+
+    sql_create_orderbook_normalized = '''CREATE TABLE IF NOT EXISTS orderbook
+        (id              SERIAL     PRIMARY KEY,
+        symbol_id        SMALLINT   NOT NULL REFERENCES symbol (id),
+        best_ask         REAL       NOT NULL,
+        best_bid         REAL       NOT NULL,
+        timestamp        INT        NOT NULL,
+        exchange_id      SMALLINT   NOT NULL REFERENCES exchange (id)
+        );'''
+
+    # Partitioned schema: orderbook and depth are split into daily or weekly
+    # ranges of timestamp, with matching names and bounds, e.g.
+    # orderbook_p20211018 and depth_p20211018. The partition key has to be
+    # part of the primary key, and depth (and depth_delta, depth_packed)
+    # carry the timestamp of their orderbook row. Old data goes by dropping whole partitions, so depth
+    # has no foreign key and no ON DELETE CASCADE.
+    # Meant for new databases, existing tables are not converted.
+    sql_create_orderbook_partitioned = '''CREATE TABLE IF NOT EXISTS orderbook
+        (id              SERIAL     NOT NULL,
+        symbol           CHAR(20)   NOT NULL,
+        best_ask         REAL       NOT NULL,
+        best_bid         REAL       NOT NULL,
+        timestamp        INT        NOT NULL,
+        exchange         CHAR(20)   NOT NULL,
+        PRIMARY KEY (id, timestamp)
+        ) PARTITION BY RANGE (timestamp);'''
+
+    sql_create_orderbook_normalized_partitioned = '''CREATE TABLE IF NOT EXISTS orderbook
+        (id              SERIAL     NOT NULL,
+        symbol_id        SMALLINT   NOT NULL REFERENCES symbol (id),
+        best_ask         REAL       NOT NULL,
+        best_bid         REAL       NOT NULL,
+        timestamp        INT        NOT NULL,
+        exchange_id      SMALLINT   NOT NULL REFERENCES exchange (id),
+        PRIMARY KEY (id, timestamp)
+        ) PARTITION BY RANGE (timestamp);'''
+
+    sql_create_depth_partitioned = '''CREATE TABLE IF NOT EXISTS depth
+        (id            SERIAL     NOT NULL,
+        orderbook_id   INTEGER    NOT NULL,
+        side           CHAR(3)    CHECK (side IN  ('ask', 'bid'))   NOT NULL,
+        price          REAL       NOT NULL,
+        amount         REAL       NULL DEFAULT NULL,
+        timestamp      INT        NOT NULL,
+        PRIMARY KEY (id, timestamp)
+        ) PARTITION BY RANGE (timestamp);'''
+
+    sql_create_depth_delta_partitioned = '''CREATE TABLE IF NOT EXISTS depth_delta
+        (orderbook_id   INTEGER    NOT NULL,
+        timestamp      INT        NOT NULL,
+        PRIMARY KEY (orderbook_id, timestamp)
+        ) PARTITION BY RANGE (timestamp);'''
+
+    sql_create_depth_packed_partitioned = '''CREATE TABLE IF NOT EXISTS depth_packed
+        (orderbook_id   INTEGER    NOT NULL,
+        ladders        BYTEA      NOT NULL,
+        timestamp      INT        NOT NULL,
+        PRIMARY KEY (orderbook_id, timestamp)
+        ) PARTITION BY RANGE (timestamp);'''
+
+    sql_create_partition = "CREATE TABLE IF NOT EXISTS {} PARTITION OF {} FOR VALUES FROM (%s) TO (%s);"
+    sql_drop_partition = "DROP TABLE IF EXISTS {};"
+    sql_list_partitions = '''SELECT c.relname FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        JOIN pg_class p ON p.oid = i.inhparent
+        WHERE p.relname = %s AND pg_table_is_visible(p.oid);'''
+    sql_table_kind = "SELECT relkind FROM pg_class WHERE relname = %s AND pg_table_is_visible(oid);"
+
+    partition_intervals = {
+        'day': 24 * 3600,
+        'week': 7 * 24 * 3600,
+    }
+    # Weeks start on Monday, 1970-01-05 is the first one after the epoch
+    partition_offsets = {
+        'day': 0,
+        'week': 4 * 24 * 3600,
+    }
+    partition = None  # None, 'day' or 'week'
+    partition_premake = 3  # Partitions created ahead of the current one
+    retention_days = None  # Partitions older than this are dropped, None to keep all
+
+    sql_create_dimension = '''CREATE TABLE IF NOT EXISTS {}
+        (id              SMALLSERIAL PRIMARY KEY,
+        name             VARCHAR(20) NOT NULL UNIQUE
+        );'''
+    sql_create_view = "CREATE OR REPLACE VIEW {} AS {};"
+
     sql_insert_orderbook = "INSERT INTO orderbook ({}) VALUES ({}) RETURNING id;"
     sql_insert_depth =  "INSERT INTO depth ({}) VALUES ({}) RETURNING id;"        
+    sql_allocate_orderbook_ids = "SELECT nextval(pg_get_serial_sequence('orderbook', 'id')) FROM generate_series(1, %s);"
+    sql_copy = "COPY {} ({}) FROM STDIN"
 
-    def __init__(self, database="orderbook_db", user="postgres", password="postgres", host="localhost", port=5432) -> None:
-        super().__init__()
+    def __init__(self, database="orderbook_db", user="postgres", password="postgres", host="localhost", port=5432, bulk_insert=None, normalized=None,
+                 delta_depth=None, keyframe_interval=None, depth_layout=None, depth_dtype=None, depth_compress=None, partition=None, partition_premake=None, retention_days=None) -> None:
+        if partition:
+            if partition not in self.partition_intervals:
+                raise ValueError(f"Partition interval not supported: {partition}")
+            self.partition = partition
+        if self.partition:
+            self.sql_create_orderbook = self.sql_create_orderbook_partitioned
+            self.sql_create_orderbook_normalized = self.sql_create_orderbook_normalized_partitioned
+            self.sql_create_depth = self.sql_create_depth_partitioned
+            self.sql_create_depth_delta = self.sql_create_depth_delta_partitioned
+            self.sql_create_depth_packed = self.sql_create_depth_packed_partitioned
+            self.depth_columns = self.depth_columns + ['timestamp']
+            self.depth_delta_columns = self.depth_delta_columns + ['timestamp']
+            self.depth_packed_columns = self.depth_packed_columns + ['timestamp']
+        super().__init__(bulk_insert=bulk_insert, normalized=normalized, delta_depth=delta_depth, keyframe_interval=keyframe_interval,
+                         depth_layout=depth_layout, depth_dtype=depth_dtype, depth_compress=depth_compress)
+        if partition_premake is not None:
+            self.partition_premake = partition_premake
+        if retention_days is not None:
+            # 0 keeps everything, like None
+            self.retention_days = retention_days or None
+        # Start timestamps of the existing partitions, and when to look again
+        self.partition_starts = set()
+        self.next_maintenance = 0
         self.db_config = {
             "database": database,
             "user": user,
@@ -35,14 +157,158 @@ class PsqlManager(DBManagerBase):
             "host": host,
             "port": port,
         }
-        print(f"Using [postgres]: {host}")
+        print(f"Using [postgres]: {host}{f' (partitioned by {self.partition})' if self.partition else ''}")
     
     def create_conn(self):
         return psycopg2.connect(**self.db_config)
     
+    def create_stream_cursor(self):
+        # A named cursor is kept on the server: each fetchmany pulls one chunk
+        # instead of the whole result being sent on execute
+        return self.conn.cursor(name='orderbook_stream')
+
     @classmethod
     def get_last_inserted_id(cls, cursor):
         return cursor.fetchone()[0]
+
+    def create_tables_safe(self):
+        if self.partition:
+            c = self.conn.cursor()
+            c.execute(self.sql_table_kind, ('orderbook',))
+            row = c.fetchone()
+            if row is not None and row[0] != 'p':
+                raise RuntimeError("Table orderbook exists and is not partitioned. "
+                                   "Use a new database for the partitioned schema.")
+        super().create_tables_safe()
+        if self.partition:
+            self.maintain_partitions()
+
+    def insert_records(self, records):
+        if self.partition and records:
+            now = time.time()
+            if now >= self.next_maintenance:
+                self.maintain_partitions(now)
+            # Records can lag behind or run ahead of the clock
+            missing = {self.partition_start(r['timestamp']) for r in records} - self.partition_starts
+            if missing:
+                self.create_partitions(missing)
+        super().insert_records(records)
+
+    def get_depth_rows(self, orderbook_id, record):
+        rows = super().get_depth_rows(orderbook_id, record)
+        suffix = self.get_row_suffix(record)
+        if not suffix:
+            return rows
+        return [row + suffix for row in rows]
+
+    def get_row_suffix(self, record):
+        if not self.partition:
+            return ()
+        return (record['timestamp'],)
+
+    def needs_keyframe(self, keyframe_ts, record):
+        # Deltas never depend on a partition that can be dropped before them
+        if self.partition and self.partition_start(record['timestamp']) != self.partition_start(keyframe_ts):
+            return True
+        return super().needs_keyframe(keyframe_ts, record)
+
+    def partition_start(self, timestamp):
+        interval = self.partition_intervals[self.partition]
+        offset = self.partition_offsets[self.partition]
+        return int((timestamp - offset) // interval) * interval + offset
+
+    def partition_name(self, table, start):
+        return "{}_p{}".format(table, datetime.fromtimestamp(start, tz=timezone.utc).strftime('%Y%m%d'))
+
+    def list_partitions(self, cursor):
+        """Start timestamps of the existing partitions, as {table: starts}
+            for each of `partitioned_tables`.
+        """
+        partitions = {}
+        for table in self.partitioned_tables:
+            cursor.execute(self.sql_list_partitions, (table,))
+            prefix = table + '_p'
+            starts = partitions[table] = set()
+            for (name,) in cursor.fetchall():
+                if name.startswith(prefix):
+                    day = datetime.strptime(name[len(prefix):], '%Y%m%d').replace(tzinfo=timezone.utc)
+                    starts.add(int(day.timestamp()))
+        return partitions
+
+    @property
+    def partitioned_tables(self):
+        if self.depth_layout == 'packed':
+            return ['orderbook', 'depth_packed']
+        tables = ['orderbook', 'depth']
+        if self.delta_depth:
+            tables.append('depth_delta')
+        return tables
+
+    def create_partitions(self, starts):
+        interval = self.partition_intervals[self.partition]
+        c = self.conn.cursor()
+        for start in sorted(starts):
+            for table in self.partitioned_tables:
+                c.execute(self.sql_create_partition.format(self.partition_name(table, start), table),
+                          (start, start + interval))
+            print("Created partition: {}".format(self.partition_name('orderbook', start)))
+        self.conn.commit()
+        self.partition_starts.update(starts)
+
+    def drop_partitions(self, starts):
+        """Drop whole partitions, instead of deleting their rows one by one.
+        """
+        c = self.conn.cursor()
+        for start in sorted(starts):
+            for table in reversed(self.partitioned_tables):
+                c.execute(self.sql_drop_partition.format(self.partition_name(table, start)))
+            print("Dropped partition: {}".format(self.partition_name('orderbook', start)))
+        self.conn.commit()
+        self.partition_starts.difference_update(starts)
+
+    def maintain_partitions(self, now=None):
+        """Create the current and the next `partition_premake` partitions,
+            and drop the ones entirely older than `retention_days`.
+        """
+        now = now or time.time()
+        interval = self.partition_intervals[self.partition]
+        current = self.partition_start(now)
+
+        c = self.conn.cursor()
+        partitions = self.list_partitions(c)
+        # A range counts as created once every table has its partition, e.g.
+        # depth_delta is only partitioned after delta_depth was turned on
+        self.partition_starts = set.intersection(*partitions.values())
+        wanted = {current + i * interval for i in range(self.partition_premake + 1)}
+        self.create_partitions(wanted - self.partition_starts)
+
+        if self.retention_days:
+            cutoff = now - self.retention_days * 24 * 3600
+            existing = set.union(*partitions.values())
+            self.drop_partitions({s for s in existing if s + interval <= cutoff})
+        self.next_maintenance = current + interval
+
+    def allocate_orderbook_ids(self, cursor, n):
+        # Draw the ids from the SERIAL sequence so that it stays in sync
+        cursor.execute(self.sql_allocate_orderbook_ids, (n,))
+        return [row[0] for row in cursor.fetchall()]
+
+    def write_rows(self, cursor, table, cols, rows):
+        buf = io.StringIO()
+        for row in rows:
+            buf.write("\t".join(self.format_copy_value(v) for v in row))
+            buf.write("\n")
+        buf.seek(0)
+        cursor.copy_expert(self.sql_copy.format(table, ",".join(cols)), buf)
+
+    @classmethod
+    def format_copy_value(cls, value):
+        if value is None:
+            return "\\N"
+        if isinstance(value, bytes):
+            # bytea hex format, with the backslash escaped for COPY
+            return "\\\\x" + value.hex()
+        return str(value)
     
 
 
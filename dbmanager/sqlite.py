@@ -1,5 +1,6 @@
 import os
 import sqlite3
+import threading
 from dbmanager.base import DBManagerBase
 
 
@@ -22,14 +23,121 @@ class SqliteManager(DBManagerBase):
         FOREIGN KEY (orderbook_id) REFERENCES orderbook (id)
             ON DELETE CASCADE
         );'''
-        
-    def __init__(self, file='history.db', path='.') -> None:
-        super().__init__()
+
+    sql_create_depth_packed = '''CREATE TABLE IF NOT EXISTS depth_packed
+        (orderbook_id INTEGER PRIMARY KEY,
+        ladders        BLOB       NOT NULL,
+        FOREIGN KEY (orderbook_id) REFERENCES orderbook (id)
+            ON DELETE CASCADE
+        );'''
+
+    sql_create_orderbook_normalized = '''CREATE TABLE IF NOT EXISTS orderbook
+        (id INTEGER PRIMARY KEY     AUTOINCREMENT,
+        symbol_id        INTEGER    NOT NULL REFERENCES symbol (id),
+        best_ask         REAL       NOT NULL,
+        best_bid         REAL       NOT NULL,
+        timestamp        INT        NOT NULL,
+        exchange_id      INTEGER    NOT NULL REFERENCES exchange (id)
+        );'''
+
+    # Small integers take a single byte in a SQLite record
+    sql_create_dimension = '''CREATE TABLE IF NOT EXISTS {}
+        (id INTEGER PRIMARY KEY,
+        name             VARCHAR(20) NOT NULL UNIQUE
+        );'''
+
+    # AUTOINCREMENT never reuses ids, so start after the recorded sequence
+    sql_max_orderbook_id = '''SELECT MAX(
+        COALESCE((SELECT seq FROM sqlite_sequence WHERE name='orderbook'), 0),
+        COALESCE((SELECT MAX(id) FROM orderbook), 0));'''
+
+    # Write-ahead log: readers do not block the writer and the other way
+    # round, and each commit appends to the log instead of rewriting pages.
+    # With synchronous=NORMAL a power loss may drop the last commits, but
+    # never corrupts the database. Not supported on network filesystems.
+    wal = True
+    synchronous = 'NORMAL'
+    cache_size = 64 * 1024  # In KiB
+    mmap_size = 256 * 1024 * 1024  # In bytes
+    # The log is copied back into the database by a background thread every
+    # checkpoint_interval seconds, so that commits do not stall on it.
+    # SQLite still checkpoints on commit past wal_autocheckpoint pages.
+    checkpoint_interval = 30  # In seconds
+    wal_autocheckpoint = 10000  # In pages
+
+    def __init__(self, file='history.db', path='.', bulk_insert=None, normalized=None, delta_depth=None, keyframe_interval=None,
+                 depth_layout=None, depth_dtype=None, depth_compress=None,
+                 wal=None, cache_size=None, mmap_size=None, checkpoint_interval=None, read_only=False) -> None:
+        super().__init__(bulk_insert=bulk_insert, normalized=normalized, delta_depth=delta_depth, keyframe_interval=keyframe_interval,
+                         depth_layout=depth_layout, depth_dtype=depth_dtype, depth_compress=depth_compress)
         self.file = os.path.join(path, file)
-        print(f"Using [sqlite]: {self.file}")
+        if wal is not None:
+            self.wal = wal
+        if cache_size is not None:
+            self.cache_size = cache_size
+        if mmap_size is not None:
+            self.mmap_size = mmap_size
+        if checkpoint_interval is not None:
+            self.checkpoint_interval = checkpoint_interval
+        self.read_only = read_only
+        self.checkpointer = None
+        self.checkpoint_stop = threading.Event()
+        print(f"Using [sqlite]: {self.file}{' (read-only)' if read_only else ''}")
 
     def create_conn(self):
-        return sqlite3.connect(self.file)
+        if self.read_only:
+            # Reads alongside a running writer, and can never write by mistake
+            conn = sqlite3.connect(f"file:{self.file}?mode=ro", uri=True, check_same_thread=False)
+        else:
+            # The connection is handed over to the writer thread after setup
+            conn = sqlite3.connect(self.file, check_same_thread=False)
+        self.set_pragmas(conn)
+        return conn
+
+    def set_pragmas(self, conn):
+        conn.execute(f"PRAGMA cache_size=-{int(self.cache_size)};")
+        conn.execute(f"PRAGMA mmap_size={int(self.mmap_size)};")
+        if self.read_only:
+            return
+        if self.wal:
+            conn.execute("PRAGMA journal_mode=WAL;")
+            conn.execute(f"PRAGMA synchronous={self.synchronous};")
+            conn.execute(f"PRAGMA wal_autocheckpoint={int(self.wal_autocheckpoint)};")
+        else:
+            conn.execute("PRAGMA journal_mode=DELETE;")
+
+    def connect(self):
+        super().connect()
+        if self.wal and not self.read_only and self.checkpoint_interval:
+            self.checkpoint_stop.clear()
+            self.checkpointer = threading.Thread(target=self.checkpoint_forever, name='sqlite-checkpoint', daemon=True)
+            self.checkpointer.start()
+
+    def close(self):
+        if self.checkpointer is not None:
+            self.checkpoint_stop.set()
+            self.checkpointer.join()
+            self.checkpointer = None
+        super().close()
+
+    def allocate_orderbook_ids(self, cursor, n):
+        # Take the write lock before reading the last id: the other writers
+        # (shard workers) wait for the commit instead of reserving the same ids
+        if not self.conn.in_transaction:
+            cursor.execute("BEGIN IMMEDIATE;")
+        return super().allocate_orderbook_ids(cursor, n)
+
+    def checkpoint_forever(self):
+        conn = sqlite3.connect(self.file)
+        try:
+            while not self.checkpoint_stop.wait(self.checkpoint_interval):
+                try:
+                    # PASSIVE never waits for readers or the writer
+                    conn.execute("PRAGMA wal_checkpoint(PASSIVE);").fetchone()
+                except sqlite3.Error as e:
+                    print(f"WAL checkpoint failed: {e}")
+        finally:
+            conn.close()
 
 
 
@@ -0,0 +1,89 @@
+import re
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+backends = {
+    'json': json.loads,
+}
+if orjson:
+    # orjson.JSONDecodeError subclasses json.JSONDecodeError,
+    # so callers catching the latter keep working
+    backends['orjson'] = orjson.loads
+
+_loads = backends.get('orjson', json.loads)
+_scanner = json.JSONDecoder()
+_whitespace = re.compile(r'\s*')
+
+
+def set_backend(name=None):
+    """Select the JSON backend by name. None or "auto" picks the fastest available.
+    """
+    global _loads
+    if not name or name == 'auto':
+        name = 'orjson' if 'orjson' in backends else 'json'
+    if name not in backends:
+        raise ValueError("JSON backend not available: {}".format(name))
+    _loads = backends[name]
+    return name
+
+
+def loads(data):
+    if _loads is json.loads and isinstance(data, (bytes, bytearray)):
+        data = _decode_utf8(data)
+    return _loads(data)
+
+
+def loads_top_levels(data, keys, limit, root=()):
+    """Decode only the first `limit` elements of the arrays found under `keys`,
+        without decoding the rest of the document.
+
+        The result is nested under the keys in `root`, e.g. `root=('tick',)`
+        returns `{'tick': {key: [...], ...}}`. Raises `json.JSONDecodeError`
+        when a key is missing, the array is malformed or the data is not UTF-8.
+    """
+    if isinstance(data, (bytes, bytearray)):
+        data = _decode_utf8(data)
+
+    res = {}
+    for key in keys:
+        match = re.search(r'"{}"\s*:\s*\['.format(re.escape(key)), data)
+        if not match:
+            raise json.JSONDecodeError("Key not found: {}".format(key), data, 0)
+        res[key] = _scan_array(data, match.end(), limit)
+
+    for key in reversed(root):
+        res = {key: res}
+    return res
+
+
+def _decode_utf8(data):
+    # Report invalid bodies like any other malformed JSON, which the
+    # callers already handle, instead of a UnicodeDecodeError
+    try:
+        return data.decode('utf-8')
+    except UnicodeDecodeError as e:
+        raise json.JSONDecodeError("Invalid UTF-8: {}".format(e.reason), data.decode('utf-8', 'replace'), e.start)
+
+
+def _scan_array(data, pos, limit):
+    items = []
+    pos = _whitespace.match(data, pos).end()
+    if data[pos:pos + 1] == ']':
+        return items
+
+    while len(items) < limit:
+        item, pos = _scanner.raw_decode(data, pos)
+        items.append(item)
+        pos = _whitespace.match(data, pos).end()
+        delimiter = data[pos:pos + 1]
+        if delimiter == ']':
+            break
+        if delimiter != ',':
+            raise json.JSONDecodeError("Expecting ',' delimiter", data, pos)
+        pos = _whitespace.match(data, pos + 1).end()
+    return items
@@ -0,0 +1,121 @@
+import sys
+import zlib
+import struct
+from array import array
+
+try:
+    import numpy as np
+except ImportError:
+    # Packing does not need it, so the collector runs without NumPy
+    np = None
+
+
+# Header of a packed ladder blob: codec, dtype code, number of ask and bid
+# levels, padded to 8 bytes so that the float64 payload stays aligned.
+# The payload follows: ask prices, ask amounts, bid prices, bid amounts.
+header = struct.Struct('<BBHHxx')
+
+CODEC_RAW = 0
+CODEC_ZLIB = 1
+
+dtypes = {
+    'f8': (0, 'd'),
+    'f4': (1, 'f'),
+}
+typecodes = {
+    0: 'd',
+    1: 'f',
+}
+
+
+def pack_ladders(ask_price, ask_amount, bid_price, bid_amount, dtype='f8', compress=False):
+    """Pack both sides of a book, best level first, into one blob.
+
+        float32 halves the size but rounds prices above about 16M (e.g.
+        BTC/JPY) to the nearest unit or coarser, float64 is exact. zlib
+        mostly pays off with float32 and deep ladders.
+    """
+    code, typecode = dtypes[dtype]
+    values = array(typecode)
+    for side in (ask_price, ask_amount, bid_price, bid_amount):
+        # array.extend only takes another array of the same type as is
+        values.extend(side if getattr(side, 'typecode', None) == typecode else iter(side))
+    if sys.byteorder == 'big':
+        values.byteswap()
+    payload = values.tobytes()
+    codec = CODEC_RAW
+    if compress:
+        payload = zlib.compress(payload)
+        codec = CODEC_ZLIB
+    return header.pack(codec, code, len(ask_price), len(bid_price)) + payload
+
+
+def unpack_ladders(blob):
+    """Return (ask_price, ask_amount, bid_price, bid_amount) as NumPy arrays.
+
+        Uncompressed blobs are not copied: the arrays are read-only views
+        on `blob` (bytes or memoryview). Without NumPy, they are copied
+        into `array` objects instead.
+    """
+    codec, code, n_ask, n_bid = header.unpack_from(blob)
+    payload = memoryview(blob)[header.size:]
+    if codec == CODEC_ZLIB:
+        payload = zlib.decompress(payload)
+    if np is not None:
+        values = np.frombuffer(payload, dtype=np.dtype('<' + typecodes[code]))
+    else:
+        values = array(typecodes[code])
+        values.frombytes(payload)
+        if sys.byteorder == 'big':
+            values.byteswap()
+    bounds = [0, n_ask, 2 * n_ask, 2 * n_ask + n_bid, 2 * (n_ask + n_bid)]
+    return tuple(values[start:end] for start, end in zip(bounds[:-1], bounds[1:]))
+
+
+def pack_record(record, dtype='f8', compress=False):
+    """Pack the ladders of an `OrderbookSnapshot` or of a record dict.
+    """
+    if hasattr(record, 'ask_price'):
+        return pack_ladders(record.ask_price, record.ask_amount, record.bid_price, record.bid_amount,
+                            dtype=dtype, compress=compress)
+    depth = record['depth']
+    return pack_ladders(
+        [d['price'] for d in depth['ask']], [d['amount'] for d in depth['ask']],
+        [d['price'] for d in depth['bid']], [d['amount'] for d in depth['bid']],
+        dtype=dtype, compress=compress,
+    )
+
+
+def unpack_many(blobs, levels=10):
+    """Unpack many blobs into (ask_price, ask_amount, bid_price, bid_amount)
+        matrices of shape (len(blobs), levels), best level first. Missing
+        levels have a NaN price and a zero amount. Requires NumPy.
+
+        When all the blobs have the same header, uncompressed, as written
+        by a collector with fixed depth, they are decoded as one matrix.
+        Otherwise each blob is decoded on its own.
+    """
+    n = len(blobs)
+    matrices = [np.full((n, levels), np.nan), np.zeros((n, levels)), np.full((n, levels), np.nan), np.zeros((n, levels))]
+    if n == 0:
+        return tuple(matrices)
+
+    buf = b''.join(blobs)
+    width = len(blobs[0])
+    if len(buf) == n * width:
+        raw = np.frombuffer(buf, dtype=np.uint8).reshape(n, width)
+        headers = raw[:, :header.size]
+        codec, code, n_ask, n_bid = header.unpack_from(blobs[0])
+        if codec == CODEC_RAW and (headers == headers[0]).all():
+            values = raw[:, header.size:].copy().view('<' + typecodes[code])
+            bounds = [0, n_ask, 2 * n_ask, 2 * n_ask + n_bid, 2 * (n_ask + n_bid)]
+            for matrix, lo, hi in zip(matrices, bounds[:-1], bounds[1:]):
+                width = min(hi - lo, levels)
+                matrix[:, :width] = values[:, lo:lo + width]
+            return tuple(matrices)
+
+    for i, blob in enumerate(blobs):
+        for matrix, side in zip(matrices, unpack_ladders(blob)):
+            width = min(len(side), levels)
+            matrix[i, :width] = side[:width]
+    return tuple(matrices)
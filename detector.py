@@ -0,0 +1,171 @@
+import math
+
+
+class Opportunity:
+    """One run of positive spread ticks of a symbol, as merged by
+        `arbitrage.segment_opportunities`: the columns of its first tick,
+        plus duration, ticks, peak_diff_ratio and mean_price_diff.
+    """
+    __slots__ = (
+        'symbol', 'timestamp', 'buy_from', 'sell_to', 'buy_price', 'sell_price',
+        'price_diff', 'diff_ratio', 'end', 'ticks', 'peak_diff_ratio', 'price_diff_sum',
+    )
+
+    def __init__(self, symbol, timestamp, buy_from, sell_to, buy_price, sell_price) -> None:
+        self.symbol = symbol
+        self.timestamp = timestamp
+        self.buy_from = buy_from
+        self.sell_to = sell_to
+        self.buy_price = buy_price
+        self.sell_price = sell_price
+        self.price_diff = sell_price - buy_price
+        self.diff_ratio = self.price_diff / buy_price
+        self.end = timestamp
+        self.ticks = 1
+        self.peak_diff_ratio = self.diff_ratio
+        self.price_diff_sum = self.price_diff
+
+    @property
+    def duration(self):
+        return self.end - self.timestamp
+
+    @property
+    def mean_price_diff(self):
+        return self.price_diff_sum / self.ticks
+
+    def __repr__(self):
+        return "Opportunity(symbol={!r}, timestamp={}, buy_from={!r}, sell_to={!r}, diff_ratio={:.4f}, duration={}, ticks={})".format(
+            self.symbol, self.timestamp, self.buy_from, self.sell_to, self.diff_ratio, self.duration, self.ticks,
+        )
+
+
+class SymbolState:
+    """Best prices of the tick being collected for one symbol, and its open
+        opportunity. Updated in place, so a tick allocates nothing.
+    """
+    __slots__ = ('timestamp', 'buy_price', 'buy_from', 'sell_price', 'sell_to', 'opportunity')
+
+    def __init__(self) -> None:
+        self.timestamp = None
+        self.opportunity = None
+        self.reset(None)
+
+    def reset(self, timestamp):
+        self.timestamp = timestamp
+        self.buy_price = math.inf
+        self.buy_from = None
+        self.sell_price = -math.inf
+        self.sell_to = None
+
+
+class SpreadDetector:
+    """Find arbitrage opportunities while the records come in, with the
+        semantics of the batch analysis in check_price_diff: for each
+        (symbol, timestamp), buy from the exchange with the lowest ask and
+        sell to the one with the highest bid, keep the ticks where the
+        spread is positive, and merge the ticks of a symbol that are no more
+        than `group_delimiter` seconds apart into one opportunity.
+
+        Best prices are kept as running min/max while the records of a tick
+        arrive, so each record costs O(1) and each tick O(exchanges). A tick
+        is evaluated when the first record of the next timestamp of its
+        symbol arrives; records older than the current tick are dropped.
+
+        `on_opportunity(event, opportunity)` is called with "open" when an
+        opportunity starts with a diff_ratio of at least `minimun_earn_rate`
+        (the filter of `report_opportunities`), and with "close" once no
+        tick has continued it for `group_delimiter` seconds. The
+        opportunity object is updated in place until it closes.
+    """
+    group_delimiter = 60  # In seconds
+    minimun_earn_rate = 0.005
+
+    def __init__(self, on_opportunity=None, exclued_exchange=(), group_delimiter=None, minimun_earn_rate=None) -> None:
+        self.on_opportunity = on_opportunity or self.log_opportunity
+        self.exclued_exchange = frozenset(exclued_exchange)
+        if group_delimiter is not None:
+            self.group_delimiter = group_delimiter
+        if minimun_earn_rate is not None:
+            self.minimun_earn_rate = minimun_earn_rate
+        self.states = {}
+        self.late_records = 0
+
+    def add(self, record):
+        exchange = record['exchange']
+        if exchange in self.exclued_exchange:
+            return
+        timestamp = record['timestamp']
+        state = self.states.get(record['symbol'])
+        if state is None:
+            state = self.states[record['symbol']] = SymbolState()
+
+        if state.timestamp != timestamp:
+            if state.timestamp is not None:
+                if timestamp < state.timestamp:
+                    self.late_records += 1
+                    return
+                self.end_tick(record['symbol'], state)
+            state.reset(timestamp)
+
+        # Strict comparisons: on a tie, the first exchange of the tick wins
+        best_ask = record['best_ask']
+        if best_ask < state.buy_price:
+            state.buy_price = best_ask
+            state.buy_from = exchange
+        best_bid = record['best_bid']
+        if best_bid > state.sell_price:
+            state.sell_price = best_bid
+            state.sell_to = exchange
+
+    def end_tick(self, symbol, state):
+        opportunity = state.opportunity
+        timestamp = state.timestamp
+        if opportunity is not None and timestamp - opportunity.end > self.group_delimiter:
+            self.close(state)
+            opportunity = None
+
+        price_diff = state.sell_price - state.buy_price
+        if not price_diff > 0:
+            return
+        if opportunity is None:
+            opportunity = Opportunity(symbol, timestamp, state.buy_from, state.sell_to, state.buy_price, state.sell_price)
+            state.opportunity = opportunity
+            if opportunity.diff_ratio >= self.minimun_earn_rate:
+                self.on_opportunity("open", opportunity)
+        else:
+            opportunity.end = timestamp
+            opportunity.ticks += 1
+            opportunity.price_diff_sum += price_diff
+            diff_ratio = price_diff / state.buy_price
+            if diff_ratio > opportunity.peak_diff_ratio:
+                opportunity.peak_diff_ratio = diff_ratio
+
+    def close(self, state):
+        opportunity = state.opportunity
+        state.opportunity = None
+        if opportunity.diff_ratio >= self.minimun_earn_rate:
+            self.on_opportunity("close", opportunity)
+
+    def flush(self):
+        """Evaluate the ticks being collected and close every opportunity,
+            e.g. on shutdown.
+        """
+        for symbol, state in self.states.items():
+            if state.timestamp is not None:
+                self.end_tick(symbol, state)
+                state.reset(None)
+            if state.opportunity is not None:
+                self.close(state)
+
+    @classmethod
+    def log_opportunity(cls, event, opportunity):
+        if event == "open":
+            print("Opportunity: [{}] buy [{}] {:.1f} -> sell [{}] {:.1f}, diff {:.2f}%".format(
+                opportunity.symbol, opportunity.buy_from, opportunity.buy_price,
+                opportunity.sell_to, opportunity.sell_price, opportunity.diff_ratio * 100,
+            ))
+        else:
+            print("Opportunity closed: [{}] {} -> {}, {}s, {} ticks, peak {:.2f}%".format(
+                opportunity.symbol, opportunity.buy_from, opportunity.sell_to,
+                opportunity.duration, opportunity.ticks, opportunity.peak_diff_ratio * 100,
+            ))
@@ -1,8 +1,25 @@
+import time
 import asyncio
+import heapq
 import json
-from re import S
+from array import array
+from operator import itemgetter
 import aiohttp
 import aiohttp.client_exceptions
+from urllib.parse import urlsplit
+import decoder
+from breaker import CircuitBreaker, parse_retry_after
+from symbols import registry
+from orderbook import OrderbookSnapshot
+
+
+class RateLimitedError(Exception):
+    """The exchange answered 429, or 503 with a Retry-After header.
+    """
+    def __init__(self, status, retry_after=None) -> None:
+        super().__init__("HTTP {}, retry after {}s".format(status, retry_after))
+        self.status = status
+        self.retry_after = retry_after
 
 
 class ExchangeBase:
@@ -10,13 +27,35 @@ class ExchangeBase:
     url = ''
     top_n = 10
     symbol_map = None
-    retry_count_down = 10  # Retry after N times
+    # Exchanges publishing their symbol map through their API set this
+    # and implement `fetch_symbol_map`. The map is then loaded lazily,
+    # cached on disk and refreshed in the background by `symbol_registry`.
+    remote_symbol_map = False
+    symbol_registry = registry
+    interval = 2  # Polling interval in seconds
+    # Below the default poll deadline (0.9 x interval), which also cuts
+    # them short
+    connect_timeout = 1  # In seconds
+    read_timeout = 1.5  # In seconds
+
+    # Options for the circuit breakers, see `CircuitBreaker`. Each instance
+    # has its own breaker, and all the instances calling the same host share
+    # a host breaker, which mostly reacts to rate limiting and outages.
+    breaker_config = {}
+    host_breaker_config = {
+        'consecutive_failures': 20,
+        'min_calls': 20,
+    }
+    host_breakers = {}
 
-    def __init__(self, symbol='btc_jpy') -> None:
+    def __init__(self, symbol='btc_jpy', interval=None) -> None:
         self.initialize()
         self.symbol = symbol
-        self.formatted_symbol = self.format_symbol(symbol)
-        self.retry_counter = 0
+        if interval:
+            self.interval = interval
+        self.formatted_symbol = self.resolve_symbol()
+        self.breaker = CircuitBreaker(name="{}:{}".format(self.name, symbol), **self.breaker_config)
+        self.host_breaker = self.get_host_breaker(self.url)
     
     def get_url(self):
         return self.url.format(self.formatted_symbol)
@@ -30,40 +69,102 @@ class ExchangeBase:
                 return cls.symbol_map.get(symbol)
         return symbol
 
-    async def _send_request(self, session):
-        async with session.get(self.get_url()) as resp:
+    @classmethod
+    async def fetch_symbol_map(cls, session):
+        """Return {symbol: formatted_symbol} from the exchange API.
+        """
+        raise NotImplementedError()
+
+    def resolve_symbol(self, session=None):
+        """Return the formatted symbol, or None while a remote symbol map
+            is not available yet. Never waits on the network.
+        """
+        if self.remote_symbol_map:
+            symbol_map = self.symbol_registry.get(type(self), session=session)
+            if symbol_map is None:
+                return None
+            return symbol_map.get(self.symbol, self.symbol)
+        return self.format_symbol(self.symbol)
+
+    def update_symbol(self, session):
+        if self.remote_symbol_map:
+            self.formatted_symbol = self.resolve_symbol(session=session)
+        if self.formatted_symbol is None:
+            print("Skip: [{}] [{}]. Symbol map not loaded yet.".format(self.name, self.symbol))
+            return False
+        return True
+
+    def get_timeout(self, deadline=None):
+        """Connect/read timeouts of the exchange, cut short by the poll
+            `deadline` (epoch seconds) when it comes first, so that a hanging
+            request fails in `fetch` instead of being cancelled.
+        """
+        connect, read = self.connect_timeout, self.read_timeout
+        total = connect + read
+        if deadline is not None:
+            remaining = max(0, deadline - time.time())
+            connect, read, total = min(connect, remaining), min(read, remaining), min(total, remaining)
+        return aiohttp.ClientTimeout(sock_connect=connect, sock_read=read, total=total)
+
+    @classmethod
+    def get_host_breaker(cls, url):
+        host = urlsplit(url).hostname or ''
+        if host not in cls.host_breakers:
+            cls.host_breakers[host] = CircuitBreaker(name=host, **cls.host_breaker_config)
+        return cls.host_breakers[host]
+
+    async def _send_request(self, session, deadline=None):
+        async with session.get(self.get_url(), timeout=self.get_timeout(deadline)) as resp:
+            retry_after = parse_retry_after(resp.headers.get('Retry-After'))
+            if resp.status == 429 or (resp.status == 503 and retry_after is not None):
+                raise RateLimitedError(resp.status, retry_after=retry_after)
             data = await resp.read()
-            json_data = json.loads(data)
+            json_data = self.decode(data)
             return json_data
+
+    @classmethod
+    def decode(cls, raw):
+        return decoder.loads(raw)
     
     @classmethod
     def parse_orderbook(cls, data):
         raise NotImplementedError()
 
-    async def get_latest_orderbook(self, session, timestamp=None):
-        if not self.retry_status_ok():
-            print("Skip: [{}] [{}]. Retry after {} times.".format(self.name, self.symbol, self.retry_counter))
+    async def get_latest_orderbook(self, session, timestamp=None, deadline=None):
+        if not self.update_symbol(session) or not self.request_allowed():
+            return None
+
+        data = await self.fetch(session=session, deadline=deadline)
+        if data is None:
             return None
+        return self.build_record(data, timestamp=timestamp)
 
+    async def fetch(self, session, deadline=None):
         try:
-            data = await self._send_request(session=session)
+            return await self._send_request(session=session, deadline=deadline)
+        except RateLimitedError as e:
+            print("Rate limited by {}: {}".format(self.get_url(), e))
+            self.record_failure(retry_after=e.retry_after, host=True)
+            return None
         except (aiohttp.ClientConnectionError, asyncio.exceptions.TimeoutError):
             print("Cannot connect to {}".format(self.get_url()))
-            self.setup_retry()
+            self.record_failure(host=True)
             return None
         except (aiohttp.ContentTypeError, aiohttp.client_exceptions.ClientPayloadError, json.decoder.JSONDecodeError) as e:
             print("Cannot parse content from {}".format(self.get_url()))
-            self.setup_retry()
+            self.record_failure()
             return None
 
+    def build_record(self, data, timestamp=None):
         try:
             res = self.parse_orderbook(data)
         except (TypeError, KeyError) as e:
             print("Cannot parse data: [{}] [{}], url: {}".format(self.name, self.symbol, self.get_url()))
             # print(e)
-            self.setup_retry()
+            self.record_failure()
             return None
-        if isinstance(res, dict):
+        self.record_success()
+        if res is not None:
             if timestamp:
                 res['timestamp'] = timestamp
             res['exchange'] = self.name
@@ -74,14 +175,33 @@ class ExchangeBase:
     def initialize(cls):
         return
     
-    def retry_status_ok(self):
-        if self.retry_counter > 0:
-            self.retry_counter -= 1
+    def request_allowed(self):
+        breakers = (self.host_breaker, self.breaker)
+        for breaker in breakers:
+            if breaker.ready():
+                continue
+            if breaker.state == breaker.HALF_OPEN:
+                print("Skip: [{}] [{}]. Circuit [{}] is probing.".format(self.name, self.symbol, breaker.name))
+            else:
+                print("Skip: [{}] [{}]. Circuit [{}] open for {:.0f}s.".format(
+                    self.name, self.symbol, breaker.name, breaker.remaining()))
             return False
+        # Only take the half-open probes once every breaker lets the call through
+        for breaker in breakers:
+            breaker.allow()
         return True
-    
-    def setup_retry(self):
-        self.retry_counter = self.retry_count_down
+
+    def record_success(self):
+        self.breaker.record_success()
+        self.host_breaker.record_success()
+
+    def record_failure(self, retry_after=None, host=False):
+        """Count a failed poll. Connection errors and rate limiting
+            also count against the host.
+        """
+        self.breaker.record_failure(retry_after=retry_after)
+        if host:
+            self.host_breaker.record_failure(retry_after=retry_after)
 
 
 class ParseLayerBase(ExchangeBase):
@@ -92,52 +212,67 @@ class ParseLayerBase(ExchangeBase):
     price_pos = "price"   # or a number for list type
     amount_pos = "amount" # or a number for list type
     
-    # Key for the parsing output
-    price_key = "price"
-    amount_key = "amount"
-    
     @classmethod
     def preprocess_data(cls, data):
         return data
 
+    # Set when the venue returns asks ascending and bids descending,
+    # so that only the first `top_n` levels need to be parsed
+    depth_sorted = False
+
+    # Decode only the first `top_n` levels of each side for venues with
+    # large payloads. Requires `depth_sorted`. `partial_decode_root` is
+    # the path of keys the depth lives under, as used by `preprocess_data`.
+    partial_decode = False
+    partial_decode_root = ()
+
+    @classmethod
+    def decode(cls, raw):
+        if cls.partial_decode and cls.depth_sorted:
+            return decoder.loads_top_levels(raw, (cls.ask_key, cls.bid_key), cls.top_n, root=cls.partial_decode_root)
+        return super().decode(raw)
+
     @classmethod
     def parse_orderbook(cls, data):
         data = cls.preprocess_data(data)
 
-        asks = cls.parse_depth(data[cls.ask_key])
-        bids = cls.parse_depth(data[cls.bid_key])
-        if len(asks) < 1 or len(bids) < 1:
+        ask_price, ask_amount = cls.select_top(data[cls.ask_key], type='ask')
+        bid_price, bid_amount = cls.select_top(data[cls.bid_key], type='bid')
+        if len(ask_price) < 1 or len(bid_price) < 1:
             raise TypeError("Depth data length is 0.")
 
-        sorted_asks = cls.sort_price(asks, type='ask')[:cls.top_n]
-        sorted_bids = cls.sort_price(bids, type='bid')[:cls.top_n]
-        best_ask = sorted_asks[0][cls.price_key]
-        best_bid = sorted_bids[0][cls.price_key]
-        best_ask = float(best_ask)
-        best_bid = float(best_bid)
-
-        res = {
-            "best_ask": best_ask,
-            "best_bid": best_bid,
-            "depth": {
-                "ask": sorted_asks,
-                "bid": sorted_bids,
-            }
-        }            
-        return res
+        return OrderbookSnapshot(ask_price, ask_amount, bid_price, bid_amount)
 
     @classmethod
     def parse_depth(cls, depth_records):
-        return [
-            {cls.price_key: record[cls.price_pos], 
-            cls.amount_key: record[cls.amount_pos]} 
-            for record in depth_records
-        ]
+        prices = array('d', [float(record[cls.price_pos]) for record in depth_records])
+        amounts = array('d', [float(record[cls.amount_pos]) for record in depth_records])
+        return prices, amounts
+
+    @classmethod
+    def select_top(cls, depth_records, type="bid"):
+        """Return the (prices, amounts) arrays of the best `top_n` levels
+            of one side, best first. Prices are converted to float once
+            and only the selected levels are materialized.
+        """
+        if cls.depth_sorted:
+            prices, amounts = cls.parse_depth(depth_records[:cls.top_n])
+            if cls.is_sorted(prices, type=type):
+                return prices, amounts
+
+        price_pos = cls.price_pos
+        levels = ((float(record[price_pos]), record) for record in depth_records)
+        select = heapq.nlargest if type == "bid" else heapq.nsmallest
+        top = select(cls.top_n, levels, key=itemgetter(0))
+        prices = array('d', [price for price, _ in top])
+        amounts = array('d', [float(record[cls.amount_pos]) for _, record in top])
+        return prices, amounts
 
     @classmethod
-    def sort_price(cls, price_list, type="bid"):
-        reverse = type=="bid"
-        return sorted(price_list, key=lambda x: x[cls.price_key], reverse=reverse)
+    def is_sorted(cls, prices, type="bid"):
+        if type == "bid":
+            return all(a >= b for a, b in zip(prices, prices[1:]))
+        return all(a <= b for a, b in zip(prices, prices[1:]))
 
 
 class Bitbank(ParseLayerBase):
@@ -145,6 +280,7 @@ class Bitbank(ParseLayerBase):
     url = 'https://public.bitbank.cc/{0}/depth'
     price_pos = 0
     amount_pos = 1
+    depth_sorted = True
     
     @classmethod
     def preprocess_data(cls, data):
@@ -190,6 +326,8 @@ class Coincheck(ParseLayerBase):
 
     price_pos = 0
     amount_pos = 1
+    depth_sorted = True
+    partial_decode = True
 
 
 class BITPoint(ParseLayerBase):
@@ -212,33 +350,26 @@ class Quoine(ParseLayerBase):
     bid_key = 'buy_price_levels'
     price_pos = 0
     amount_pos = 1
+    read_timeout = 5  # Slow to answer: polls read until their deadline
     
+    remote_symbol_map = True
+    url_products = 'https://api.liquid.com/products'
+
     @classmethod
-    def load_symbol_map(cls):
+    async def fetch_symbol_map(cls, session):
         print("loading symbol map for " + cls.__name__)
-        import requests
-        url_products = 'https://api.liquid.com/products'
+        async with session.get(cls.url_products) as resp:
+            res = cls.decode(await resp.read())
 
         symbol_map = {}
-        try:
-            res = requests.get(url=url_products).json()
-            for record in res:
-                id = record["id"]
-                currency = record["currency"]
-                base_currency = record["base_currency"]
+        for record in res:
+            id = record["id"]
+            currency = record["currency"]
+            base_currency = record["base_currency"]
 
-                symbol = str.lower("{}_{}".format(base_currency, currency))
-                symbol_map[symbol] = id
-        except json.JSONDecodeError:
-            pass
-
-        # print(symbol_map)
-        cls.symbol_map = symbol_map
-
-    @classmethod
-    def initialize(cls):
-        if not cls.symbol_map:
-            cls.load_symbol_map()
+            symbol = str.lower("{}_{}".format(base_currency, currency))
+            symbol_map[symbol] = id
+        return symbol_map
 
 
 class Zaif(ParseLayerBase):
@@ -253,6 +384,10 @@ class Huobi(ParseLayerBase):
     url = 'https://api-cloud.huobi.co.jp/market/depth?symbol={0}&type=step0'
     price_pos = 0
     amount_pos = 1
+    depth_sorted = True
+    partial_decode = True
+    partial_decode_root = ('tick',)
+    read_timeout = 5  # Slow to answer: polls read until their deadline
     
     @classmethod
     def symbol_map(cls, symbol):
@@ -280,7 +415,12 @@ class BtcBox(ParseLayerBase):
 
 
 def get_quoine_products():
-    Quoine.load_symbol_map()
+
+    async def runner():
+        async with aiohttp.ClientSession() as session:
+            print(await Quoine.fetch_symbol_map(session=session))
+
+    asyncio.run(runner())
 
 
 def single_test():
@@ -1,11 +1,17 @@
-import time
+import os
 import asyncio
-import aiohttp
 import dotenv
 
 from exchanges import *
+from decoder import set_backend
 from version import print_version
-from utils import get_db_manager
+from utils import get_db_manager, get_bool_env
+from scheduler import PollScheduler
+from net import get_session
+from writer import WriteBehindQueue
+from detector import SpreadDetector
+from shard import ShardSupervisor
+from streaming import streaming_exchanges
 
 
 def construct_exchanges():
@@ -48,38 +54,69 @@ def construct_exchanges():
         BtcBox,
         ]
 
+    # Exchanges read from their depth stream instead of being polled
+    streamed = [e.strip() for e in os.environ.get("STREAM_EXCHANGES", "").split(",") if e.strip()]
+    for name in streamed:
+        if name not in streaming_exchanges:
+            raise ValueError("Streaming not supported for exchange: {}".format(name))
+    exchange_list = [streaming_exchanges[e.name] if e.name in streamed else e for e in exchange_list]
+    stream_interval = int(os.environ.get("STREAM_INTERVAL") or 0) or None
+
     exchanges = []
     for s in symbols:
         for e_class in exchange_list:
-            e = e_class(s)
+            interval = stream_interval if e_class.name in streamed else None
+            e = e_class(s, interval=interval)
             exchanges.append(e)
     return exchanges    
 
 
+def construct_detector():
+    if not get_bool_env("DETECTOR", True):
+        return None
+    excluded = os.environ.get("DETECTOR_EXCLUDED_EXCHANGES", "")
+    return SpreadDetector(
+        exclued_exchange=[e.strip() for e in excluded.split(",") if e.strip()],
+        group_delimiter=int(os.environ.get("DETECTOR_GROUP_DELIMITER", 60)),
+        minimun_earn_rate=float(os.environ.get("DETECTOR_MIN_EARN_RATE", 0.005)),
+    )
+
+
 async def runner():
 
-    exchanges = construct_exchanges()
+    n_workers = int(os.environ.get("COLLECTOR_WORKERS", 0))
 
     with get_db_manager() as db:
         db.create_tables_safe()
 
-        async with aiohttp.ClientSession() as session:
-            try:
-                while True:
-                    tasks = []
-                    timestamp = int(time.time())
-                    for e in exchanges:
-                        tasks.append(asyncio.ensure_future(e.get_latest_orderbook(session=session, timestamp=timestamp)))
-
-                    records = await asyncio.gather(*tasks)
-                    records = list(filter(lambda x: x is not None, records))
-                    for record in records:
-                        log_record(record)
-                    db.insert_records(records=records)
-                    
-                    time.sleep(2)
-            except KeyboardInterrupt:
-                print("Interruped...")
+        writer = WriteBehindQueue(db)
+        detector = construct_detector()
+
+        async def on_record(record):
+            log_record(record)
+            if detector:
+                detector.add(record)
+            await writer.put(record)
+
+        writer.start()
+        try:
+            if n_workers > 0:
+                # This process only writes, the pollers run in the workers
+                supervisor = ShardSupervisor(
+                    construct_exchanges, on_record=on_record, n_workers=n_workers,
+                    key=os.environ.get("COLLECTOR_SHARD_BY", "exchange"))
+                await supervisor.run()
+            else:
+                exchanges = construct_exchanges()
+                async with get_session() as session:
+                    scheduler = PollScheduler(exchanges, session=session, on_record=on_record)
+                    await scheduler.run()
+        except (KeyboardInterrupt, asyncio.CancelledError):
+            print("Interruped...")
+        finally:
+            if detector:
+                detector.flush()
+            await writer.close()
 
 
 def log_record(record):
@@ -92,6 +129,7 @@ def log_record(record):
 def main():
     dotenv.load_dotenv()
     print_version()
+    print("JSON backend: {}".format(set_backend(os.environ.get("JSON_DECODER"))))
     asyncio.run(runner())
     
 
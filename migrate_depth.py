@@ -0,0 +1,118 @@
+""" Convert the stored depth from the row layout (one depth row per level)
+    to the packed layout (one depth_packed blob per snapshot), using the
+    database, dtype and compression configured in .env.
+
+    Run from the repository root, with the collector stopped:
+        python migrate_depth.py [--drop]
+
+    The conversion is committed chunk by chunk and resumes after the last
+    converted snapshot when run again. Delta rows (DB_DELTA_DEPTH) are
+    replayed into full ladders. With --drop, the depth and depth_delta
+    tables are dropped at the end. Then set DB_DEPTH_LAYOUT=packed.
+"""
+import sys
+import time
+import dotenv
+import depthpack
+from orderbook import OrderBook
+from utils import get_db_manager
+
+chunk_size = 100000
+
+sql_select_rows = '''SELECT d.orderbook_id, o.exchange, o.symbol, o.timestamp, d.side, d.price, d.amount{delta_col}
+    FROM depth d JOIN {source} o ON o.id = d.orderbook_id{delta_join}
+    WHERE d.orderbook_id > {start}
+    ORDER BY d.orderbook_id, d.id;'''
+
+
+def iter_snapshots(reader, start):
+    """Yield (orderbook_id, exchange, symbol, timestamp, is_delta, rows) for
+        each orderbook row after `start` that has depth rows, rows being
+        (side, price, amount).
+    """
+    delta_col, delta_join = '', ''
+    if reader.delta_depth:
+        delta_col = ', m.orderbook_id'
+        delta_join = ' LEFT JOIN depth_delta m ON m.orderbook_id = d.orderbook_id'
+    sql = sql_select_rows.format(delta_col=delta_col, delta_join=delta_join, source=reader.orderbook_source, start=start)
+
+    current = None
+    rows = []
+    for _, chunk in reader.fetch_chunks(sql, chunk_size=chunk_size):
+        for r in chunk:
+            if current is not None and r[0] != current[0]:
+                yield current + (rows,)
+                rows = []
+            is_delta = len(r) > 7 and r[7] is not None
+            current = (r[0], r[1].strip(), r[2].strip(), r[3], is_delta)
+            rows.append((r[4].strip(), r[5], r[6]))
+    if current is not None:
+        yield current + (rows,)
+
+
+def migrate(drop=False):
+    # Books are rebuilt on their own connection: the stream of depth rows
+    # keeps the reader busy (unbuffered MySQL cursors) until it ends
+    with get_db_manager(read_only=True) as reader, get_db_manager(read_only=True) as lookup, get_db_manager() as writer:
+        writer.depth_layout = 'packed'
+        writer.create_tables_safe()
+        c = writer.conn.cursor()
+        if getattr(writer, 'partition', None):
+            # depth_packed partitions for the ranges already stored
+            writer.create_partitions(writer.list_partitions(c)['orderbook'])
+
+        c.execute("SELECT COALESCE(MAX(orderbook_id), 0) FROM depth_packed;")
+        start = c.fetchone()[0]
+        print(f"Converting depth after orderbook id {start}")
+
+        books = {}
+        batch = []
+        n_converted = 0
+        start_time = time.time()
+        for orderbook_id, exchange, symbol, timestamp, is_delta, rows in iter_snapshots(reader, start):
+            key = (exchange, symbol)
+            book = books.get(key)
+            if book is None:
+                book = books[key] = OrderBook()
+                if is_delta:
+                    # Resuming: rebuild the book stored just before this delta
+                    snapshot = lookup.load_depth(exchange, symbol, timestamp - 1)
+                    if snapshot is not None:
+                        book.apply(zip(snapshot.ask_price, snapshot.ask_amount), zip(snapshot.bid_price, snapshot.bid_amount))
+            if not is_delta:
+                book.clear()
+            for side, price, amount in rows:
+                # A None amount removes the level
+                book.update(side, price, amount)
+
+            ladders = depthpack.pack_record(book.snapshot(), dtype=writer.depth_dtype, compress=writer.depth_compress)
+            batch.append((orderbook_id, ladders) + writer.get_row_suffix({'timestamp': timestamp}))
+            if len(batch) >= chunk_size:
+                n_converted += flush(writer, batch)
+                batch = []
+                print(f"Converted {n_converted} snapshots ({time.time() - start_time:.1f}s)")
+        n_converted += flush(writer, batch)
+        print(f"Converted {n_converted} snapshots in {time.time() - start_time:.1f}s")
+
+        if drop:
+            for table in ('depth_delta', 'depth'):
+                c.execute(f"DROP TABLE IF EXISTS {table};")
+            writer.conn.commit()
+            print("Dropped the depth and depth_delta tables")
+
+
+def flush(writer, batch):
+    if batch:
+        c = writer.conn.cursor()
+        writer.write_rows(c, 'depth_packed', writer.depth_packed_columns, batch)
+        writer.conn.commit()
+    return len(batch)
+
+
+def main():
+    dotenv.load_dotenv()
+    migrate(drop='--drop' in sys.argv[1:])
+
+
+if __name__ == '__main__':
+    main()
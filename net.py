@@ -0,0 +1,34 @@
+import os
+import aiohttp
+
+
+def create_session(limit=100, limit_per_host=8, ttl_dns_cache=300, keepalive_timeout=30, total_timeout=30):
+    """Create the HTTP session shared by all the pollers.
+
+        - limit / limit_per_host: connection pool size, overall and per host
+        - ttl_dns_cache: seconds to cache DNS lookups
+        - keepalive_timeout: seconds to keep idle connections open for reuse
+        - total_timeout: upper bound for any request, in seconds. Polls
+          replace it with the connect/read timeouts of their exchange, cut
+          at the poll deadline (see `ExchangeBase.get_timeout`).
+    """
+    connector = aiohttp.TCPConnector(
+        limit=limit,
+        limit_per_host=limit_per_host,
+        use_dns_cache=True,
+        ttl_dns_cache=ttl_dns_cache,
+        keepalive_timeout=keepalive_timeout,
+    )
+    timeout = aiohttp.ClientTimeout(total=total_timeout)
+    return aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+
+def get_session():
+    session_config = {
+        "limit": int(os.environ.get("HTTP_POOL_LIMIT", 100)),
+        "limit_per_host": int(os.environ.get("HTTP_POOL_LIMIT_PER_HOST", 8)),
+        "ttl_dns_cache": int(os.environ.get("HTTP_DNS_CACHE_TTL", 300)),
+        "keepalive_timeout": float(os.environ.get("HTTP_KEEPALIVE_TIMEOUT", 30)),
+        "total_timeout": float(os.environ.get("HTTP_TOTAL_TIMEOUT", 30)),
+    }
+    return create_session(**session_config)
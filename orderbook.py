@@ -0,0 +1,220 @@
+from array import array
+from bisect import bisect_left, insort
+from collections.abc import Mapping
+
+
+class OrderbookSnapshot(Mapping):
+    """Top levels of one (exchange, symbol) book at one timestamp.
+
+        Prices and amounts of each side are stored in contiguous
+        `array('d')`, best level first. The snapshot can still be read
+        like the former record dict, e.g. `snapshot['best_ask']` or
+        `snapshot['depth']['ask'][0]['price']`.
+    """
+    __slots__ = (
+        'symbol', 'exchange', 'timestamp',
+        'ask_price', 'ask_amount', 'bid_price', 'bid_amount',
+    )
+
+    record_keys = ('symbol', 'best_ask', 'best_bid', 'timestamp', 'exchange', 'depth')
+    writable_keys = ('symbol', 'exchange', 'timestamp')
+
+    def __init__(self, ask_price, ask_amount, bid_price, bid_amount, symbol=None, exchange=None, timestamp=None) -> None:
+        self.ask_price = ask_price
+        self.ask_amount = ask_amount
+        self.bid_price = bid_price
+        self.bid_amount = bid_amount
+        self.symbol = symbol
+        self.exchange = exchange
+        self.timestamp = timestamp
+
+    @classmethod
+    def from_levels(cls, asks, bids, **kwargs):
+        """Build from two lists of (price, amount), best level first.
+        """
+        return cls(
+            array('d', [p for p, _ in asks]), array('d', [a for _, a in asks]),
+            array('d', [p for p, _ in bids]), array('d', [a for _, a in bids]),
+            **kwargs,
+        )
+
+    @property
+    def best_ask(self):
+        return self.ask_price[0]
+
+    @property
+    def best_bid(self):
+        return self.bid_price[0]
+
+    @property
+    def depth(self):
+        """Dict view of the ladders, built on demand.
+        """
+        return {
+            'ask': [{'price': p, 'amount': a} for p, a in zip(self.ask_price, self.ask_amount)],
+            'bid': [{'price': p, 'amount': a} for p, a in zip(self.bid_price, self.bid_amount)],
+        }
+
+    def depth_rows(self, orderbook_id):
+        """Yield the (orderbook_id, side, price, amount) rows of the depth table.
+        """
+        for side, prices, amounts in (
+                ('ask', self.ask_price, self.ask_amount),
+                ('bid', self.bid_price, self.bid_amount)):
+            for price, amount in zip(prices, amounts):
+                yield (orderbook_id, side, price, amount)
+
+    def __getitem__(self, key):
+        if key in self.record_keys:
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key not in self.writable_keys:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __iter__(self):
+        return iter(self.record_keys)
+
+    def __len__(self):
+        return len(self.record_keys)
+
+    def __repr__(self):
+        return "OrderbookSnapshot(symbol={!r}, exchange={!r}, timestamp={!r}, best_ask={}, best_bid={}, levels={}/{})".format(
+            self.symbol, self.exchange, self.timestamp, self.best_ask, self.best_bid,
+            len(self.ask_price), len(self.bid_price),
+        )
+
+
+class BookSide:
+    """One side of an `OrderBook`: the amount of each price level, and the
+        prices in a sorted list with the best level last.
+
+        Bids are sorted by price and asks by negated price, so that the best
+        level is the last item on both sides. Updating the amount of an
+        existing level is a dict lookup. Adding or removing a level is a
+        binary search, plus moving the levels better than it, which are few
+        since most updates happen near the top of the book.
+    """
+    __slots__ = ('amounts', 'keys', 'sign')
+
+    def __init__(self, is_bid) -> None:
+        self.amounts = {}
+        self.keys = []
+        self.sign = 1 if is_bid else -1
+
+    def __len__(self):
+        return len(self.keys)
+
+    def set(self, price, amount):
+        """Set the amount of a level, an amount of 0 or None removing it.
+        """
+        amounts = self.amounts
+        if amount:
+            if price not in amounts:
+                insort(self.keys, self.sign * price)
+            amounts[price] = amount
+        elif price in amounts:
+            del amounts[price]
+            keys = self.keys
+            del keys[bisect_left(keys, self.sign * price)]
+
+    def remove_from(self, price):
+        """Remove the levels at `price` or better, e.g. the bids at or
+            above a new best ask.
+        """
+        keys = self.keys
+        i = bisect_left(keys, self.sign * price)
+        for key in keys[i:]:
+            del self.amounts[self.sign * key]
+        del keys[i:]
+
+    def clear(self):
+        self.amounts.clear()
+        self.keys.clear()
+
+    def best(self):
+        return self.sign * self.keys[-1] if self.keys else None
+
+    def top(self, k=None):
+        """Return the (prices, amounts) arrays of the best `k` levels, or of
+            all of them, best first.
+        """
+        keys = self.keys[-k:] if k else self.keys
+        sign = self.sign
+        prices = array('d', [sign * key for key in reversed(keys)])
+        amounts = self.amounts
+        return prices, array('d', [amounts[price] for price in prices])
+
+
+class OrderBook:
+    """Live L2 book of one (exchange, symbol), updated level by level from
+        streams or stored deltas.
+
+        Updates cost a dict lookup, or a binary search when a level appears
+        or disappears. The best prices are read in O(1) and the top `k`
+        levels in O(k), exported as an `OrderbookSnapshot` whose `array('d')`
+        ladders NumPy reads without copy (`np.frombuffer`).
+    """
+    __slots__ = ('asks', 'bids', 'symbol', 'exchange')
+
+    def __init__(self, symbol=None, exchange=None) -> None:
+        self.asks = BookSide(is_bid=False)
+        self.bids = BookSide(is_bid=True)
+        self.symbol = symbol
+        self.exchange = exchange
+
+    @classmethod
+    def from_levels(cls, asks, bids, **kwargs):
+        """Build from two iterables of (price, amount), in any order.
+        """
+        book = cls(**kwargs)
+        book.apply(asks, bids)
+        return book
+
+    def side(self, side):
+        """Side by name, 'ask' or 'bid' as in the depth table.
+        """
+        return self.bids if side == 'bid' else self.asks
+
+    def update(self, side, price, amount):
+        self.side(side).set(price, amount)
+
+    def apply(self, asks=(), bids=()):
+        """Apply two iterables of (price, amount), an amount of 0 or None
+            removing the level.
+        """
+        for price, amount in asks:
+            self.asks.set(price, amount)
+        for price, amount in bids:
+            self.bids.set(price, amount)
+
+    def clear(self):
+        self.asks.clear()
+        self.bids.clear()
+
+    @property
+    def best_ask(self):
+        return self.asks.best()
+
+    @property
+    def best_bid(self):
+        return self.bids.best()
+
+    def is_crossed(self):
+        return bool(self.asks) and bool(self.bids) and self.bids.best() >= self.asks.best()
+
+    def snapshot(self, k=None, timestamp=None):
+        """`OrderbookSnapshot` of the best `k` levels of each side, or of
+            the whole book.
+        """
+        ask_price, ask_amount = self.asks.top(k)
+        bid_price, bid_amount = self.bids.top(k)
+        return OrderbookSnapshot(ask_price, ask_amount, bid_price, bid_amount,
+                                 symbol=self.symbol, exchange=self.exchange, timestamp=timestamp)
+
+    def __repr__(self):
+        return "OrderBook(symbol={!r}, exchange={!r}, best_ask={}, best_bid={}, levels={}/{})".format(
+            self.symbol, self.exchange, self.best_ask, self.best_bid, len(self.asks), len(self.bids),
+        )
@@ -0,0 +1,78 @@
+import time
+import asyncio
+
+
+def next_tick(now, interval):
+    """Return the first epoch-aligned tick strictly after `now`.
+    """
+    return (int(now // interval) + 1) * interval
+
+
+class PollScheduler:
+    """Poll each exchange on fixed wall-clock ticks aligned to the epoch.
+
+        Every poller runs in its own loop with its own interval, so a slow
+        venue never delays a fast one. When a fetch overruns one or more
+        ticks, the missed ticks are skipped instead of being queued up.
+
+        Each fetch has a hard deadline, `deadline` seconds after its tick
+        (by default just before the next tick). The exchange timeouts are
+        cut short to end at the deadline, so that a hanging request fails
+        and is counted by the circuit breakers. Fetches still running
+        `cancel_grace` seconds after the deadline are cancelled, their
+        records dropped, and counted as failures as well.
+    """
+    default_interval = 2  # In seconds
+    deadline = None  # In seconds after the tick
+    deadline_ratio = 0.9  # Default deadline, as a fraction of the interval
+    cancel_grace = 0.05  # In seconds
+
+    def __init__(self, pollers, session, on_record, default_interval=None, deadline=None) -> None:
+        self.pollers = pollers
+        self.session = session
+        self.on_record = on_record
+        if default_interval:
+            self.default_interval = default_interval
+        if deadline:
+            self.deadline = deadline
+        self.skipped_ticks = 0
+        self.dropped_polls = 0
+
+    def get_interval(self, poller):
+        return getattr(poller, 'interval', None) or self.default_interval
+
+    async def run(self):
+        await asyncio.gather(*[self.poll_forever(p) for p in self.pollers])
+
+    async def poll_forever(self, poller):
+        interval = self.get_interval(poller)
+        tick = next_tick(time.time(), interval)
+        while True:
+            await asyncio.sleep(max(0, tick - time.time()))
+            await self.poll_once(poller, tick, deadline=tick + (self.deadline or interval * self.deadline_ratio))
+
+            # The sleep may wake up slightly early, so never fire the same tick twice
+            upcoming = max(next_tick(time.time(), interval), tick + interval)
+            missed = round((upcoming - tick) / interval) - 1
+            if missed > 0:
+                self.skipped_ticks += missed
+                print("Overrun: [{}] [{}]. Skipped {} tick(s).".format(
+                    getattr(poller, 'name', poller), getattr(poller, 'symbol', ''), missed))
+            tick = upcoming
+
+    async def poll_once(self, poller, tick, deadline):
+        try:
+            record = await asyncio.wait_for(
+                poller.get_latest_orderbook(session=self.session, timestamp=int(tick), deadline=deadline),
+                timeout=max(0, deadline - time.time()) + self.cancel_grace,
+            )
+        except asyncio.TimeoutError:
+            self.dropped_polls += 1
+            record_failure = getattr(poller, 'record_failure', None)
+            if record_failure:
+                record_failure(host=True)
+            print("Deadline exceeded: [{}] [{}]. Dropped tick {}.".format(
+                getattr(poller, 'name', poller), getattr(poller, 'symbol', ''), int(tick)))
+            return
+        if record is not None:
+            await self.on_record(record)
@@ -0,0 +1,210 @@
+import os
+import time
+import asyncio
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+
+from scheduler import PollScheduler
+from net import get_session
+
+
+def shard_exchanges(exchanges, n_shards, key='exchange'):
+    """Split the exchanges into `n_shards` lists, keeping all the instances
+        of an exchange (or of a symbol, with key='symbol') in the same one.
+        The assignment only depends on the names, so a restarted worker
+        gets the same shard.
+    """
+    if key not in ('exchange', 'symbol'):
+        raise ValueError("Shard key not supported: {}".format(key))
+    attr = 'name' if key == 'exchange' else 'symbol'
+    names = sorted({getattr(e, attr) for e in exchanges})
+    shard_of = {name: i % n_shards for i, name in enumerate(names)}
+    shards = [[] for _ in range(n_shards)]
+    for e in exchanges:
+        shards[shard_of[getattr(e, attr)]].append(e)
+    return shards
+
+
+def run_worker(index, n_shards, key, construct_exchanges, conn, heartbeat_interval):
+    """Entry point of a worker process: poll one shard on its own event loop
+        and HTTP session, and send the records to the supervisor over `conn`.
+    """
+    try:
+        asyncio.run(worker_main(index, n_shards, key, construct_exchanges, conn, heartbeat_interval))
+    except (KeyboardInterrupt, BrokenPipeError, EOFError):
+        # Interrupted along with the supervisor, or the supervisor is gone
+        pass
+
+
+async def worker_main(index, n_shards, key, construct_exchanges, conn, heartbeat_interval):
+    pollers = shard_exchanges(construct_exchanges(), n_shards, key=key)[index]
+    print("Worker {}/{} [pid {}]: {} exchanges".format(index, n_shards, os.getpid(), len(pollers)))
+
+    loop = asyncio.get_event_loop()
+    # Sends block when the pipe is full, i.e. when the writer lags behind.
+    # They run on a thread so that the pollers wait for them without
+    # blocking the event loop.
+    sender = ThreadPoolExecutor(max_workers=1, thread_name_prefix='shard-sender')
+
+    async def on_record(record):
+        await loop.run_in_executor(sender, conn.send, ('record', record))
+
+    async with get_session() as session:
+        scheduler = PollScheduler(pollers, session=session, on_record=on_record)
+
+        async def heartbeat_forever():
+            while True:
+                stats = {
+                    'pid': os.getpid(),
+                    'skipped_ticks': scheduler.skipped_ticks,
+                    'dropped_polls': scheduler.dropped_polls,
+                }
+                await loop.run_in_executor(sender, conn.send, ('heartbeat', stats))
+                await asyncio.sleep(heartbeat_interval)
+
+        await asyncio.gather(scheduler.run(), heartbeat_forever())
+
+
+class Worker:
+    """Supervisor side of a worker process: the process, the receiving end
+        of its pipe and the thread reading it.
+    """
+    def __init__(self, index) -> None:
+        self.index = index
+        self.process = None
+        self.conn = None
+        self.reader = None
+        self.last_seen = 0
+        self.stats = {}
+        self.started = 0
+        self.restarts = 0
+        self.restart_at = 0
+
+
+class ShardSupervisor:
+    """Run the pollers in `n_workers` processes instead of one event loop.
+
+        The exchanges are split by exchange or by symbol (see
+        `shard_exchanges`). Each worker builds its own exchanges, event loop
+        and HTTP session, and streams its records back over a local pipe.
+        The supervisor stays the single writer: `on_record` runs on its
+        event loop, and a slow `on_record` (e.g. a full write queue) pushes
+        back on the workers through the pipes.
+
+        A worker that exits, or that sent neither a record nor a heartbeat
+        for `heartbeat_timeout` seconds, is killed and started again. The
+        restart delay doubles for a worker failing again within
+        `stable_after` seconds, up to `max_restart_delay`.
+    """
+    heartbeat_interval = 5  # In seconds
+    heartbeat_timeout = 30  # In seconds
+    check_interval = 1  # In seconds
+    base_restart_delay = 1  # In seconds
+    max_restart_delay = 60  # In seconds
+    stable_after = 300  # In seconds
+
+    def __init__(self, construct_exchanges, on_record, n_workers=2, key='exchange',
+                 heartbeat_timeout=None) -> None:
+        self.construct_exchanges = construct_exchanges
+        self.on_record = on_record
+        self.n_workers = n_workers
+        self.key = key
+        if heartbeat_timeout:
+            self.heartbeat_timeout = heartbeat_timeout
+        # Spawn: workers do not inherit the supervisor's threads and loop
+        self.context = multiprocessing.get_context('spawn')
+        self.workers = [Worker(i) for i in range(n_workers)]
+        self.loop = None
+        self.stopping = False
+
+    async def run(self):
+        self.loop = asyncio.get_event_loop()
+        for worker in self.workers:
+            self.start_worker(worker)
+        try:
+            while True:
+                await asyncio.sleep(self.check_interval)
+                await self.check_workers()
+        finally:
+            await self.stop()
+
+    def start_worker(self, worker):
+        receiver, sender = self.context.Pipe(duplex=False)
+        worker.process = self.context.Process(
+            target=run_worker,
+            args=(worker.index, self.n_workers, self.key, self.construct_exchanges,
+                  sender, self.heartbeat_interval),
+            name='collector-{}'.format(worker.index),
+            daemon=True,
+        )
+        worker.process.start()
+        # Only the child keeps the sending end, so that its exit ends recv()
+        sender.close()
+        worker.conn = receiver
+        worker.started = worker.last_seen = time.monotonic()
+        worker.reader = threading.Thread(target=self.receive_forever, args=(worker, receiver),
+                                         name='shard-reader-{}'.format(worker.index), daemon=True)
+        worker.reader.start()
+
+    def receive_forever(self, worker, conn):
+        while not self.stopping:
+            try:
+                kind, payload = conn.recv()
+            except (EOFError, OSError):
+                return
+            # Records show the worker is alive as well, even when a
+            # backlog in the pipe delays its heartbeats
+            worker.last_seen = time.monotonic()
+            if kind == 'record':
+                future = asyncio.run_coroutine_threadsafe(self.on_record(payload), self.loop)
+                try:
+                    future.result()
+                except Exception as e:
+                    print("Cannot handle record from worker {}: {}".format(worker.index, e))
+            elif kind == 'heartbeat':
+                worker.stats = payload
+
+    async def check_workers(self):
+        now = time.monotonic()
+        for worker in self.workers:
+            if worker.process is None:
+                if now >= worker.restart_at:
+                    self.start_worker(worker)
+                continue
+
+            if not worker.process.is_alive():
+                reason = "exited with code {}".format(worker.process.exitcode)
+            elif now - worker.last_seen > self.heartbeat_timeout:
+                reason = "silent for {:.0f}s".format(now - worker.last_seen)
+            else:
+                continue
+
+            await self.loop.run_in_executor(None, self.kill_worker, worker)
+            if now - worker.started > self.stable_after:
+                worker.restarts = 0
+            delay = min(self.base_restart_delay * 2 ** worker.restarts, self.max_restart_delay)
+            worker.restarts += 1
+            worker.restart_at = now + delay
+            print("Worker {} {}, restarting in {}s. Last stats: {}".format(worker.index, reason, delay, worker.stats))
+
+    def kill_worker(self, worker, timeout=5):
+        """Terminate the process of a worker and wait for it. Blocking, run
+            it in an executor from the event loop.
+        """
+        process = worker.process
+        if process.is_alive():
+            process.terminate()
+            process.join(timeout)
+            if process.is_alive():
+                process.kill()
+        process.join()
+        worker.conn.close()
+        worker.process = None
+
+    async def stop(self):
+        self.stopping = True
+        await asyncio.gather(*(
+            self.loop.run_in_executor(None, self.kill_worker, worker)
+            for worker in self.workers if worker.process is not None
+        ))
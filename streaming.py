@@ -0,0 +1,315 @@
+import json
+import time
+import asyncio
+import aiohttp
+import decoder
+from exchanges import ParseLayerBase, Bitbank, Bitflyer, Coincheck
+from orderbook import OrderBook
+
+
+class StreamSyncError(Exception):
+    """The local book cannot be kept in sync with the stream: a message
+        was missed or came out of order, or no snapshot could be loaded.
+    """
+
+
+class StreamingLayerBase(ParseLayerBase):
+    """Keep a local book from the depth stream of the exchange, and serve
+        its top levels when polled.
+
+        The stream runs in a background task started by the first poll,
+        over a WebSocket of the poller's session. The book is loaded from
+        a snapshot, then updated with the diffs. Diffs received before the
+        snapshot are buffered and replayed on top of it. When the exchange
+        numbers its messages, diffs already in the snapshot are dropped,
+        and a gap or a message out of order resyncs the book from a new
+        connection.
+
+        `PollScheduler` still polls the instance on its ticks, so records
+        are emitted every `interval` seconds with the same timestamps as
+        the other exchanges, but without any request. Nothing is emitted
+        while the book is not in sync.
+
+        Subclasses combine this class with the polled exchange class,
+        e.g. `class BitbankStream(StreamingLayerBase, Bitbank)`, and
+        implement `subscribe` and `on_message`.
+    """
+    stream_url = ''
+    ws_heartbeat = 30  # Seconds between WebSocket pings
+    reconnect_delay = 1  # In seconds
+    max_reconnect_delay = 60  # In seconds
+    max_pending = 1000  # Diffs buffered while waiting for the snapshot
+
+    # Set when the exchange numbers its diffs one by one, so that a gap
+    # can be detected. Otherwise sequence numbers only have to increase.
+    sequence_contiguous = False
+    # Remove the levels of the other side crossed by an update, for
+    # exchanges that do not always send the removal of filled levels
+    prune_crossed = False
+
+    def __init__(self, symbol='btc_jpy', interval=None) -> None:
+        super().__init__(symbol=symbol, interval=interval)
+        self.task = None
+        self.ws = None
+        self.messages = 0
+        self.bytes_received = 0
+        self.resyncs = 0
+        self.reset_book()
+
+    def get_stream_url(self):
+        return self.stream_url.format(self.formatted_symbol)
+
+    async def get_latest_orderbook(self, session, timestamp=None, deadline=None):
+        if not self.update_symbol(session):
+            return None
+        if self.task is None or self.task.done():
+            if self.task is not None and not self.task.cancelled() and self.task.exception():
+                print("Stream stopped: [{}] [{}] {!r}".format(self.name, self.symbol, self.task.exception()))
+            self.task = asyncio.ensure_future(self.stream_forever(session))
+            return None
+        if not self.synced:
+            return None
+
+        res = self.get_snapshot()
+        if res is not None:
+            if timestamp:
+                res['timestamp'] = timestamp
+            res['exchange'] = self.name
+            res['symbol'] = self.symbol
+        return res
+
+    def get_snapshot(self):
+        """Top `top_n` levels of the local book, or None when a side is
+            empty or the book is crossed (then it is resynced).
+        """
+        book = self.book
+        if not book.asks or not book.bids:
+            return None
+        if book.is_crossed():
+            self.resync("crossed book, bid {} >= ask {}".format(book.best_bid, book.best_ask))
+            return None
+        return book.snapshot(self.top_n)
+
+    async def stream_forever(self, session):
+        delay = self.reconnect_delay
+        while True:
+            connected = time.monotonic()
+            try:
+                await self.stream(session)
+                reason = "connection closed"
+            except StreamSyncError as e:
+                reason = str(e)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                reason = "connection error {!r}".format(e)
+            except (TypeError, KeyError, IndexError, ValueError) as e:
+                # json.JSONDecodeError is a ValueError
+                reason = "cannot parse message {!r}".format(e)
+            self.reset_book()
+
+            if time.monotonic() - connected > self.max_reconnect_delay:
+                delay = self.reconnect_delay
+            print("Stream: [{}] [{}] {}, reconnecting in {}s.".format(self.name, self.symbol, reason, delay))
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.max_reconnect_delay)
+
+    async def stream(self, session):
+        async with session.ws_connect(self.get_stream_url(), heartbeat=self.ws_heartbeat) as ws:
+            self.ws = ws
+            try:
+                await self.subscribe(ws, session)
+                async for msg in ws:
+                    if msg.type in (aiohttp.WSMsgType.TEXT, aiohttp.WSMsgType.BINARY):
+                        self.messages += 1
+                        self.bytes_received += len(msg.data)
+                        await self.on_message(ws, msg.data)
+                    elif msg.type == aiohttp.WSMsgType.ERROR:
+                        raise aiohttp.ClientError(ws.exception())
+            finally:
+                self.ws = None
+
+    async def subscribe(self, ws, session):
+        raise NotImplementedError()
+
+    async def on_message(self, ws, data):
+        """Handle one message, calling `on_snapshot` or `on_diff` for
+            depth messages.
+        """
+        raise NotImplementedError()
+
+    def reset_book(self):
+        self.book = OrderBook(symbol=self.symbol, exchange=self.name)
+        self.sequence = None
+        self.synced = False
+        self.pending = []
+
+    def resync(self, reason):
+        """Drop the book and reconnect, e.g. when it is found inconsistent.
+        """
+        print("Resync: [{}] [{}] {}.".format(self.name, self.symbol, reason))
+        self.resyncs += 1
+        self.reset_book()
+        if self.ws is not None:
+            asyncio.ensure_future(self.ws.close())
+
+    def on_snapshot(self, asks, bids, sequence=None):
+        """Replace the book with lists of (price, amount), then apply the
+            diffs buffered until now.
+        """
+        self.book.clear()
+        self.book.apply(asks, bids)
+        self.sequence = sequence
+        self.synced = True
+        pending, self.pending = self.pending, []
+        for diff in pending:
+            self.on_diff(*diff)
+
+    def on_diff(self, asks, bids, sequence=None):
+        """Apply lists of (price, amount), an amount of 0 removing the level.
+        """
+        if not self.synced:
+            if len(self.pending) >= self.max_pending:
+                raise StreamSyncError("no snapshot after {} diffs".format(len(self.pending)))
+            self.pending.append((asks, bids, sequence))
+            return
+        if sequence is not None and self.sequence is not None:
+            if sequence <= self.sequence:
+                # Already in the snapshot
+                return
+            if self.sequence_contiguous and sequence != self.sequence + 1:
+                raise StreamSyncError("sequence {} after {}".format(sequence, self.sequence))
+        if sequence is not None:
+            self.sequence = sequence
+
+        self.book.apply(asks, bids)
+        if self.prune_crossed:
+            lowest_ask = min((price for price, amount in asks if amount), default=None)
+            if lowest_ask is not None:
+                self.book.bids.remove_from(lowest_ask)
+            highest_bid = max((price for price, amount in bids if amount), default=None)
+            if highest_bid is not None:
+                self.book.asks.remove_from(highest_bid)
+
+    @classmethod
+    def parse_levels(cls, levels):
+        price_pos = cls.price_pos
+        amount_pos = cls.amount_pos
+        return [(float(level[price_pos]), float(level[amount_pos])) for level in levels]
+
+
+class BitbankStream(StreamingLayerBase, Bitbank):
+    """Rooms depth_whole (full book, every few seconds) and depth_diff,
+        numbered with the same increasing sequence, over Socket.IO.
+    """
+    stream_url = 'wss://stream.bitbank.cc/socket.io/?EIO=4&transport=websocket'
+
+    async def subscribe(self, ws, session):
+        # Rooms are joined once the Socket.IO handshake is done
+        return
+
+    async def on_message(self, ws, data):
+        # Engine.IO packets: 0 open, 2 ping, 4 message. Socket.IO packets
+        # inside a message: 0 connect, 2 event.
+        if data == '2':
+            await ws.send_str('3')
+        elif data.startswith('0'):
+            await ws.send_str('40')
+        elif data.startswith('40'):
+            # Diffs first, so that none is missed before the first snapshot
+            for room in ('depth_diff_', 'depth_whole_'):
+                await ws.send_str('42' + json.dumps(['join-room', room + self.formatted_symbol]))
+        elif data.startswith('42'):
+            event = decoder.loads(data[2:])
+            if event[0] != 'message':
+                return
+            room = event[1]['room_name']
+            book = event[1]['message']['data']
+            if room.startswith('depth_whole_'):
+                self.on_snapshot(self.parse_levels(book['asks']), self.parse_levels(book['bids']), int(book['sequenceId']))
+            elif room.startswith('depth_diff_'):
+                self.on_diff(self.parse_levels(book['a']), self.parse_levels(book['b']), int(book['s']))
+
+
+class BitflyerStream(StreamingLayerBase, Bitflyer):
+    """Channels lightning_board_snapshot and lightning_board over JSON-RPC.
+        The diffs are not numbered, and do not always remove the levels
+        that were filled, hence `prune_crossed`.
+    """
+    stream_url = 'wss://ws.lightstream.bitflyer.com/json-rpc'
+    prune_crossed = True
+
+    def get_channels(self):
+        product_code = str(self.formatted_symbol).upper()
+        return 'lightning_board_' + product_code, 'lightning_board_snapshot_' + product_code
+
+    async def subscribe(self, ws, session):
+        # Diffs first, so that none is missed before the first snapshot
+        for i, channel in enumerate(self.get_channels()):
+            await ws.send_str(json.dumps({'method': 'subscribe', 'params': {'channel': channel}, 'id': i}))
+
+    async def on_message(self, ws, data):
+        message = decoder.loads(data)
+        if message.get('method') != 'channelMessage':
+            return
+        channel = message['params']['channel']
+        book = message['params']['message']
+        asks = self.parse_levels(book['asks'])
+        bids = self.parse_levels(book['bids'])
+        if channel.startswith('lightning_board_snapshot_'):
+            self.on_snapshot(asks, bids)
+        else:
+            self.on_diff(asks, bids)
+
+
+class CoincheckStream(StreamingLayerBase, Coincheck):
+    """Channel {pair}-orderbook sends diffs only, the snapshot is loaded
+        from the REST endpoint once subscribed, then again every
+        `snapshot_interval` seconds.
+
+        The diffs are not numbered, so the ones received while the
+        snapshot loads cannot be told apart from the ones it already
+        includes. They are dropped rather than replayed over it, where a
+        stale one could bring back a level filled since, and the periodic
+        snapshot repairs the changes missed that way.
+    """
+    stream_url = 'wss://ws-api.coincheck.com/'
+    partial_decode = False  # The snapshot needs every level
+    snapshot_interval = 300  # In seconds
+
+    async def stream(self, session):
+        self.snapshot_task = None
+        try:
+            await super().stream(session)
+        finally:
+            if self.snapshot_task is not None:
+                self.snapshot_task.cancel()
+
+    async def subscribe(self, ws, session):
+        await ws.send_str(json.dumps({'type': 'subscribe', 'channel': '{}-orderbook'.format(self.formatted_symbol)}))
+        # Loaded next to the stream, whose diffs are buffered meanwhile
+        self.snapshot_task = asyncio.ensure_future(self.load_snapshots(session))
+
+    async def load_snapshots(self, session):
+        while True:
+            data = await self.fetch(session=session)
+            try:
+                # fetch returns None on errors
+                data = self.preprocess_data(data)
+                asks, bids = self.parse_levels(data[self.ask_key]), self.parse_levels(data[self.bid_key])
+            except (TypeError, KeyError, IndexError, ValueError) as e:
+                if not self.synced:
+                    self.resync("cannot load the snapshot {!r}".format(e))
+                    return
+            else:
+                self.pending = []
+                self.on_snapshot(asks, bids)
+            await asyncio.sleep(self.snapshot_interval)
+
+    async def on_message(self, ws, data):
+        message = decoder.loads(data)
+        if not isinstance(message, list) or message[0] != self.formatted_symbol:
+            return
+        book = message[1]
+        self.on_diff(self.parse_levels(book['asks']), self.parse_levels(book['bids']))
+
+
+streaming_exchanges = {e.name: e for e in (BitbankStream, BitflyerStream, CoincheckStream)}
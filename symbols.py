@@ -0,0 +1,89 @@
+import os
+import json
+import time
+import asyncio
+import aiohttp
+
+
+class SymbolRegistry:
+    """Symbol maps that exchanges publish through their own API.
+
+        Maps are loaded lazily: the disk cache is read the first time an
+        exchange asks for its map, and a refresh is started in the
+        background through the shared session whenever the map is missing
+        or older than `ttl`. Callers never wait on the network; they get
+        the cached map, possibly stale, or None until the first refresh
+        succeeds. A failed refresh is retried after `retry_interval`.
+    """
+    cache_dir = 'data/symbol_cache'
+    ttl = 24 * 3600  # In seconds
+    retry_interval = 60  # In seconds
+
+    def __init__(self, cache_dir=None, ttl=None, retry_interval=None) -> None:
+        if cache_dir:
+            self.cache_dir = cache_dir
+        if ttl:
+            self.ttl = ttl
+        if retry_interval:
+            self.retry_interval = retry_interval
+        self.maps = {}
+        self.loaded_at = {}
+        self.failed_at = {}
+        self.tasks = {}
+
+    def get(self, e_class, session=None):
+        """Return the symbol map of `e_class`, or None if not loaded yet.
+            With a session, start a background refresh when needed.
+        """
+        name = e_class.name
+        if name not in self.maps:
+            self.load_cache(name)
+        if session is not None and self.needs_refresh(name) and name not in self.tasks:
+            self.tasks[name] = asyncio.ensure_future(self.refresh(e_class, session))
+        return self.maps.get(name)
+
+    def needs_refresh(self, name):
+        now = time.time()
+        if now - self.failed_at.get(name, 0) < self.retry_interval:
+            return False
+        return name not in self.maps or now - self.loaded_at.get(name, 0) > self.ttl
+
+    async def refresh(self, e_class, session):
+        name = e_class.name
+        try:
+            symbol_map = await e_class.fetch_symbol_map(session)
+            if not symbol_map:
+                raise ValueError("Empty symbol map")
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError, KeyError, TypeError) as e:
+            print("Cannot load symbol map for {}: {}".format(name, e))
+            self.failed_at[name] = time.time()
+            return None
+        finally:
+            self.tasks.pop(name, None)
+
+        print("Loaded symbol map for {}: {} symbols".format(name, len(symbol_map)))
+        self.maps[name] = symbol_map
+        self.loaded_at[name] = time.time()
+        self.save_cache(name)
+        return symbol_map
+
+    def get_cache_fn(self, name):
+        return os.path.join(self.cache_dir, "{}.json".format(name))
+
+    def load_cache(self, name):
+        try:
+            with open(self.get_cache_fn(name), 'r') as f:
+                cached = json.load(f)
+            self.maps[name] = cached['symbol_map']
+            self.loaded_at[name] = cached['loaded_at']
+        except (FileNotFoundError, ValueError, KeyError, TypeError):
+            pass
+
+    def save_cache(self, name):
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        with open(self.get_cache_fn(name), 'w') as f:
+            json.dump({'loaded_at': self.loaded_at[name], 'symbol_map': self.maps[name]}, f)
+
+
+registry = SymbolRegistry()
@@ -1,7 +1,10 @@
 import os
 from dbmanager import PsqlManager, MysqlManager, SqliteManager
 
-def get_db_manager():
+def get_db_manager(read_only=False):
+    """ With read_only, SQLite opens a read-only connection that can run
+        next to the collector. The server databases ignore it.
+    """
     engine = os.environ.get("USE_DB", "sqlite")
     engine = engine.lower()
 
@@ -10,10 +13,16 @@ def get_db_manager():
     elif engine in ["postgres", "psql", "postgresql"]:
         return get_postgres()
     elif engine == "sqlite":
-        return get_sqlite()
+        return get_sqlite(read_only=read_only)
     
     print(f"DB manager type not supported: {engine}")
 
+def get_bool_env(name, default=False):
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.lower() in ["1", "true", "yes", "on"]
+
 def get_mysql():
     db_config = {
         "host":  os.environ.get("MYSQL_HOST", "localhost"),
@@ -21,7 +30,13 @@ def get_mysql():
         "password":  os.environ.get("MYSQL_PASSWORD", "password"),
         "port":  os.environ.get("MYSQL_PORT", 3306),
         "database": os.environ.get("MYSQL_DB_NAME", "orderbook_db"),
-        
+        "bulk_insert": get_bool_env("DB_BULK_INSERT", True),
+        "normalized": get_bool_env("DB_NORMALIZED", False),
+        "delta_depth": get_bool_env("DB_DELTA_DEPTH", False),
+        "keyframe_interval": int(os.environ.get("DB_KEYFRAME_INTERVAL", 600)),
+        "depth_layout": os.environ.get("DB_DEPTH_LAYOUT", "rows"),
+        "depth_dtype": os.environ.get("DB_DEPTH_DTYPE", "f8"),
+        "depth_compress": get_bool_env("DB_DEPTH_COMPRESS", False),
     }
     return MysqlManager(**db_config)
     
@@ -32,13 +47,35 @@ def get_postgres():
         "password":  os.environ.get("POSTGRES_PASSWORD", "password"),
         "port":  os.environ.get("POSTGRES_PORT", 5432),
         "database": os.environ.get("POSTGRES_DB_NAME", "orderbook_db"),
+        "bulk_insert": get_bool_env("DB_BULK_INSERT", True),
+        "normalized": get_bool_env("DB_NORMALIZED", False),
+        "delta_depth": get_bool_env("DB_DELTA_DEPTH", False),
+        "keyframe_interval": int(os.environ.get("DB_KEYFRAME_INTERVAL", 600)),
+        "depth_layout": os.environ.get("DB_DEPTH_LAYOUT", "rows"),
+        "depth_dtype": os.environ.get("DB_DEPTH_DTYPE", "f8"),
+        "depth_compress": get_bool_env("DB_DEPTH_COMPRESS", False),
+        "partition": os.environ.get("POSTGRES_PARTITION") or None,
+        "partition_premake": int(os.environ.get("POSTGRES_PARTITION_PREMAKE", 3)),
+        "retention_days": int(os.environ.get("POSTGRES_RETENTION_DAYS", 0)),
     }
     return PsqlManager(**db_config)
 
 
-def get_sqlite():
+def get_sqlite(read_only=False):
     db_config = {
         "file": os.environ.get("SQLITE_DB_FILE", "history.db"),
         "path": os.environ.get("SQLITE_DB_PATH", "data/sqlite_data"),
+        "bulk_insert": get_bool_env("DB_BULK_INSERT", True),
+        "normalized": get_bool_env("DB_NORMALIZED", False),
+        "delta_depth": get_bool_env("DB_DELTA_DEPTH", False),
+        "keyframe_interval": int(os.environ.get("DB_KEYFRAME_INTERVAL", 600)),
+        "depth_layout": os.environ.get("DB_DEPTH_LAYOUT", "rows"),
+        "depth_dtype": os.environ.get("DB_DEPTH_DTYPE", "f8"),
+        "depth_compress": get_bool_env("DB_DEPTH_COMPRESS", False),
+        "wal": get_bool_env("SQLITE_WAL", True),
+        "cache_size": int(os.environ.get("SQLITE_CACHE_SIZE", 64 * 1024)),
+        "mmap_size": int(os.environ.get("SQLITE_MMAP_SIZE", 256 * 1024 * 1024)),
+        "checkpoint_interval": int(os.environ.get("SQLITE_CHECKPOINT_INTERVAL", 30)),
+        "read_only": read_only,
     }
     return SqliteManager(**db_config)
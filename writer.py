@@ -0,0 +1,124 @@
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+
+class WriteBehindQueue:
+    """Decouple the pollers from the database.
+
+        Records are put on a bounded asyncio.Queue and drained in batches,
+        by size or by time, on a dedicated writer thread. A slow commit then
+        never blocks the event loop, and a full queue pushes back on the
+        pollers instead of growing without limit.
+    """
+    max_size = 10000
+    batch_size = 700
+    flush_interval = 2  # In seconds
+    log_interval = 60  # In seconds
+
+    def __init__(self, db, max_size=None, batch_size=None, flush_interval=None) -> None:
+        self.db = db
+        if max_size:
+            self.max_size = max_size
+        if batch_size:
+            self.batch_size = batch_size
+        if flush_interval:
+            self.flush_interval = flush_interval
+
+        self.queue = asyncio.Queue(maxsize=self.max_size)
+        self.batch_ready = asyncio.Event()
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='db-writer')
+        self.task = None
+        # Records taken from the queue but not yet handed to the writer thread
+        self.pending = []
+        self.last_log = time.time()
+
+        self.stats = {
+            'enqueued': 0,
+            'written': 0,
+            'failed': 0,
+            'batches': 0,
+            'max_depth': 0,
+            'blocked_puts': 0,
+            'blocked_time': 0.0,
+            'last_write_time': 0.0,
+        }
+
+    def start(self):
+        self.task = asyncio.ensure_future(self.drain_forever())
+
+    async def put(self, record):
+        if self.queue.full():
+            self.stats['blocked_puts'] += 1
+            start = time.time()
+            await self.queue.put(record)
+            self.stats['blocked_time'] += time.time() - start
+        else:
+            self.queue.put_nowait(record)
+
+        self.stats['enqueued'] += 1
+        depth = self.queue.qsize()
+        self.stats['max_depth'] = max(self.stats['max_depth'], depth)
+        if depth >= self.batch_size:
+            self.batch_ready.set()
+
+    async def drain_forever(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            self.pending.append(await self.queue.get())
+            try:
+                await asyncio.wait_for(self.batch_ready.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self.batch_ready.clear()
+
+            while len(self.pending) < self.batch_size and not self.queue.empty():
+                self.pending.append(self.queue.get_nowait())
+            batch = self.pending
+            self.pending = []
+            await loop.run_in_executor(self.executor, self.write_batch, batch)
+
+            if time.time() - self.last_log > self.log_interval:
+                self.log_stats()
+
+    def write_batch(self, records):
+        start = time.time()
+        try:
+            self.db.insert_records(records=records)
+        except Exception as e:
+            print("Cannot write {} records: {}".format(len(records), e))
+            self.stats['failed'] += len(records)
+            return
+        self.stats['written'] += len(records)
+        self.stats['batches'] += 1
+        self.stats['last_write_time'] = time.time() - start
+
+    async def close(self):
+        """Stop draining and flush everything still buffered, waiting for
+            the writer thread to finish.
+        """
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+
+        batch = self.pending
+        self.pending = []
+        while not self.queue.empty():
+            batch.append(self.queue.get_nowait())
+        for i in range(0, len(batch), self.batch_size):
+            self.executor.submit(self.write_batch, batch[i:i + self.batch_size])
+        # The single worker runs the in-flight write first, then the flush
+        self.executor.shutdown(wait=True)
+        self.log_stats()
+
+    def log_stats(self):
+        self.last_log = time.time()
+        s = self.stats
+        print("Writer: depth[{}/{}] max[{}] enqueued[{}] written[{}] failed[{}] batches[{}] "
+              "blocked[{} puts, {:.2f}s] last_write[{:.3f}s]".format(
+            self.queue.qsize(), self.max_size, s['max_depth'], s['enqueued'], s['written'], s['failed'],
+            s['batches'], s['blocked_puts'], s['blocked_time'], s['last_write_time'],
+        ))